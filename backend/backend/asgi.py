@@ -10,14 +10,15 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 import chat.routing
+from core.channels_auth import TokenCookieAuthMiddleware
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    # The auth_token cookie first, then the Django session
+    "websocket": TokenCookieAuthMiddleware(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
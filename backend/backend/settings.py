@@ -57,6 +57,63 @@ CHANNEL_LAYERS = {
     }
 }
 
+# To run several Daphne workers on one host, start `manage.py channel_broker`
+# and point every worker at its socket; groups are then shared between them.
+CHANNEL_BROKER_SOCKET = os.environ.get("CHANNEL_BROKER_SOCKET")
+if CHANNEL_BROKER_SOCKET:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.LocalBrokerChannelLayer",
+            "CONFIG": {
+                "path": CHANNEL_BROKER_SOCKET,
+            },
+        }
+    }
+
+# Group commit for WebSocket chat messages: messages arriving within
+# FLUSH_INTERVAL seconds (or MAX_BATCH of them) share one bulk insert.
+CHAT_GROUP_COMMIT = {
+    "ENABLED": False,
+    "FLUSH_INTERVAL": 0.005,
+    "MAX_BATCH": 100,
+}
+
+# Sockets stay online for TTL seconds after their last frame. Presence changes
+# reach friends in batches every BROADCAST_INTERVAL seconds, and a user only
+# goes offline OFFLINE_GRACE seconds after their last socket closes.
+CHAT_PRESENCE = {
+    "TTL": 60,
+    "BROADCAST_INTERVAL": 1.0,
+    "OFFLINE_GRACE": 10,
+}
+
+# Typing frames are forwarded at most once per WINDOW seconds per pair, and a
+# repeated "start" only every REFRESH seconds.
+CHAT_TYPING = {
+    "WINDOW": 0.25,
+    "REFRESH": 3.0,
+}
+
+# Each socket buffers at most MAX_QUEUE outbound frames. POLICY says what
+# gives when a slow client fills it: drop_ephemeral, coalesce or close.
+CHAT_OUTBOUND = {
+    "MAX_QUEUE": 256,
+    "POLICY": "drop_ephemeral",
+}
+
+# Messages older than MIN_AGE_DAYS are moved into compressed per-conversation
+# segment files under DIRECTORY by `manage.py archive_messages`.
+CHAT_ARCHIVE = {
+    "DIRECTORY": os.path.join(BASE_DIR, "archive"),
+    "MIN_AGE_DAYS": 90,
+}
+
+# Unread notifications absorb same-type events from the same user for
+# WINDOW seconds after they are created ("Alice sent you 12 messages").
+NOTIFICATION_COALESCING = {
+    "WINDOW": 300,
+}
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -100,6 +157,28 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
 }
+# Token -> user lookups cached in each process for TTL seconds, so most
+# API requests skip the auth query. See core/token_cache.py.
+AUTH_TOKEN_CACHE = {
+    "ENABLED": True,
+    "MAX_SIZE": 10000,
+    "TTL": 60,
+}
+# Login and signup hash passwords in this many worker processes; beyond
+# MAX_PENDING queued or running hashes they answer 503. See core/hashing.py.
+PASSWORD_HASHING_POOL = {
+    "WORKERS": 2,
+    "MAX_PENDING": 32,
+}
+# Per-user token buckets for sending: RATE per second refills up to BURST.
+# Shared by the WebSocket and REST paths. See core/ratelimit.py.
+RATE_LIMITS = {
+    "ENABLED": True,
+    "ACTIONS": {
+        "send_message": {"RATE": 10, "BURST": 30},
+        "typing": {"RATE": 1, "BURST": 10},
+    },
+}
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
 ]
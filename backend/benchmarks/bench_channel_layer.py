@@ -0,0 +1,138 @@
+"""
+Fan-out latency and throughput of group_send: InMemoryChannelLayer vs the
+LocalBrokerChannelLayer shared by several worker processes.
+
+The in-memory run keeps every receiver in one process, which is the best
+the old setup can do. The broker run starts ``manage.py channel_broker``'s
+broker in a subprocess and spreads the receivers over ``--workers``
+processes, each with its own layer instance, like Daphne workers would.
+Latency is measured from just before group_send to receive() returning;
+by default every message is sent in one burst, so it includes queueing.
+Pass ``--interval`` to measure latency at a steady rate instead.
+
+    python -m benchmarks.bench_channel_layer --workers 4 --channels 25 --messages 500
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from .utils import percentile, timer
+
+GROUP = "bench"
+
+
+async def receive_all(layer, channels, messages):
+    latencies = []
+
+    async def drain(channel):
+        for i in range(messages):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message["sent_at"])
+
+    await asyncio.gather(*(drain(channel) for channel in channels))
+    return latencies
+
+
+async def send_all(layer, messages, interval):
+    for i in range(messages):
+        await layer.group_send(GROUP, {"type": "bench.message", "n": i, "sent_at": time.time()})
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def send_and_close(layer, messages, interval):
+    await send_all(layer, messages, interval)
+    await layer.close()
+
+
+async def run_in_memory(receivers, messages, interval):
+    from channels.layers import InMemoryChannelLayer
+
+    layer = InMemoryChannelLayer(capacity=messages)
+    channels = [await layer.new_channel() for i in range(receivers)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    receiving = asyncio.ensure_future(receive_all(layer, channels, messages))
+    await send_all(layer, messages, interval)
+    return await receiving
+
+
+def broker_process(path):
+    from chat.broker import run
+
+    run(path, max_buffer=64 * 1024 * 1024)
+
+
+def worker_process(path, channel_count, messages, ready, results):
+    from chat.layers import LocalBrokerChannelLayer
+
+    async def main():
+        layer = LocalBrokerChannelLayer(path, capacity=messages)
+        channels = [await layer.new_channel() for i in range(channel_count)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.put(True)
+        return await receive_all(layer, channels, messages)
+
+    results.put(asyncio.run(main()))
+
+
+def run_broker(workers, channels_per_worker, messages, interval):
+    from chat.layers import LocalBrokerChannelLayer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "broker.sock")
+        broker = multiprocessing.Process(target=broker_process, args=(path,), daemon=True)
+        broker.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker_process, args=(path, channels_per_worker, messages, ready, results))
+            for i in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            ready.get(timeout=30)
+
+        with timer() as elapsed:
+            asyncio.run(send_and_close(LocalBrokerChannelLayer(path), messages, interval))
+            latencies = [sample for proc in procs for sample in results.get(timeout=120)]
+        for proc in procs:
+            proc.join()
+        broker.terminate()
+        broker.join()
+    return latencies, elapsed["seconds"]
+
+
+def report(label, latencies, seconds):
+    print(f"  {label:<14} {len(latencies) / seconds:10.0f} deliveries/s   "
+          f"p50 {percentile(latencies, 0.5) * 1000:7.2f} ms   p99 {percentile(latencies, 0.99) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="receiving processes for the broker run")
+    parser.add_argument("--channels", type=int, default=25, help="group members per worker")
+    parser.add_argument("--messages", type=int, default=500, help="group_send calls")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between group_send calls")
+    args = parser.parse_args()
+
+    receivers = args.workers * args.channels
+    print(f"{args.messages} group_sends to {receivers} channels ({receivers * args.messages} deliveries)")
+
+    with timer() as elapsed:
+        latencies = asyncio.run(run_in_memory(receivers, args.messages, args.interval))
+    report("in-memory", latencies, elapsed["seconds"])
+
+    latencies, seconds = run_broker(args.workers, args.channels, args.messages, args.interval)
+    report(f"broker x{args.workers}", latencies, seconds)
+
+
+if __name__ == "__main__":
+    main()
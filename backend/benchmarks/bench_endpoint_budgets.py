@@ -0,0 +1,104 @@
+"""
+Query counts and latency of every REST and web endpoint as fan-out grows.
+
+Seeds the user from chat/tests/test_query_budgets.py at each ``--scales``
+multiple of its friends, pending requests, messages and notifications,
+then requests every entry in its ENDPOINTS table ``--runs`` times (writes
+are rolled back after each run). A query count that grows with the scale
+is an N+1. Entries over their query or wall-clock budget at any scale are
+marked, their SQL is printed, and the script exits non-zero.
+``--output`` writes the results as JSON.
+
+    python -m benchmarks.bench_endpoint_budgets --scales 1,10 --runs 10 --output budgets.json
+"""
+import argparse
+import json
+import sys
+
+from .utils import percentile, setup_django, test_database
+
+
+def measure(spec, data, runs):
+    from django.db import reset_queries, transaction
+    from chat.tests.test_query_budgets import client_for, request_endpoint
+
+    samples, queries, status = [], None, 0
+    for i in range(runs):
+        client = client_for(spec, data)
+        # CaptureQueriesContext miscounts once the query log wraps around
+        reset_queries()
+        with transaction.atomic():
+            response, captured, seconds = request_endpoint(client, spec, data)
+            transaction.set_rollback(True)
+        samples.append(seconds)
+        status = max(status, response.status_code)
+        if queries is None:
+            queries = captured
+    return {
+        "path": spec["path"](data), "status": status, "queries": queries,
+        "p50": percentile(samples, 0.5), "max": max(samples),
+    }
+
+
+def run_scale(scale, runs):
+    from chat.tests.test_query_budgets import ENDPOINTS, seed_fanout
+
+    with test_database():
+        data = seed_fanout(friends=30 * scale, pending=10 * scale, messages=60 * scale, notifications=40 * scale)
+        return [measure(spec, data, runs) for spec in ENDPOINTS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1,10", help="comma-separated fan-out multipliers")
+    parser.add_argument("--runs", type=int, default=10, help="requests per endpoint at each scale")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+    scales = [int(s) for s in args.scales.split(",")]
+
+    setup_django()
+    from django.test import override_settings
+    from django.test.utils import setup_test_environment
+    from chat.tests.test_query_budgets import ENDPOINTS, describe_queries
+
+    setup_test_environment()
+    by_scale = {}
+    # Repeated sends would otherwise be throttled
+    with override_settings(RATE_LIMITS={"ENABLED": False}):
+        for scale in scales:
+            by_scale[scale] = run_scale(scale, args.runs)
+
+    print(f"{'endpoint':52s} {'budget':>6s} " + " ".join(f"{'x' + str(s) + ' q':>6s} {'p50 ms':>7s}" for s in scales))
+    results, offenders = [], []
+    for index, spec in enumerate(ENDPOINTS):
+        measured = [by_scale[scale][index] for scale in scales]
+        label = f"{spec['method'].upper()} {measured[-1]['path']}"
+        counts = [len(m["queries"]) for m in measured]
+        over = any(count > spec["queries"] or m["p50"] > spec["seconds"] or m["status"] >= 400 for count, m in zip(counts, measured))
+        flags = ("  OVER" if over else "") + ("  grows" if counts[-1] > counts[0] else "")
+        print(f"{label:52s} {spec['queries']:6d} "
+              + " ".join(f"{count:6d} {m['p50'] * 1000:7.1f}" for count, m in zip(counts, measured)) + flags)
+        if over:
+            offenders.append((label, measured[-1]))
+        results.append({
+            "name": spec["name"], "method": spec["method"], "path": measured[-1]["path"],
+            "budget": {"queries": spec["queries"], "seconds": spec["seconds"]},
+            "scales": {
+                str(scale): {"status": m["status"], "queries": count, "p50_ms": round(m["p50"] * 1000, 3), "max_ms": round(m["max"] * 1000, 3)}
+                for scale, count, m in zip(scales, counts, measured)
+            },
+        })
+
+    for label, measured in offenders:
+        print(f"\n{label}: {len(measured['queries'])} queries, status {measured['status']} at x{scales[-1]}")
+        print(describe_queries(measured["queries"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scales": scales, "runs": args.runs, "endpoints": results}, f, indent=2, sort_keys=True)
+        print(f"results written to {args.output}")
+    if offenders:
+        sys.exit(f"{len(offenders)} endpoint(s) over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Messages/sec through ChatConsumer's persistence step, per-message vs group commit.
+
+Every simulated sender awaits each write before sending the next message,
+the same as a WebSocket consumer does. On the default in-memory SQLite
+database there are no network round-trips, so the gap mostly reflects
+fewer transactions and statements; point DJANGO_SETTINGS_MODULE at a
+PostgreSQL settings module to include the round-trips group commit saves.
+
+    python -m benchmarks.bench_group_commit --senders 50 --messages 40
+"""
+import argparse
+import asyncio
+
+from .utils import create_users, setup_django, test_database, timer
+
+
+async def run_per_message(pairs, messages_per_sender):
+    from channels.db import database_sync_to_async
+    from chat.group_commit import write_messages
+
+    save = database_sync_to_async(write_messages)
+
+    async def sender(sender_id, receiver_id):
+        for i in range(messages_per_sender):
+            await save([(sender_id, receiver_id, f"message {i}")])
+
+    await asyncio.gather(*(sender(s, r) for s, r in pairs))
+
+
+async def run_group_commit(pairs, messages_per_sender, flush_interval, max_batch):
+    from chat.group_commit import MessageWriteBuffer
+
+    buffer = MessageWriteBuffer(flush_interval, max_batch)
+
+    async def sender(sender_id, receiver_id):
+        for i in range(messages_per_sender):
+            await buffer.submit(sender_id, receiver_id, f"message {i}")
+
+    await asyncio.gather(*(sender(s, r) for s, r in pairs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=40, help="messages per sender")
+    parser.add_argument("--flush-interval", type=float, default=0.005)
+    parser.add_argument("--max-batch", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        users = create_users(args.senders * 2)
+        pairs = [(users[2 * i].id, users[2 * i + 1].id) for i in range(args.senders)]
+        total = args.senders * args.messages
+
+        with timer() as baseline:
+            asyncio.run(run_per_message(pairs, args.messages))
+        with timer() as grouped:
+            asyncio.run(run_group_commit(pairs, args.messages, args.flush_interval, args.max_batch))
+
+    print(f"{total} messages from {args.senders} concurrent senders")
+    print(f"  per-message:  {total / baseline['seconds']:10.0f} msg/s")
+    print(f"  group commit: {total / grouped['seconds']:10.0f} msg/s "
+          f"(interval={args.flush_interval}s, max_batch={args.max_batch})")
+
+
+if __name__ == "__main__":
+    main()
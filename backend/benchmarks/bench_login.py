@@ -0,0 +1,147 @@
+"""
+Login throughput and latency under a concurrent burst, inline vs pooled hashing.
+
+Requests go straight into Django's ASGI handler, as a server would send
+them. ``inline`` serves /api/login/ from a sync view that calls
+authenticate(), the way the API used to; ``pool`` uses the current async
+view, which hashes in core.hashing's process pool. A bystander keeps
+polling a cheap authenticated endpoint throughout, showing how much the
+burst delays everyone else. With more clients than MAX_PENDING the pool
+sheds load with 503s, which are counted separately.
+
+    python -m benchmarks.bench_login --clients 20 --logins 3
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import types
+
+from .utils import create_users, percentile, setup_django, test_database, timer
+
+PASSWORD = "bench-password"
+
+
+def inline_urlconf():
+    """A urlconf serving /api/login/ from a sync view that hashes inline."""
+    from django.contrib.auth import authenticate
+    from django.http import JsonResponse
+    from django.urls import include, path
+    from django.views.decorators.csrf import csrf_exempt
+    from rest_framework.authtoken.models import Token
+
+    @csrf_exempt
+    def inline_login(request):
+        data = json.loads(request.body)
+        user = authenticate(request, email=data["email"], password=data["password"])
+        if user is None:
+            return JsonResponse({"non_field_errors": ["Unable to log in with provided credentials."]}, status=400)
+        token, created = Token.objects.get_or_create(user=user)
+        return JsonResponse({"token": token.key, "user_id": user.pk, "email": user.email})
+
+    module = types.ModuleType("benchmarks._inline_login_urls")
+    module.urlpatterns = [path("api/login/", inline_login), path("", include("backend.urls"))]
+    sys.modules[module.__name__] = module
+    return module.__name__
+
+
+async def request(app, method, path, body=b"", headers=()):
+    """Send one HTTP request through ``app``; returns the response status."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"), *headers],
+        "client": ("127.0.0.1", 40000), "server": ("localhost", 80),
+    }
+    sent = False
+    status = {}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status["code"]
+
+
+async def burst(app, emails, logins_per_client, bystander_headers):
+    login_samples, statuses, bystander_samples = [], {}, []
+    done = asyncio.Event()
+
+    async def client(email):
+        body = json.dumps({"email": email, "password": PASSWORD}).encode()
+        for i in range(logins_per_client):
+            start = time.perf_counter()
+            status = await request(app, "POST", "/api/login/", body)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                login_samples.append(time.perf_counter() - start)
+
+    async def bystander():
+        while not done.is_set():
+            start = time.perf_counter()
+            await request(app, "GET", "/api/notifications/unread_count/", headers=bystander_headers)
+            bystander_samples.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    watcher = asyncio.ensure_future(bystander())
+    with timer() as elapsed:
+        await asyncio.gather(*(client(email) for email in emails))
+    done.set()
+    await watcher
+    return elapsed["seconds"], login_samples, statuses, bystander_samples
+
+
+async def warm_up(workers):
+    """Start the pool's worker processes before timing anything."""
+    from core.hashing import amake_password
+
+    await asyncio.gather(*(amake_password("warm-up") for i in range(workers)))
+
+
+def report(label, seconds, login_samples, statuses, bystander_samples):
+    print(f"  {label:<7} {len(login_samples) / seconds:7.1f} logins/s   "
+          f"login p50 {percentile(login_samples, 0.5) * 1000:7.0f} ms  p99 {percentile(login_samples, 0.99) * 1000:7.0f} ms   "
+          f"bystander p50 {percentile(bystander_samples, 0.5) * 1000:6.1f} ms  p99 {percentile(bystander_samples, 0.99) * 1000:6.1f} ms   "
+          f"statuses {dict(sorted(statuses.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients logging in")
+    parser.add_argument("--logins", type=int, default=3, help="logins per client")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.hashers import make_password
+    from django.core.handlers.asgi import ASGIHandler
+    from django.test import override_settings
+    from rest_framework.authtoken.models import Token
+    from core.hashing import get_hashing_pool
+
+    with test_database():
+        users = create_users(args.clients + 1)
+        type(users[0]).objects.update(password=make_password(PASSWORD))
+        bystander_token = Token.objects.create(user=users[-1])
+        bystander_headers = [(b"authorization", f"Token {bystander_token.key}".encode())]
+        emails = [user.email for user in users[:-1]]
+        app = ASGIHandler()
+        asyncio.run(warm_up(get_hashing_pool().workers))
+
+        print(f"{args.clients} clients x {args.logins} logins, hashing pool of {get_hashing_pool().workers}")
+        with override_settings(ROOT_URLCONF=inline_urlconf()):
+            report("inline", *asyncio.run(burst(app, emails, args.logins, bystander_headers)))
+        report("pool", *asyncio.run(burst(app, emails, args.logins, bystander_headers)))
+        get_hashing_pool().shutdown()
+
+
+if __name__ == "__main__":
+    main()
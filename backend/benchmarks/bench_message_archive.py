@@ -0,0 +1,110 @@
+"""
+Hot message table size and history page latency, before and after archiving.
+
+Seeds conversations whose oldest messages are past CHAT_ARCHIVE's age
+limit, then times the newest page and a deep page (well into the old
+history) of random conversations through ``fetch_message_rows``, the
+MessageViewSet.list path, before and after ``archive_messages``. Table
+size is the message table plus its indexes, as the database reports it.
+
+    python -m benchmarks.bench_message_archive --conversations 200 --messages 500 --old 0.9
+"""
+import argparse
+import datetime
+import random
+import tempfile
+
+from .utils import create_users, percentile, setup_django, test_database, timer
+
+
+def seed(users, messages_per_conversation, old_fraction):
+    from django.utils import timezone
+    from chat.models import Conversation, Message
+
+    pairs = [(users[2 * i], users[2 * i + 1]) for i in range(len(users) // 2)]
+    # Round-robin, so every conversation's history spans the whole id range
+    Message.objects.bulk_create(
+        [
+            Message(sender=a if i % 2 else b, receiver=b if i % 2 else a, content=f"message {i} " + "x" * 80)
+            for i in range(messages_per_conversation)
+            for a, b in pairs
+        ],
+        batch_size=5000,
+    )
+    ids = list(Message.objects.order_by("id").values_list("id", flat=True))
+    cutoff_id = ids[int(len(ids) * old_fraction) - 1]
+    Message.objects.filter(id__lte=cutoff_id).update(timestamp=timezone.now() - datetime.timedelta(days=365))
+    for a, b in pairs:
+        Conversation.objects.record_messages(list(Message.objects.filter(sender=a, receiver=b).order_by("-id")[:1]))
+    return [(a.id, b.id) for a, b in pairs]
+
+
+def table_size():
+    from django.db import connection
+    from chat.models import Message
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'chat_message' OR name LIKE 'chat_msg%' "
+                           "OR name LIKE 'sqlite_autoindex_chat_message%' OR name LIKE 'chat_message_%'")
+        else:
+            cursor.execute("SELECT pg_total_relation_size('chat_message')")
+        size = cursor.fetchone()[0] or 0
+    return Message.objects.count(), size
+
+
+def measure(pairs, samples, rng):
+    from chat.history import fetch_message_rows
+    from chat.models import Conversation
+
+    newest, deep = [], []
+    for i in range(samples):
+        user_id, other_id = rng.choice(pairs)
+        watermarks, archived_up_to_id = Conversation.objects.page_state(user_id, other_id)
+        with timer() as elapsed:
+            rows = fetch_message_rows(user_id, other_id, limit=50, archived_up_to_id=archived_up_to_id)
+        newest.append(elapsed["seconds"])
+        # A page from the first tenth of the history
+        before_id = rows[0]["id"] - (rows[-1]["id"] - rows[0]["id"]) * 8 if rows else None
+        watermarks, archived_up_to_id = Conversation.objects.page_state(user_id, other_id)
+        with timer() as elapsed:
+            fetch_message_rows(user_id, other_id, before_id=before_id, limit=50, archived_up_to_id=archived_up_to_id)
+        deep.append(elapsed["seconds"])
+    return newest, deep
+
+
+def report(label, size, newest, deep):
+    rows, size_bytes = size
+    print(f"  {label:<7} {rows:9d} hot rows  {size_bytes / 1e6:8.1f} MB   "
+          f"newest page p50 {percentile(newest, 0.5) * 1000:6.2f} ms  p99 {percentile(newest, 0.99) * 1000:6.2f} ms   "
+          f"deep page p50 {percentile(deep, 0.5) * 1000:6.2f} ms  p99 {percentile(deep, 0.99) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500, help="messages per conversation")
+    parser.add_argument("--old", type=float, default=0.9, help="fraction of messages past the age limit")
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import override_settings
+    from chat.archive import archive_messages
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory, override_settings(CHAT_ARCHIVE={"DIRECTORY": directory, "MIN_AGE_DAYS": 90}):
+        with test_database():
+            pairs = seed(create_users(args.conversations * 2), args.messages, args.old)
+            print(f"{args.conversations} conversations x {args.messages} messages, {args.old:.0%} past the age limit")
+            report("before", table_size(), *measure(pairs, args.samples, rng))
+
+            with timer() as elapsed:
+                conversations, archived = archive_messages()
+            print(f"  archived {archived} messages from {conversations} conversations in {elapsed['seconds']:.1f}s")
+            report("after", table_size(), *measure(pairs, args.samples, rng))
+
+
+if __name__ == "__main__":
+    main()
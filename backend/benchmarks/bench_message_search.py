@@ -0,0 +1,120 @@
+"""
+Message search latency: an icontains scan of the user's messages vs the inverted index.
+
+For each table size the message table is seeded with random sentences
+of Zipf-distributed words across many conversations and the index is
+rebuilt. Then the same queries (one or two words from real messages,
+some cut down to a prefix, some just three letters) run through both
+paths for random users. The scan grows with the user's history; the
+index lookup reads at most ``chat.search``'s MAX_CANDIDATES postings
+however common the words are.
+
+    python -m benchmarks.bench_message_search --users 200 --sizes 50000,200000 --queries 200
+"""
+import argparse
+import random
+
+from .utils import create_users, percentile, setup_django, test_database, timer
+
+SYLLABLES = ["al", "an", "ar", "be", "ca", "da", "el", "fa", "go", "ha", "is", "jo", "ka", "li", "ma",
+             "ne", "or", "pa", "qu", "ri", "sa", "ta", "ul", "va", "wi", "xe", "ya", "zo"]
+
+
+def vocabulary(size, rng):
+    """Random words with Zipf-like frequencies, like the words of real chat."""
+    words = sorted({"".join(rng.choice(SYLLABLES) for i in range(rng.randint(2, 4))) for i in range(size)})
+    rng.shuffle(words)
+    return words, [1 / rank for rank in range(1, len(words) + 1)]
+
+
+def sentence(rng, words, weights):
+    return " ".join(rng.choices(words, weights, k=rng.randint(4, 12)))
+
+
+def seed_messages(users, count, rng, words, weights):
+    from chat.models import Message
+
+    Message.objects.bulk_create(
+        [Message(sender=sender, receiver=receiver, content=sentence(rng, words, weights))
+         for sender, receiver in (rng.sample(users, 2) for i in range(count))],
+        batch_size=5000,
+    )
+
+
+def make_queries(count, rng):
+    from chat.models import Message
+
+    sample = list(Message.objects.order_by("?").values_list("sender_id", "content")[:count])
+    queries = []
+    for user_id, content in sample:
+        words = content.split()
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append((user_id, rng.choice(words)))
+        elif kind < 0.6:
+            # A word as it's being typed, which matches many others
+            queries.append((user_id, rng.choice(words)[:3]))
+        else:
+            first, second = rng.sample(words, 2)
+            queries.append((user_id, f"{first} {second[:rng.randint(3, len(second))]}"))
+    return queries
+
+
+def scan(user_id, query):
+    from django.db.models import Q
+    from chat.models import Message
+
+    messages = Message.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+    for term in query.split():
+        messages = messages.filter(content__icontains=term)
+    return list(messages.order_by("-id")[:20])
+
+
+def indexed(user_id, query):
+    from chat.search import search_messages
+
+    return search_messages(user_id, query)[0]
+
+
+def measure(fn, queries):
+    samples = []
+    for user_id, query in queries:
+        with timer() as elapsed:
+            fn(user_id, query)
+        samples.append(elapsed["seconds"])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sizes", default="50000,200000", help="comma-separated message table sizes")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="distinct words messages are made of")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from chat.search import rebuild_index
+
+    rng = random.Random(args.seed)
+    with test_database():
+        users = create_users(args.users)
+        words, weights = vocabulary(args.vocabulary, rng)
+        seeded = 0
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            seed_messages(users, size - seeded, rng, words, weights)
+            seeded = size
+            with timer() as elapsed:
+                rebuild_index(batch_size=5000)
+            queries = make_queries(args.queries, rng)
+
+            print(f"{size} messages between {args.users} users, index rebuilt in {elapsed['seconds']:.1f}s, {len(queries)} queries")
+            for label, fn in (("icontains", scan), ("inverted index", indexed)):
+                samples = measure(fn, queries)
+                print(f"  {label:<15} mean {sum(samples) / len(samples) * 1000:8.2f} ms   "
+                      f"p50 {percentile(samples, 0.5) * 1000:8.2f} ms   p99 {percentile(samples, 0.99) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
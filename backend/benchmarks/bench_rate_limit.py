@@ -0,0 +1,71 @@
+"""
+Per-check overhead of the send-path rate limiter.
+
+Times ``RateLimiter.check`` directly and through ``check_rate`` (which
+also reads RATE_LIMITS), over many users so most checks touch a different
+bucket. Then several threads check at once, with one shard and with the
+configured number, to show what sharding the locks saves under
+contention. No database is involved.
+
+    python -m benchmarks.bench_rate_limit --checks 200000 --users 10000 --threads 8
+"""
+import argparse
+import random
+import threading
+
+from .utils import setup_django, timer
+
+
+def single_thread(check, keys):
+    with timer() as elapsed:
+        for user_id in keys:
+            check(user_id, "send_message")
+    return elapsed["seconds"] / len(keys)
+
+
+def threaded(limiter, keys, threads):
+    chunks = [keys[i::threads] for i in range(threads)]
+    start = threading.Barrier(threads + 1)
+
+    def worker(chunk):
+        start.wait()
+        for user_id in chunk:
+            limiter.check(user_id, "send_message")
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for thread in workers:
+        thread.start()
+    with timer() as elapsed:
+        start.wait()
+        for thread in workers:
+            thread.join()
+    return elapsed["seconds"] / len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from core.ratelimit import RateLimiter, check_rate, get_config
+
+    config = get_config()
+    rng = random.Random(args.seed)
+    keys = [rng.randrange(args.users) for i in range(args.checks)]
+
+    print(f"{args.checks} checks over {args.users} users")
+    limiter = RateLimiter(config["ACTIONS"], config["SHARDS"])
+    print(f"  RateLimiter.check          {single_thread(limiter.check, keys) * 1e6:6.2f} us/check")
+    print(f"  check_rate (with settings) {single_thread(check_rate, keys) * 1e6:6.2f} us/check")
+    for shards in (1, config["SHARDS"]):
+        limiter = RateLimiter(config["ACTIONS"], shards)
+        per_check = threaded(limiter, keys, args.threads)
+        print(f"  {args.threads} threads, {shards:2d} shard(s)    {per_check * 1e6:6.2f} us/check")
+
+
+if __name__ == "__main__":
+    main()
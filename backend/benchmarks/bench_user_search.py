@@ -0,0 +1,111 @@
+"""
+User search latency: the old icontains scan vs the token prefix index.
+
+For each table size the user table is seeded with random names, the index
+is rebuilt, and the same typeahead-style queries (2-5 letter prefixes of
+real names, a full email, and terms nearly every user matches) run
+through both paths. The scan grows
+with the table; the index lookup reads at most ``core.search``'s
+MAX_CANDIDATES rows for a term, however common.
+
+    python -m benchmarks.bench_user_search --sizes 10000,100000 --queries 200
+"""
+import argparse
+import random
+
+from .utils import percentile, setup_django, test_database, timer
+
+# Matched by a large share of the table: the worst case for the index
+COMMON_QUERIES = ["a", "al", "example", "example.com"]
+
+SYLLABLES = ["al", "an", "ar", "be", "ca", "da", "el", "fa", "go", "ha", "is", "jo", "ka", "li", "ma",
+             "ne", "or", "pa", "qu", "ri", "sa", "ta", "ul", "va", "wi", "xe", "ya", "zo"]
+
+
+def random_name(rng):
+    return "".join(rng.choice(SYLLABLES) for i in range(rng.randint(2, 4))).title()
+
+
+def seed_users(count, rng, start):
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    users = []
+    for i in range(start, start + count):
+        first, last = random_name(rng), random_name(rng)
+        users.append(User(email=f"{first}.{last}.{i}@example.com".lower(), first_name=first, last_name=last, password="!"))
+    User.objects.bulk_create(users, batch_size=2000)
+
+
+def make_queries(count, rng):
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    sample = list(User.objects.order_by("?").values_list("first_name", "last_name", "email")[:count])
+    queries = []
+    for first, last, email in sample:
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(first[:rng.randint(2, 5)])
+        elif kind < 0.8:
+            queries.append(f"{first} {last[:rng.randint(1, 3)]}")
+        else:
+            queries.append(email)
+    return queries + COMMON_QUERIES
+
+
+def scan(query):
+    from django.contrib.auth import get_user_model
+    from django.db.models import Q
+
+    User = get_user_model()
+    return list(User.objects.filter(
+        Q(email__icontains=query) | Q(first_name__icontains=query) | Q(last_name__icontains=query)
+    )[:20])
+
+
+def indexed(query):
+    from core.search import search_users
+
+    return search_users(query)[0]
+
+
+def measure(fn, queries):
+    samples = []
+    for query in queries:
+        with timer() as elapsed:
+            fn(query)
+        samples.append(elapsed["seconds"])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated user table sizes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    setup_django()
+    from core.search import rebuild_index
+
+    rng = random.Random(args.seed)
+    with test_database():
+        seeded = 0
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            seed_users(size - seeded, rng, seeded)
+            seeded = size
+            rebuild_index(batch_size=5000)
+            queries = make_queries(args.queries, rng)
+
+            print(f"{size} users, {len(queries)} queries")
+            for label, fn in (("icontains", scan), ("token index", indexed)):
+                samples = measure(fn, queries)
+                common = samples[-len(COMMON_QUERIES):]
+                print(f"  {label:<12} mean {sum(samples) / len(samples) * 1000:8.2f} ms   "
+                      f"p50 {percentile(samples, 0.5) * 1000:8.2f} ms   p99 {percentile(samples, 0.99) * 1000:8.2f} ms   "
+                      f"common terms max {max(common) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
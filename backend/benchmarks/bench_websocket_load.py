@@ -0,0 +1,156 @@
+"""
+End-to-end WebSocket load: many users chatting through the real ASGI app.
+
+Runs ``backend.asgi.application`` in-process, authenticates every
+simulated user with an auth_token cookie, and connects one
+``WebsocketCommunicator`` per user. Users are paired up and each sends
+``--messages`` messages to its partner, ``--interval`` seconds apart, all
+at once. Every socket reads, acknowledging each frame as a client must
+(see ``chat.outbound``), until it has seen its partner's messages and the
+echoes of its own.
+
+Reports delivered messages/sec and the p50/p95/p99 latency from send to
+the partner's socket receiving it. Memory per connection is the Python
+heap growth (tracemalloc) from opening the sockets, divided by their
+number. Uses the throwaway SQLite test database unless
+DJANGO_SETTINGS_MODULE points at a PostgreSQL settings module. Rate
+limits are turned off; this measures capacity, not abuse control.
+``--output`` writes the results as JSON for tracking regressions.
+
+    python -m benchmarks.bench_websocket_load --users 1000 --messages 5 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from .utils import create_users, percentile, setup_django, test_database, timer
+
+
+def make_tokens(users):
+    from rest_framework.authtoken.models import Token
+
+    Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users], batch_size=1000)
+    return dict(Token.objects.filter(user__in=users).values_list("user_id", "key"))
+
+
+async def connect_all(application, users, tokens, batch_size, timeout):
+    from channels.testing import WebsocketCommunicator
+
+    sockets = {}
+    for start in range(0, len(users), batch_size):
+        batch = users[start:start + batch_size]
+        communicators = [
+            WebsocketCommunicator(application, "/ws/chat/", headers=[(b"cookie", f"auth_token={tokens[user.id]}".encode())])
+            for user in batch
+        ]
+        results = await asyncio.gather(*(communicator.connect(timeout=timeout) for communicator in communicators))
+        for user, communicator, (connected, code) in zip(batch, communicators, results):
+            if not connected:
+                raise RuntimeError(f"socket for user {user.id} was refused ({code})")
+            sockets[user.id] = communicator
+    return sockets
+
+
+async def run_load(sockets, pairs, messages, interval, timeout):
+    latencies = []
+    errors = 0
+
+    async def send(socket, partner_id):
+        for i in range(messages):
+            await socket.send_json_to({"type": "message", "recipient_id": partner_id, "message": f"{time.perf_counter():.9f}"})
+            await asyncio.sleep(interval)
+
+    async def read(user_id, socket):
+        nonlocal errors
+        # The partner's messages plus echoes of our own
+        for i in range(2 * messages):
+            frame = await socket.receive_json_from(timeout=timeout)
+            await socket.send_json_to({"type": "ack", "received": i + 1})
+            if frame["type"] != "message":
+                errors += 1
+            elif frame["message"]["sender"]["id"] != user_id:
+                latencies.append(time.perf_counter() - float(frame["message"]["content"]))
+
+    tasks = []
+    for a, b in pairs:
+        tasks += [send(sockets[a], b), send(sockets[b], a), read(a, sockets[a]), read(b, sockets[b])]
+    with timer() as elapsed:
+        await asyncio.gather(*tasks)
+    return elapsed["seconds"], latencies, errors
+
+
+async def disconnect_all(sockets):
+    await asyncio.gather(*(socket.disconnect() for socket in sockets.values()))
+
+
+async def scenario(application, users, tokens, args):
+    pairs = [(users[2 * i].id, users[2 * i + 1].id) for i in range(len(users) // 2)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    with timer() as connecting:
+        sockets = await connect_all(application, users, tokens, args.connect_batch, args.timeout)
+    per_connection = (tracemalloc.get_traced_memory()[0] - before) / len(sockets)
+    tracemalloc.stop()
+
+    elapsed, latencies, errors = await run_load(sockets, pairs, args.messages, args.interval, args.timeout)
+    await disconnect_all(sockets)
+    return {
+        "connections": len(sockets),
+        "connect_seconds": round(connecting["seconds"], 3),
+        "memory_per_connection_bytes": round(per_connection),
+        "messages": len(pairs) * 2 * args.messages,
+        "delivered": len(latencies),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 3)
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="simulated users, one socket each (paired up)")
+    parser.add_argument("--messages", type=int, default=5, help="messages each user sends")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between one user's messages")
+    parser.add_argument("--group-commit", action="store_true", help="enable CHAT_GROUP_COMMIT for the run")
+    parser.add_argument("--connect-batch", type=int, default=200, help="sockets opened concurrently")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds a socket waits for its next frame")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from django.test import override_settings
+    from backend.asgi import application
+
+    group_commit = {**settings.CHAT_GROUP_COMMIT, "ENABLED": args.group_commit}
+    with test_database(), override_settings(RATE_LIMITS={"ENABLED": False}, CHAT_GROUP_COMMIT=group_commit):
+        users = create_users(args.users - args.users % 2)
+        tokens = make_tokens(users)
+        results = asyncio.run(scenario(application, users, tokens, args))
+        results["config"] = {
+            "users": len(users), "messages": args.messages, "interval": args.interval,
+            "group_commit": args.group_commit, "database": connection.vendor,
+        }
+
+    latency = results["latency_ms"]
+    print(f"{results['connections']} sockets ({results['config']['database']}, group commit {'on' if args.group_commit else 'off'}), "
+          f"connected in {results['connect_seconds']:.1f}s, {results['memory_per_connection_bytes'] / 1024:.1f} KiB each")
+    print(f"  {results['delivered']}/{results['messages']} delivered in {results['elapsed_seconds']:.1f}s "
+          f"= {results['messages_per_second']:.0f} msg/s, {results['errors']} errors")
+    print(f"  send-to-receive p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  p99 {latency['p99']:.1f} ms  max {latency['max']:.1f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"  results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Shared setup for the scripts in this package.
+
+Benchmarks run against a throwaway test database built from the current
+migrations, using ``backend.test_settings`` unless DJANGO_SETTINGS_MODULE
+says otherwise. Run them from the ``backend`` directory, e.g.::
+
+    python -m benchmarks.bench_group_commit
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.test_settings")
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create the test database for the duration of the block."""
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def create_users(count, prefix="bench"):
+    """Bulk-create ``count`` users without paying for password hashing."""
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    User.objects.bulk_create(
+        [
+            User(email=f"{prefix}{i}@example.com", first_name=f"First{i}", last_name=f"Last{i}", password="!")
+            for i in range(count)
+        ],
+        batch_size=1000,
+    )
+    return list(User.objects.filter(email__startswith=prefix).order_by("id"))
+
+
+@contextmanager
+def timer():
+    """Yield a dict whose ``seconds`` key is filled in when the block exits."""
+    result = {}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - start
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
@@ -1,20 +1,49 @@
-from rest_framework import viewsets, status, decorators
+from rest_framework import viewsets, mixins, status, decorators
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.db import transaction
 from django.db.models import Q
-from .models import Message
-from .serializers import MessageSerializer
+from .models import Conversation, Message
+from .outbound import connection_stats
+from .history import fetch_inbox_page, fetch_message_rows, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .renderers import FastJSONRenderer
+from .search import search_messages, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT, MAX_LIMIT as SEARCH_MAX_LIMIT
+from .serializers import ConversationSerializer, MarkReadSerializer, MessageSerializer, serialize_message_rows
 from django.contrib.auth import get_user_model
+from core.ratelimit import TokenBucketThrottle
 
 User = get_user_model()
 
-class MessageViewSet(viewsets.ModelViewSet):
+class CursorParamsMixin:
+    def _int_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None # Ignore invalid cursors
+
+    def _limit_param(self):
+        limit = self._int_param('limit') or DEFAULT_PAGE_SIZE
+        return max(1, min(limit, MAX_PAGE_SIZE))
+
+class MessageViewSet(CursorParamsMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
         user = self.request.user
-        return Message.objects.filter(Q(sender=user) | Q(receiver=user))
+        return Message.objects.filter(Q(sender=user) | Q(receiver=user)).select_related('sender', 'receiver')
+
+    def get_throttles(self):
+        # Shares the sender's bucket with ChatConsumer's message frames
+        if self.action == 'create':
+            return [TokenBucketThrottle('send_message')]
+        return super().get_throttles()
 
     def perform_create(self, serializer):
         serializer.save(sender=self.request.user)
@@ -23,23 +52,105 @@ class MessageViewSet(viewsets.ModelViewSet):
         user = request.user
         other_user_id = request.query_params.get('user_id')
         
-        if not other_user_id:
+        if not other_user_id or not other_user_id.isdigit():
             return Response({"detail": "user_id query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
             
-        messages = Message.objects.filter(
-            (Q(sender=user) & Q(receiver_id=other_user_id)) |
-            (Q(receiver=user) & Q(sender_id=other_user_id))
+        before_id = self._int_param('before_id')
+        after_id = self._int_param('after_id')
+        limit = self._limit_param()
+
+        # Plain rows instead of model instances and nested serializers; same output as MessageSerializer
+        watermarks, archived_up_to_id = Conversation.objects.page_state(user.id, other_user_id)
+        rows = fetch_message_rows(
+            user.id, other_user_id, before_id=before_id, after_id=after_id, limit=limit, archived_up_to_id=archived_up_to_id,
         )
-        
-        after_id = request.query_params.get('after_id')
-        if after_id:
-            try:
-                after_id = int(after_id)
-                messages = messages.filter(id__gt=after_id)
-            except ValueError:
-                pass # Ignore invalid after_id
-            
-        messages = messages.order_by('timestamp')
-        
-        serializer = self.get_serializer(messages, many=True)
+        return Response(serialize_message_rows(rows, watermarks))
+
+    @decorators.action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over the user's conversations.
+
+        GET /api/chat/messages/search/?q=<text>&offset=<n>&limit=<n>
+
+        Returns the best matches first, each tagged with its
+        ``conversation_key``, with ``next_offset`` set when there are more.
+        """
+        offset = max(0, self._int_param('offset') or 0)
+        limit = max(1, min(self._int_param('limit') or SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT))
+        rows, has_more = search_messages(request.user.id, request.query_params.get('q', ''), offset=offset, limit=limit)
+
+        pairs = [Conversation.pair(row['sender_id'], row['receiver_id']) for row in rows]
+        watermarks = Conversation.objects.read_watermarks_many(pairs)
+        results = []
+        for row, pair in zip(rows, pairs):
+            result = serialize_message_rows([row], watermarks[pair])[0]
+            result['conversation_key'] = Conversation.key(*pair)
+            results.append(result)
+        return Response({
+            'results': results,
+            'next_offset': offset + limit if has_more else None,
+        })
+
+class ConversationViewSet(CursorParamsMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    The user's inbox: conversations ordered by last activity.
+
+    GET /api/chat/inbox/?before_id=<last_message_id>&limit=<n>
+    """
+    serializer_class = ConversationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        return Conversation.objects.filter(Q(low_user=user) | Q(high_user=user))
+
+    def list(self, request, *args, **kwargs):
+        conversations = fetch_inbox_page(request.user.id, before_id=self._int_param('before_id'), limit=self._limit_param())
+        serializer = self.get_serializer(conversations, many=True)
         return Response(serializer.data)
+
+    @decorators.action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """
+        Advance several read watermarks in one call.
+
+        POST /api/chat/inbox/mark_read/
+        {"watermarks": [{"user_id": 2, "message_id": 120}, ...]}
+        """
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            updated = sum(
+                Conversation.objects.mark_read(request.user.id, item['user_id'], up_to_id=item['message_id'])
+                for item in serializer.validated_data['watermarks']
+            )
+        return Response({"updated": updated}, status=status.HTTP_200_OK)
+
+class ConnectionMetricsView(APIView):
+    """
+    Outbound queue depths of the sockets open in this worker process.
+
+    GET /api/chat/metrics/connections/?limit=<n>
+
+    Lists the deepest queues first, with totals over every connection.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = connection_stats()
+        try:
+            limit = max(1, int(request.query_params.get('limit', 50)))
+        except ValueError:
+            limit = 50
+        return Response({
+            'connections': stats[:limit],
+            'totals': {
+                'connections': len(stats),
+                'queued': sum(s['depth'] for s in stats),
+                'dropped': sum(s['dropped'] for s in stats),
+                'coalesced': sum(s['coalesced'] for s in stats),
+                'overflowed': sum(s['overflowed'] for s in stats),
+            },
+        })
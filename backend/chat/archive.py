@@ -0,0 +1,317 @@
+"""
+Cold storage for old chat messages.
+
+``archive_messages`` moves messages older than CHAT_ARCHIVE['MIN_AGE_DAYS']
+out of the message table into per-conversation segment files, so the hot
+table and its indexes stop growing with total history. Each run appends
+new segments; a written segment is never modified.
+
+A segment is a run of zlib-compressed blocks of messages in id order,
+followed by an index of the blocks' id ranges and offsets::
+
+    [block] ... [block] [index JSON] [index length: 8 bytes LE] [MAGIC]
+
+Readers memory-map the file and decompress only the blocks a page needs.
+Search postings (``chat.search``) stay in the table, so archived messages
+are still found and ``archived_messages`` reads the matches back by id.
+Overlapping runs are safe: a segment is only catalogued if the
+conversation's ``archived_up_to_id`` hasn't moved since its messages were
+read, otherwise its file is removed and the other run's segment stands.
+Only a prefix of each conversation is archived, never its last message,
+so archived ids are always below the ids still in the table and
+``history.fetch_message_rows`` can simply continue into the archive once
+it pages past the hot rows.
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ArchiveSegment, Conversation, Message
+
+User = get_user_model()
+
+DEFAULTS = {
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'archive'),
+    'MIN_AGE_DAYS': 90,
+    # Messages per compressed block, the unit a read decompresses
+    'BLOCK_MESSAGES': 256,
+    # Most messages a single run writes into one segment
+    'SEGMENT_MESSAGES': 10000,
+    # Memory-mapped segments kept open per process
+    'OPEN_SEGMENTS': 64,
+}
+
+MAGIC = b'CHATSEG1'
+FOOTER = struct.Struct('<Q')
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_ARCHIVE', {})}
+
+
+def _micros(value):
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _timestamp(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+
+def write_segment(path, records, block_messages):
+    """
+    Write ``(id, sender_id, receiver_id, timestamp, is_read, content)``
+    records, in id order, as a segment file at ``path``.
+
+    The file only appears under its final name once complete and synced.
+    """
+    index = []
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        for start in range(0, len(records), block_messages):
+            block = records[start:start + block_messages]
+            data = zlib.compress(json.dumps(
+                [[r[0], r[1], r[2], _micros(r[3]), r[4], r[5]] for r in block], separators=(',', ':'),
+            ).encode())
+            index.append([block[0][0], block[-1][0], f.tell(), len(data)])
+            f.write(data)
+        index_data = json.dumps(index, separators=(',', ':')).encode()
+        f.write(index_data)
+        f.write(FOOTER.pack(len(index_data)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """A memory-mapped segment file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[-len(MAGIC):] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a chat archive segment")
+        end = len(self._map) - len(MAGIC) - FOOTER.size
+        (index_length,) = FOOTER.unpack(self._map[end:end + FOOTER.size])
+        self.blocks = json.loads(self._map[end - index_length:end])
+
+    def read(self, after_id=None, before_id=None, limit=None, newest=False):
+        """
+        Records with after_id < id < before_id, oldest first. With ``limit``
+        only that many are decompressed and returned: the oldest ones, or
+        with ``newest`` the newest ones.
+        """
+        blocks = [
+            block for block in self.blocks
+            if (after_id is None or block[1] > after_id) and (before_id is None or block[0] < before_id)
+        ]
+        records = []
+        for first_id, last_id, offset, length in (reversed(blocks) if newest else blocks):
+            found = [
+                record for record in json.loads(zlib.decompress(self._map[offset:offset + length]))
+                if (after_id is None or record[0] > after_id) and (before_id is None or record[0] < before_id)
+            ]
+            records = found + records if newest else records + found
+            if limit is not None and len(records) >= limit:
+                return records[-limit:] if newest else records[:limit]
+        return records
+
+    def read_ids(self, ids):
+        """The records whose id is in the set ``ids``, decompressing only the blocks that can hold them."""
+        records = []
+        for first_id, last_id, offset, length in self.blocks:
+            if any(first_id <= message_id <= last_id for message_id in ids):
+                records.extend(
+                    record for record in json.loads(zlib.decompress(self._map[offset:offset + length])) if record[0] in ids
+                )
+        return records
+
+    def close(self):
+        self._map.close()
+
+
+class SegmentCache:
+    """Keeps the most recently read segments mapped."""
+
+    def __init__(self, size):
+        self.size = size
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            segment = self._segments.get(path)
+            if segment is not None:
+                self._segments.move_to_end(path)
+                return segment
+        segment = Segment(path)
+        with self._lock:
+            self._segments[path] = segment
+            while len(self._segments) > self.size:
+                # Readers still holding the evicted segment keep it alive until they finish
+                self._segments.popitem(last=False)
+        return segment
+
+
+_segments = None
+
+
+def get_segment_cache():
+    global _segments
+    if _segments is None:
+        _segments = SegmentCache(get_config()['OPEN_SEGMENTS'])
+    return _segments
+
+
+def archived_rows(user_id, other_user_id, before_id=None, after_id=None, limit=50):
+    """
+    Return up to ``limit`` archived messages of a conversation in the
+    ``history.MESSAGE_ROW_FIELDS`` format, oldest first: the newest below
+    ``before_id``, or with ``after_id`` the oldest above it.
+    """
+    low, high = Conversation.pair(user_id, other_user_id)
+    ascending = after_id is not None
+    segments = ArchiveSegment.objects.filter(low_user_id=low, high_user_id=high)
+    if before_id is not None:
+        segments = segments.filter(first_id__lt=before_id)
+    if after_id is not None:
+        segments = segments.filter(last_id__gt=after_id)
+    segments = segments.order_by('first_id' if ascending else '-first_id').values_list('path', flat=True)
+
+    directory = get_config()['DIRECTORY']
+    cache = get_segment_cache()
+    records = []
+    for path in segments:
+        found = cache.get(os.path.join(directory, path)).read(
+            after_id=after_id, before_id=before_id, limit=limit - len(records), newest=not ascending,
+        )
+        records = records + found if ascending else found + records
+        if len(records) >= limit:
+            break
+    records = records[:limit] if ascending else records[-limit:]
+    return _rows(low, high, records)
+
+
+def archived_messages(low_user_id, high_user_id, message_ids):
+    """
+    Return the archived messages of the (low, high) conversation whose ids
+    are in ``message_ids``, in the ``history.MESSAGE_ROW_FIELDS`` format,
+    oldest first. Ids that aren't archived are skipped.
+    """
+    ids = set(message_ids)
+    if not ids:
+        return []
+    segments = ArchiveSegment.objects.filter(
+        low_user_id=low_user_id, high_user_id=high_user_id, first_id__lte=max(ids), last_id__gte=min(ids),
+    ).order_by('first_id').values_list('path', flat=True)
+
+    directory = get_config()['DIRECTORY']
+    cache = get_segment_cache()
+    records = []
+    for path in segments:
+        records.extend(cache.get(os.path.join(directory, path)).read_ids(ids))
+    return _rows(low_user_id, high_user_id, records)
+
+
+def _rows(low, high, records):
+    if not records:
+        return []
+    users = User.objects.only('id', 'email', 'first_name', 'last_name').in_bulk({low, high})
+    rows = []
+    for message_id, sender_id, receiver_id, micros, is_read, content in records:
+        sender, receiver = users[sender_id], users[receiver_id]
+        rows.append({
+            'id': message_id, 'content': content, 'timestamp': _timestamp(micros), 'is_read': is_read,
+            'sender_id': sender_id, 'sender__email': sender.email,
+            'sender__first_name': sender.first_name, 'sender__last_name': sender.last_name,
+            'receiver_id': receiver_id, 'receiver__email': receiver.email,
+            'receiver__first_name': receiver.first_name, 'receiver__last_name': receiver.last_name,
+        })
+    return rows
+
+
+def archive_conversation(conversation, cutoff, config):
+    """
+    Archive the oldest messages of ``conversation`` sent before ``cutoff``.
+
+    Stops at the first message that is too new or is the conversation's
+    last message, so what stays in the table is a suffix of the history.
+    Returns the number of messages archived.
+    """
+    low, high = conversation.low_user_id, conversation.high_user_id
+    pair = Q(sender_id=low, receiver_id=high) | Q(sender_id=high, receiver_id=low)
+    candidates = Message.objects.filter(pair, id__gt=conversation.archived_up_to_id).order_by('id').values_list(
+        'id', 'sender_id', 'receiver_id', 'timestamp', 'is_read', 'content',
+    )[:config['SEGMENT_MESSAGES']]
+
+    records = []
+    for record in candidates:
+        if record[3] >= cutoff or record[0] == conversation.last_message_id:
+            break
+        records.append(record)
+    if not records:
+        return 0
+
+    # Unique, so a run that loses a race only ever removes its own file
+    name = f'{records[0][0]:020d}-{records[-1][0]:020d}-{uuid.uuid4().hex[:8]}.seg'
+    relative = os.path.join(f'{low}_{high}', name)
+    path = os.path.join(config['DIRECTORY'], relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_segment(path, records, config['BLOCK_MESSAGES'])
+
+    # The file is durable before its rows leave the table
+    with transaction.atomic():
+        archived_up_to_id = Conversation.objects.select_for_update().filter(id=conversation.id).values_list(
+            'archived_up_to_id', flat=True,
+        ).get()
+        if archived_up_to_id != conversation.archived_up_to_id:
+            # Another run archived these messages since we read them
+            os.remove(path)
+            return 0
+        ArchiveSegment.objects.create(
+            low_user_id=low, high_user_id=high, path=relative,
+            first_id=records[0][0], last_id=records[-1][0], message_count=len(records),
+        )
+        Conversation.objects.filter(id=conversation.id).update(archived_up_to_id=records[-1][0])
+        Message.objects.filter(pair, id__gt=conversation.archived_up_to_id, id__lte=records[-1][0]).delete()
+    return len(records)
+
+
+def archive_messages(min_age_days=None, conversations=None):
+    """
+    Archive every conversation's messages older than ``min_age_days``
+    (default CHAT_ARCHIVE['MIN_AGE_DAYS']). Safe to re-run: each run only
+    picks up messages the previous ones left behind. Returns
+    ``(conversations touched, messages archived)``.
+    """
+    config = get_config()
+    days = config['MIN_AGE_DAYS'] if min_age_days is None else min_age_days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    queryset = Conversation.objects.filter(last_activity__isnull=False) if conversations is None else conversations
+
+    touched = archived = 0
+    for conversation in queryset.only('id', 'low_user_id', 'high_user_id', 'last_message_id', 'archived_up_to_id').iterator():
+        moved = 0
+        while True:
+            count = archive_conversation(conversation, cutoff, config)
+            if not count:
+                break
+            moved += count
+            conversation.refresh_from_db(fields=['archived_up_to_id', 'last_message_id'])
+        if moved:
+            touched += 1
+            archived += moved
+    return touched, archived
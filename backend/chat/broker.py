@@ -0,0 +1,255 @@
+"""
+A single-host message broker for ``chat.layers.LocalBrokerChannelLayer``.
+
+Every worker process keeps one Unix domain socket connection to the broker.
+The broker owns group membership and routes messages: a message for a
+process-specific channel goes straight to the connection that owns it, and
+``group_send`` is expanded here so each worker receives one frame listing
+all of its member channels. Messages for plain (non process-specific)
+channels wait in bounded, expiring queues until a worker listens for them.
+It also keeps which workers have each user online, so presence is counted
+across all of them (see ``chat.presence``).
+
+Run it with ``python manage.py channel_broker``.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def encode_frame(payload):
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    """Return the next frame from ``reader``, or None once it is closed."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"Frame of {length} bytes exceeds the limit")
+        return json.loads(await reader.readexactly(length))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def channel_owner(channel):
+    """
+    The client token in a process-specific channel name, or None.
+
+    Channel names look like ``"specific.<token>!<local part>"``.
+    """
+    if '!' not in channel:
+        return None
+    return channel.split('!', 1)[0].rsplit('.', 1)[-1]
+
+
+class ChannelBroker:
+    """
+    Routing state and the connection handler for the broker.
+
+    ``capacity`` bounds the queue of each plain channel and ``expiry``
+    (seconds) drops messages nobody picked up; group membership lapses after
+    ``group_expiry`` seconds, as with the other channel layers. A client
+    whose socket buffer already holds ``max_buffer`` bytes has further
+    deliveries dropped rather than queued without limit.
+    """
+
+    def __init__(self, capacity=100, expiry=60, group_expiry=86400, max_buffer=4 * 1024 * 1024, orphan_grace=30):
+        self.capacity = capacity
+        self.expiry = expiry
+        self.group_expiry = group_expiry
+        self.max_buffer = max_buffer
+        self.orphan_grace = orphan_grace
+
+        self.clients = {}
+        self.groups = defaultdict(dict)
+        self.pending = defaultdict(deque)
+        self.listeners = defaultdict(list)
+        self.orphaned = {}
+        # user id -> tokens of the workers the user is connected to
+        self.presence = defaultdict(set)
+        self.dropped = 0
+
+    async def serve(self, path):
+        """Listen on ``path`` until cancelled."""
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle_client, path=path)
+        cleanup = asyncio.create_task(self._cleanup_forever())
+        logger.info("Channel broker listening on %s", path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            cleanup.cancel()
+
+    async def handle_client(self, reader, writer):
+        token = None
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                op = frame.get('op')
+                if op == 'hello':
+                    token = frame['token']
+                    self.clients[token] = writer
+                    self.orphaned.pop(token, None)
+                elif op == 'send':
+                    self.send(frame['channel'], frame['message'])
+                elif op == 'group_send':
+                    self.group_send(frame['group'], frame['message'])
+                elif op == 'group_add':
+                    self.groups[frame['group']][frame['channel']] = time.time()
+                    # Acknowledged so group_add returns once membership holds
+                    writer.write(encode_frame({'op': 'ack', 'id': frame.get('id')}))
+                elif op == 'group_discard':
+                    self.group_discard(frame['group'], frame['channel'])
+                elif op == 'discard_channel':
+                    self.discard_channel(frame['channel'])
+                elif op == 'listen':
+                    self.listen(frame['channel'], writer)
+                elif op == 'presence':
+                    changed = self.update_presence(frame['user'], token, frame['online'])
+                    writer.write(encode_frame({'op': 'ack', 'id': frame.get('id'), 'changed': changed}))
+                elif op == 'online':
+                    online = [user for user in frame['users'] if self.presence.get(user)]
+                    writer.write(encode_frame({'op': 'ack', 'id': frame.get('id'), 'online': online}))
+                elif op == 'flush':
+                    self.groups.clear()
+                    self.pending.clear()
+                    self.presence.clear()
+                    writer.write(encode_frame({'op': 'ack', 'id': frame.get('id')}))
+                else:
+                    logger.warning("Ignoring unknown broker op %r", op)
+        finally:
+            for writers in self.listeners.values():
+                if writer in writers:
+                    writers.remove(writer)
+            if token is not None and self.clients.get(token) is writer:
+                del self.clients[token]
+                self.orphaned[token] = time.time()
+            writer.close()
+
+    # Routing
+
+    def send(self, channel, message):
+        owner = channel_owner(channel)
+        if owner is not None:
+            self._deliver(self.clients.get(owner), [channel], message)
+            return
+
+        listeners = self.listeners.get(channel)
+        if listeners:
+            # Rotate so plain channels are shared between listening workers
+            listeners.append(listeners.pop(0))
+            self._deliver(listeners[-1], [channel], message)
+            return
+
+        queue = self.pending[channel]
+        if len(queue) >= self.capacity:
+            self.dropped += 1
+            return
+        queue.append((time.time() + self.expiry, message))
+
+    def group_send(self, group, message):
+        by_owner = defaultdict(list)
+        for channel in self.groups.get(group, {}):
+            owner = channel_owner(channel)
+            if owner is None:
+                self.send(channel, message)
+            else:
+                by_owner[owner].append(channel)
+        for owner, channels in by_owner.items():
+            self._deliver(self.clients.get(owner), channels, message)
+
+    def group_discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    def discard_channel(self, channel):
+        for group in list(self.groups):
+            self.group_discard(group, channel)
+
+    def update_presence(self, user, token, online):
+        """Record whether ``token``'s worker has ``user`` online; True if the user went from no workers to one or back."""
+        workers = self.presence[user]
+        was_online = bool(workers)
+        if online:
+            workers.add(token)
+        else:
+            workers.discard(token)
+        if not workers:
+            del self.presence[user]
+        return was_online != bool(workers)
+
+    def listen(self, channel, writer):
+        if writer not in self.listeners[channel]:
+            self.listeners[channel].append(writer)
+        queue = self.pending.pop(channel, ())
+        now = time.time()
+        for expires, message in queue:
+            if expires >= now:
+                self._deliver(writer, [channel], message)
+
+    def _deliver(self, writer, channels, message):
+        if writer is None or writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.dropped += len(channels)
+            return
+        writer.write(encode_frame({'op': 'deliver', 'channels': channels, 'message': message}))
+
+    # Expiry
+
+    async def _cleanup_forever(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.clean_expired()
+
+    def clean_expired(self):
+        now = time.time()
+        for channel, queue in list(self.pending.items()):
+            while queue and queue[0][0] < now:
+                queue.popleft()
+                self.dropped += 1
+            if not queue:
+                del self.pending[channel]
+
+        joined_before = now - self.group_expiry
+        dead = {token for token, since in self.orphaned.items() if since < now - self.orphan_grace}
+        for token in dead:
+            del self.orphaned[token]
+        for group, members in list(self.groups.items()):
+            for channel, joined_at in list(members.items()):
+                if joined_at < joined_before or channel_owner(channel) in dead:
+                    del members[channel]
+            if not members:
+                del self.groups[group]
+        if dead:
+            # Users only a vanished worker had online
+            for user, workers in list(self.presence.items()):
+                workers -= dead
+                if not workers:
+                    del self.presence[user]
+
+
+def run(path, **options):
+    """Run a broker in the foreground on ``path``."""
+    broker = ChannelBroker(**options)
+    try:
+        asyncio.run(broker.serve(path))
+    except KeyboardInterrupt:
+        pass
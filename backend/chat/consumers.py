@@ -1,79 +1,278 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Message
-from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from core.ratelimit import check_rate
+from .group_commit import get_config as get_group_commit_config, get_write_buffer, write_messages
+from .models import Conversation, FriendAdjacency
+from .outbound import OVERFLOW_CLOSE_CODE, OutboundQueue, get_config as get_outbound_config
+from .presence import get_config as get_presence_config, get_presence_tracker
+from .typing_events import START, STOP, get_typing_throttle
+
+
+def user_group_name(user_id):
+    """The channel group every socket of a user joins."""
+    return f"user_{user_id}"
 
-User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Chat over one socket per device.
+
+    ``ws/chat/`` carries all of the user's conversations: inbound frames name
+    a ``recipient_id`` and outbound frames are tagged with the
+    ``conversation_key``. ``ws/chat/<user_id>/`` is the older one-socket-per-
+    conversation endpoint; it defaults the recipient to that user and only
+    forwards frames for that conversation.
+
+    Either way the socket joins a single per-user group, so a message costs
+    one group_send per participant whatever the number of open sockets.
+
+    ``ws/chat/`` also carries the user's notifications as they are created.
+    Connecting with ``?notifications_since=<id>`` first replays the ones
+    after that id, so a reconnecting client does not miss any.
+
+    Every socket keeps its user online (see ``chat.presence``) as long as
+    it sends some frame, ``{"type": "heartbeat"}`` if nothing else, within
+    CHAT_PRESENCE['TTL'] seconds. ``ws/chat/`` receives friends' presence
+    changes in batches and answers ``{"type": "presence"}`` with the friends
+    online right now on any worker.
+
+    ``{"type": "typing", "recipient_id": 2, "state": "start"}`` (or
+    ``"stop"``) frames are passed on without being stored, throttled per
+    pair and per sender by ``chat.typing_events``. Message frames draw on the sender's
+    ``send_message`` rate limit (see ``core.ratelimit``); over it they get an
+    error frame with ``code: "rate_limited"`` and ``retry_after``.
+
+    Clients acknowledge the frames they have read with
+    ``{"type": "ack", "received": <frames read so far>}`` or
+    ``{"type": "ack", "last_message_id": <id>}``. Once a client has sent
+    its first ack, outbound frames count against a bounded per-socket queue
+    (see ``chat.outbound``) until they are acknowledged, so a client that
+    stops reading can't make the worker or the server buffer without limit.
+    Clients that never ack are only held to the frames waiting to be sent.
+    """
+
     async def connect(self):
         self.user = self.scope["user"]
-        self.other_user_id = self.scope['url_route']['kwargs']['user_id']
-        
+        self.user_group_name = None
+        self.writer = None
+
         if not self.user.is_authenticated:
             await self.close()
             return
 
-        # Create a consistent room name for the two users
-        users = sorted([int(self.user.id), int(self.other_user_id)])
-        self.room_group_name = f"chat_{users[0]}_{users[1]}"
+        peer_id = self.scope['url_route']['kwargs'].get('user_id')
+        self.peer_id = int(peer_id) if peer_id else None
+        self.conversation_key = Conversation.key(self.user.id, self.peer_id) if self.peer_id else None
 
-        # Join room group
+        # Join the user's group
+        self.user_group_name = user_group_name(self.user.id)
         await self.channel_layer.group_add(
-            self.room_group_name,
+            self.user_group_name,
             self.channel_name
         )
 
         await self.accept()
+        config = get_outbound_config()
+        self.outbound = OutboundQueue(config['MAX_QUEUE'], config['POLICY'], user_id=self.user.id, channel_name=self.channel_name)
+        self.outbound_ready = asyncio.Event()
+        self.writer = asyncio.get_running_loop().create_task(self.write_frames())
+        if get_presence_config()['ENABLED']:
+            get_presence_tracker().connect(self.user.id, self.channel_name)
+
+        since_id = self.query_param('notifications_since')
+        if self.conversation_key is None and since_id is not None and since_id.isdigit():
+            self.outbound.last_notification_id = int(since_id)
+            self.push(await self.notification_backlog(int(since_id)))
 
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Leave the user's group
+        if self.user_group_name:
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
+            )
+            if get_presence_config()['ENABLED']:
+                get_presence_tracker().disconnect(self.user.id, self.channel_name)
+            get_typing_throttle().disconnect(self.user.id, self.channel_name)
+        if self.writer is not None:
+            self.writer.cancel()
+            self.outbound.discard()
 
     # Receive message from WebSocket
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        receiver_id = self.other_user_id
+        try:
+            frame = json.loads(text_data)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self.send_error("Frames must be JSON objects.")
+            return
+
+        if get_presence_config()['ENABLED']:
+            get_presence_tracker().heartbeat(self.user.id, self.channel_name)
+
+        frame_type = frame.get('type', 'message')
+        if frame_type == 'message':
+            await self.receive_message(frame)
+        elif frame_type == 'typing':
+            await self.receive_typing(frame)
+        elif frame_type == 'ack':
+            await self.receive_ack(frame)
+        elif frame_type == 'heartbeat':
+            pass
+        elif frame_type == 'presence':
+            await self.send_presence_snapshot()
+        else:
+            await self.send_error(f"Unknown frame type: {frame_type}.")
+
+    async def receive_message(self, frame):
+        message = frame.get('message')
+        try:
+            receiver_id = int(frame.get('recipient_id', self.peer_id))
+        except (TypeError, ValueError):
+            receiver_id = None
+        if not message or receiver_id is None:
+            await self.send_error("Message frames need 'message' and 'recipient_id'.")
+            return
+        allowed, retry_after = check_rate(self.user.id, 'send_message')
+        if not allowed:
+            await self.send_error("Sending messages too fast.", code='rate_limited', retry_after=round(retry_after, 3))
+            return
 
         # Save message to database
-        saved_message = await self.save_message(self.user.id, receiver_id, message)
-
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': saved_message
-            }
-        )
+        try:
+            if get_group_commit_config()['ENABLED']:
+                saved_message = await get_write_buffer().submit(self.user.id, receiver_id, message)
+            else:
+                saved_message = await self.save_message(self.user.id, receiver_id, message)
+        except ObjectDoesNotExist:
+            await self.send_error("Unknown recipient.")
+            return
+
+        # Send message to both participants' groups
+        event = {
+            'type': 'chat_message',
+            'conversation_key': Conversation.key(self.user.id, receiver_id),
+            'message': saved_message
+        }
+        for user_id in sorted({self.user.id, receiver_id}):
+            await self.channel_layer.group_send(user_group_name(user_id), event)
 
-    # Receive message from room group
+    async def receive_ack(self, frame):
+        acked = {}
+        for name in ('received', 'last_message_id'):
+            if frame.get(name) is not None:
+                try:
+                    acked[name] = int(frame[name])
+                except (TypeError, ValueError):
+                    pass
+        if len(acked) != 1:
+            await self.send_error("Ack frames need one of 'received' or 'last_message_id'.")
+            return
+        self.outbound.ack(**acked)
+
+    async def receive_typing(self, frame):
+        state = frame.get('state')
+        try:
+            receiver_id = int(frame.get('recipient_id', self.peer_id))
+        except (TypeError, ValueError):
+            receiver_id = None
+        if state not in (START, STOP) or receiver_id is None:
+            await self.send_error("Typing frames need 'recipient_id' and a 'state' of 'start' or 'stop'.")
+            return
+        get_typing_throttle().submit(self.user.id, receiver_id, state, self.channel_name)
+
+    # Receive message from user group
     async def chat_message(self, event):
-        message = event['message']
+        conversation_key = event['conversation_key']
+        if self.conversation_key and conversation_key != self.conversation_key:
+            return
+
+        # Queue message for the WebSocket
+        self.push({
+            'type': 'message',
+            'conversation_key': conversation_key,
+            'message': event['message']
+        })
+
+    # Receive typing state from user group
+    async def typing_changed(self, event):
+        conversation_key = event['conversation_key']
+        if self.conversation_key and conversation_key != self.conversation_key:
+            return
+
+        self.push({
+            'type': 'typing',
+            'conversation_key': conversation_key,
+            'user_id': event['user_id'],
+            'state': event['state']
+        })
+
+    # Receive notification from user group
+    async def notification_created(self, event):
+        # Conversation sockets leave notifications to the user's main socket
+        if self.conversation_key:
+            return
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': message
-        }))
+        self.push({
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_count': event['unread_count']
+        })
+
+    # Receive a batch of friends' presence changes from user group
+    async def presence_changed(self, event):
+        if self.conversation_key:
+            return
+
+        self.push({
+            'type': 'presence',
+            'online': event['online'],
+            'offline': event['offline']
+        })
+
+    async def send_presence_snapshot(self):
+        friend_ids = await database_sync_to_async(FriendAdjacency.objects.friend_ids)(self.user.id)
+        self.push({
+            'type': 'presence',
+            'online': sorted(await get_presence_tracker().online(friend_ids)),
+            'offline': []
+        })
+
+    def push(self, frame):
+        """Queue ``frame`` for the writer task, subject to CHAT_OUTBOUND's policy."""
+        self.outbound.put(frame)
+        self.outbound_ready.set()
+
+    async def write_frames(self):
+        while True:
+            while len(self.outbound):
+                await self.send(text_data=json.dumps(self.outbound.pop()))
+            if self.outbound.overflowed:
+                # The resume frame is out; make the client reconnect
+                await self.close(code=OVERFLOW_CLOSE_CODE)
+                return
+            self.outbound_ready.clear()
+            await self.outbound_ready.wait()
+
+    def query_param(self, name):
+        return parse_qs(self.scope.get('query_string', b'').decode()).get(name, [None])[0]
+
+    async def send_error(self, detail, **extra):
+        self.push({'type': 'error', 'detail': detail, **extra})
 
     @database_sync_to_async
     def save_message(self, sender_id, receiver_id, content):
-        sender = User.objects.get(id=sender_id)
-        receiver = User.objects.get(id=receiver_id)
-        message = Message.objects.create(sender=sender, receiver=receiver, content=content)
-        return {
-            'id': message.id,
-            'content': message.content,
-            'sender': {
-                'id': sender.id,
-                'first_name': sender.first_name,
-                'last_name': sender.last_name,
-                'email': sender.email
-            },
-            'timestamp': message.timestamp.isoformat()
-        }
+        result = write_messages([(sender_id, receiver_id, content)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @database_sync_to_async
+    def notification_backlog(self, since_id):
+        from notifications.push import notification_backlog
+        return notification_backlog(self.user.id, since_id)
@@ -0,0 +1,139 @@
+import asyncio
+import weakref
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from .models import Conversation, Message
+from .signals import messages_stored
+
+User = get_user_model()
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Seconds a message may wait for others to share its commit
+    'FLUSH_INTERVAL': 0.005,
+    # Flush as soon as this many messages are waiting
+    'MAX_BATCH': 100,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_GROUP_COMMIT', {})}
+
+
+def message_payload(message, sender):
+    """The dict pushed to the room group for a stored message."""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'sender': {
+            'id': sender.id,
+            'first_name': sender.first_name,
+            'last_name': sender.last_name,
+            'email': sender.email
+        },
+        'timestamp': message.timestamp.isoformat()
+    }
+
+
+def write_messages(rows):
+    """
+    Store ``(sender_id, receiver_id, content)`` rows in one transaction.
+
+    Returns one entry per row, in order: the message payload, or a
+    ``User.DoesNotExist`` instance when either user is unknown so a single
+    bad row can't fail the rest of its batch.
+    """
+    user_ids = {user_id for sender_id, receiver_id, content in rows for user_id in (sender_id, receiver_id)}
+    users = User.objects.only('id', 'first_name', 'last_name', 'email').in_bulk(user_ids)
+
+    valid = [row for row in rows if row[0] in users and row[1] in users]
+    objs = [Message(sender=users[sender_id], receiver=users[receiver_id], content=content) for sender_id, receiver_id, content in valid]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            messages = Message.objects.bulk_create(objs)
+        else:
+            messages = [Message.objects.create(sender=m.sender, receiver=m.receiver, content=m.content) for m in objs]
+        Conversation.objects.record_messages(messages)
+        messages_stored.send(sender=Message, messages=messages)
+
+    stored = iter(messages)
+    results = []
+    for sender_id, receiver_id, content in rows:
+        if sender_id in users and receiver_id in users:
+            results.append(message_payload(next(stored), users[sender_id]))
+        else:
+            results.append(User.DoesNotExist(f"Unknown user in message {sender_id} -> {receiver_id}"))
+    return results
+
+
+class MessageWriteBuffer:
+    """
+    Group commit for chat messages.
+
+    Messages submitted by every consumer on the event loop are held for at
+    most ``flush_interval`` seconds (or until ``max_batch`` are waiting) and
+    then written together; each submitter resumes once its batch is
+    committed and gets back its payload with the assigned id.
+    """
+
+    def __init__(self, flush_interval, max_batch):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+
+    async def submit(self, sender_id, receiver_id, content):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((int(sender_id), int(receiver_id), content), future))
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Hold a reference so the task isn't garbage collected mid-flush
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            results = await database_sync_to_async(write_messages)([row for row, future in batch])
+        except Exception as exc:
+            for row, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (row, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_write_buffer():
+    """Return the write buffer shared by all consumers on the running loop."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        config = get_config()
+        buffer = _buffers[loop] = MessageWriteBuffer(config['FLUSH_INTERVAL'], config['MAX_BATCH'])
+    return buffer
@@ -0,0 +1,93 @@
+from operator import attrgetter, itemgetter
+from .archive import archived_rows
+from .models import Conversation, Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Columns behind MessageSerializer's output, users included
+MESSAGE_ROW_FIELDS = (
+    'id', 'content', 'timestamp', 'is_read',
+    'sender_id', 'sender__email', 'sender__first_name', 'sender__last_name',
+    'receiver_id', 'receiver__email', 'receiver__first_name', 'receiver__last_name',
+)
+
+
+def fetch_message_rows(user_id, other_user_id, before_id=None, after_id=None, limit=DEFAULT_PAGE_SIZE, archived_up_to_id=0):
+    """
+    Return up to ``limit`` messages exchanged between two users, oldest
+    first, as dicts of ``MESSAGE_ROW_FIELDS``.
+
+    Without ``after_id`` the page is the newest ``limit`` messages below
+    ``before_id`` (or the newest overall). With ``after_id`` it is the oldest
+    ``limit`` messages above it, which is what a client catching up uses.
+
+    Each direction of the conversation is read with its own query so both walk
+    the (sender, receiver, id) index and stop after ``limit`` rows, however
+    long the conversation is. Skips building model instances;
+    ``serializers.serialize_message_rows`` turns the rows into the API
+    representation.
+
+    Pass the conversation's ``archived_up_to_id`` to page on into the
+    archive (see ``chat.archive``) once the message table runs out. Archived
+    messages are all older than the ones left in the table, so the archive
+    is only read when the page reaches below them.
+    """
+    queryset = Message.objects.values(*MESSAGE_ROW_FIELDS)
+    rows = _fetch_page(queryset, user_id, other_user_id, before_id, after_id, limit)
+    if not archived_up_to_id:
+        return rows
+
+    if after_id is not None:
+        if after_id < archived_up_to_id:
+            rows = (archived_rows(user_id, other_user_id, after_id=after_id, limit=limit) + rows)[:limit]
+    elif len(rows) < limit:
+        older = archived_rows(user_id, other_user_id, before_id=rows[0]['id'] if rows else before_id, limit=limit - len(rows))
+        rows = older + rows
+    return rows
+
+
+def _fetch_page(queryset, user_id, other_user_id, before_id, after_id, limit):
+    ascending = after_id is not None
+    pairs = [(user_id, other_user_id)]
+    if int(user_id) != int(other_user_id):
+        pairs.append((other_user_id, user_id))
+
+    messages = []
+    for sender_id, receiver_id in pairs:
+        direction = queryset.filter(sender_id=sender_id, receiver_id=receiver_id)
+        if before_id is not None:
+            direction = direction.filter(id__lt=before_id)
+        if after_id is not None:
+            direction = direction.filter(id__gt=after_id)
+        direction = direction.order_by('id' if ascending else '-id')
+        messages.extend(direction[:limit])
+
+    messages.sort(key=itemgetter('id'), reverse=not ascending)
+    messages = messages[:limit]
+    if not ascending:
+        messages.reverse()
+    return messages
+
+
+def fetch_inbox_page(user_id, before_id=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return up to ``limit`` of a user's conversations, most recently active first.
+
+    Pages are keyed on ``last_message_id`` (ids grow with activity). The user
+    may sit on either side of the pair, so each side is read from its own
+    (user, last_message) index and the two short lists are merged.
+    """
+    conversations = []
+    for side in ('low_user_id', 'high_user_id'):
+        queryset = Conversation.objects.select_related('low_user', 'high_user', 'last_message').filter(
+            **{side: user_id}, last_message__isnull=False
+        )
+        if before_id is not None:
+            queryset = queryset.filter(last_message_id__lt=before_id)
+        conversations.extend(queryset.order_by('-last_message_id')[:limit])
+
+    # A conversation with yourself matches both sides
+    conversations = list({c.id: c for c in conversations}.values())
+    conversations.sort(key=attrgetter('last_message_id'), reverse=True)
+    return conversations[:limit]
@@ -0,0 +1,225 @@
+import asyncio
+import copy
+import random
+import string
+import time
+from channels.layers import InMemoryChannelLayer
+from .broker import channel_owner, encode_frame, read_frame
+
+
+class LocalBrokerChannelLayer(InMemoryChannelLayer):
+    """
+    Channel layer shared by several worker processes on one host.
+
+    Groups live in the broker process (``manage.py channel_broker``), reached
+    over the Unix domain socket at ``path``. Messages for this process's
+    channels are queued locally with the same ``capacity`` and ``expiry``
+    rules as InMemoryChannelLayer, so a slow consumer only ever costs its own
+    bounded queue. Messages travel as JSON and must be JSON-serializable.
+
+    If the broker connection drops, say because the broker restarted, the
+    layer reconnects straight away (retrying with backoff) and tells the
+    broker again which channels listen where, which groups this process's
+    channels belong to and who is online here.
+
+    ``group_add`` and ``flush`` wait for the broker's acknowledgement. Other
+    sends to the broker are fire-and-forget: ``ChannelFull`` is only
+    raised for channels owned by this process, and a full remote queue drops
+    the message the same way ``group_send`` does.
+
+    The ``presence`` extension shares per-user online counts between workers
+    through the broker (see ``chat.presence``).
+    """
+
+    extensions = ["groups", "flush", "presence"]
+
+    def __init__(self, path, max_buffer=4 * 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_buffer = max_buffer
+        self.token = "".join(random.choice(string.ascii_letters) for i in range(12))
+        self._loop = None
+        self._lock = None
+        self._writer = None
+        self._reader_task = None
+        self._reconnect_task = None
+        self._listening = set()
+        # group -> channels this process added to it, replayed on reconnect
+        self._groups = {}
+        # Users this process has told the broker are online here
+        self._present = set()
+        self._acks = {}
+        self._next_ack = 0
+
+    # Broker connection
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections belong to an event loop; start over on a new one
+            self._loop, self._lock, self._writer = loop, asyncio.Lock(), None
+        if self._writer is not None and not self._writer.is_closing():
+            return self._writer
+
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                writer.write(encode_frame({'op': 'hello', 'token': self.token}))
+                for channel in self._listening:
+                    writer.write(encode_frame({'op': 'listen', 'channel': channel}))
+                for group, channels in self._groups.items():
+                    for channel in channels:
+                        writer.write(encode_frame({'op': 'group_add', 'group': group, 'channel': channel}))
+                for user_id in self._present:
+                    writer.write(encode_frame({'op': 'presence', 'user': user_id, 'online': True}))
+                self._writer = writer
+                self._reader_task = loop.create_task(self._read_forever(reader, writer))
+        return self._writer
+
+    async def _send_frame(self, payload):
+        writer = await self._connection()
+        writer.write(encode_frame(payload))
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            await writer.drain()
+
+    async def _request(self, payload):
+        """Send a frame and return the broker's acknowledgement."""
+        self._next_ack += 1
+        ack_id = self._next_ack
+        future = self._acks[ack_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self._send_frame({**payload, 'id': ack_id})
+            return await future
+        finally:
+            self._acks.pop(ack_id, None)
+
+    async def _read_forever(self, reader, writer):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                op = frame.get('op')
+                if op == 'deliver':
+                    self._deliver(frame['channels'], frame['message'])
+                elif op == 'ack':
+                    future = self._acks.get(frame.get('id'))
+                    if future is not None and not future.done():
+                        future.set_result(frame)
+        finally:
+            if self._writer is writer:
+                self._writer = None
+                if not asyncio.current_task().cancelling():
+                    # Lost rather than closed: don't wait for the next send to notice
+                    self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+            for future in self._acks.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the channel broker connection"))
+
+    async def _reconnect(self, delay=0.05, max_delay=5):
+        while True:
+            try:
+                await self._connection()
+                return
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def _deliver(self, channels, message):
+        expires = time.time() + self.expiry
+        for i, channel in enumerate(channels):
+            queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+            try:
+                queue.put_nowait((expires, message if i == 0 else copy.deepcopy(message)))
+            except asyncio.QueueFull:
+                pass # Dropped like any other overflowing group message
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        if channel_owner(channel) == self.token:
+            await super().send(channel, message)
+        else:
+            await self._send_frame({'op': 'send', 'channel': channel, 'message': message})
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self._connection()
+        if channel_owner(channel) is None and channel not in self._listening:
+            self._listening.add(channel)
+            await self._send_frame({'op': 'listen', 'channel': channel})
+        return await super().receive(channel)
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.%s!%s" % (
+            prefix.rstrip('.'),
+            self.token,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    def _remove_from_groups(self, channel):
+        # A local message expired, so the channel is gone; tell the broker
+        self._forget_group_member(channel)
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(encode_frame({'op': 'discard_channel', 'channel': channel}))
+
+    async def flush(self):
+        await super().flush()
+        self._groups.clear()
+        await self._request({'op': 'flush'})
+
+    async def close(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            # Closing flushes whatever is still buffered for the broker
+            writer.close()
+            await writer.wait_closed()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        self._groups.setdefault(group, set()).add(channel)
+        await self._request({'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        self._forget_group_member(channel, group)
+        await self._send_frame({'op': 'group_discard', 'group': group, 'channel': channel})
+
+    def _forget_group_member(self, channel, group=None):
+        for name in [group] if group is not None else list(self._groups):
+            channels = self._groups.get(name)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self._groups[name]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        await self._send_frame({'op': 'group_send', 'group': group, 'message': message})
+
+    # Presence extension
+
+    async def update_presence(self, user_id, online):
+        """Record whether ``user_id`` is online in this process; True if that changed their state across processes."""
+        ack = await self._request({'op': 'presence', 'user': user_id, 'online': online})
+        # Replayed if the broker connection is ever opened again
+        if online:
+            self._present.add(user_id)
+        else:
+            self._present.discard(user_id)
+        return ack['changed']
+
+    async def online_users(self, user_ids):
+        """The subset of ``user_ids`` online in any process."""
+        ack = await self._request({'op': 'online', 'users': list(user_ids)})
+        return set(ack['online'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from chat.archive import archive_messages, get_config
+
+
+class Command(BaseCommand):
+    help = "Move old chat messages out of the message table into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-days', type=int, default=None,
+                            help="Archive messages older than this (defaults to CHAT_ARCHIVE['MIN_AGE_DAYS']).")
+
+    def handle(self, *args, **options):
+        days = get_config()['MIN_AGE_DAYS'] if options['min_age_days'] is None else options['min_age_days']
+        conversations, messages = archive_messages(min_age_days=days)
+        self.stdout.write(f"Archived {messages} messages older than {days} days from {conversations} conversations.")
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chat import broker
+
+
+class Command(BaseCommand):
+    help = "Run the local channel broker that lets several workers on this host share channel groups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'CHANNEL_BROKER_SOCKET', None),
+                            help="Unix socket path (defaults to settings.CHANNEL_BROKER_SOCKET).")
+        parser.add_argument('--capacity', type=int, default=100, help="Max queued messages per plain channel.")
+        parser.add_argument('--expiry', type=int, default=60, help="Seconds before an undelivered message is dropped.")
+        parser.add_argument('--group-expiry', type=int, default=86400, help="Seconds before group membership lapses.")
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("Pass --socket or set CHANNEL_BROKER_SOCKET.")
+        self.stdout.write(f"Channel broker listening on {options['socket']}")
+        broker.run(
+            options['socket'],
+            capacity=options['capacity'],
+            expiry=options['expiry'],
+            group_expiry=options['group_expiry'],
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'receiver', 'id'], name='chat_msg_pair_id_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.25 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    pairs = {}
+    directions = Message.objects.values('sender_id', 'receiver_id').annotate(
+        last_id=models.Max('id'),
+        unread=models.Count('id', filter=models.Q(is_read=False)),
+    ).order_by()
+    for row in directions:
+        low, high = sorted((row['sender_id'], row['receiver_id']))
+        entry = pairs.setdefault((low, high), {'last_id': 0, low: 0, high: 0})
+        entry['last_id'] = max(entry['last_id'], row['last_id'])
+        if low != high:
+            entry[row['receiver_id']] += row['unread']
+
+    last_messages = Message.objects.in_bulk([entry['last_id'] for entry in pairs.values()])
+    Conversation.objects.bulk_create(
+        [
+            Conversation(
+                low_user_id=low,
+                high_user_id=high,
+                last_message_id=entry['last_id'],
+                last_activity=last_messages[entry['last_id']].timestamp,
+                low_unread_count=entry[low],
+                high_unread_count=entry[high],
+            )
+            for (low, high), entry in pairs.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0003_message_pair_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('low_unread_count', models.PositiveIntegerField(default=0)),
+                ('high_unread_count', models.PositiveIntegerField(default=0)),
+                ('high_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message')),
+                ('low_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['low_user', 'last_message'], name='chat_conv_low_activity_idx'), models.Index(fields=['high_user', 'last_message'], name='chat_conv_high_activity_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('low_user', 'high_user'), name='chat_conversation_pair_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.CheckConstraint(check=models.Q(('low_user__lte', models.F('high_user'))), name='chat_conversation_pair_ordered'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.25 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+def backfill_watermarks(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    read_up_to = Message.objects.filter(is_read=True).values('sender_id', 'receiver_id').annotate(
+        last_read_id=models.Max('id'),
+    ).order_by()
+    for row in read_up_to:
+        low, high = sorted((row['sender_id'], row['receiver_id']))
+        field = 'low_read_id' if row['receiver_id'] == low else 'high_read_id'
+        Conversation.objects.filter(low_user_id=low, high_user_id=high).update(**{field: row['last_read_id']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='high_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='low_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
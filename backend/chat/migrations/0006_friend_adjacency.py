@@ -0,0 +1,41 @@
+# Generated by Django 4.2.25 on 2026-10-18 20:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_adjacency(apps, schema_editor):
+    Friendship = apps.get_model('chat', 'Friendship')
+    FriendAdjacency = apps.get_model('chat', 'FriendAdjacency')
+
+    edges = []
+    for friendship in Friendship.objects.filter(status='ACCEPTED').only('id', 'sender_id', 'receiver_id'):
+        edges.append(FriendAdjacency(user_id=friendship.sender_id, friend_id=friendship.receiver_id, friendship_id=friendship.id))
+        edges.append(FriendAdjacency(user_id=friendship.receiver_id, friend_id=friendship.sender_id, friendship_id=friendship.id))
+    FriendAdjacency.objects.bulk_create(edges, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0005_conversation_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendAdjacency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('friendship', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.friendship')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='friendadjacency',
+            constraint=models.UniqueConstraint(fields=('user', 'friend'), name='chat_friend_adjacency_uniq'),
+        ),
+        migrations.RunPython(backfill_adjacency, migrations.RunPython.noop),
+    ]
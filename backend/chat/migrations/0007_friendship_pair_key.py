@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+def backfill_pair_keys(apps, schema_editor):
+    Friendship = apps.get_model('chat', 'Friendship')
+    FriendAdjacency = apps.get_model('chat', 'FriendAdjacency')
+
+    # Keep one friendship per unordered pair: an accepted one if there is one, else the oldest
+    by_pair = {}
+    for friendship in Friendship.objects.order_by('id'):
+        low, high = sorted((friendship.sender_id, friendship.receiver_id))
+        friendship.pair_key = f"{low}_{high}"
+        kept = by_pair.get(friendship.pair_key)
+        if kept is None or (friendship.status == 'ACCEPTED' and kept.status != 'ACCEPTED'):
+            by_pair[friendship.pair_key] = friendship
+
+    kept_ids = {friendship.id for friendship in by_pair.values()}
+    Friendship.objects.exclude(id__in=kept_ids).delete()
+    Friendship.objects.bulk_update(by_pair.values(), ['pair_key'], batch_size=1000)
+
+    # Edges of a deleted duplicate went with it; make sure the survivor has its own
+    edges = []
+    for friendship in by_pair.values():
+        if friendship.status == 'ACCEPTED':
+            edges.append(FriendAdjacency(user_id=friendship.sender_id, friend_id=friendship.receiver_id, friendship_id=friendship.id))
+            edges.append(FriendAdjacency(user_id=friendship.receiver_id, friend_id=friendship.sender_id, friendship_id=friendship.id))
+    FriendAdjacency.objects.bulk_create(edges, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_friend_adjacency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendship',
+            name='pair_key',
+            field=models.CharField(editable=False, max_length=41, null=True),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+    ]
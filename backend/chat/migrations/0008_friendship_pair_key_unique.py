@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_friendship_pair_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='friendship',
+            name='pair_key',
+            field=models.CharField(editable=False, max_length=41, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='friendship',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.25 on 2026-10-18 20:42
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# A copy of chat.search's tokenizer as it was when this migration was written,
+# so later changes to it don't change what this backfill does
+MAX_TOKEN_LENGTH = 64
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [word[:MAX_TOKEN_LENGTH] for word in WORD.findall((text or '').lower())]
+
+
+def backfill_search_tokens(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    MessageSearchToken = apps.get_model('chat', 'MessageSearchToken')
+
+    tokens = []
+    for message_id, sender_id, receiver_id, content in Message.objects.values_list('id', 'sender_id', 'receiver_id', 'content').iterator():
+        low, high = sorted((sender_id, receiver_id))
+        tokens.extend(
+            MessageSearchToken(message_id=message_id, low_user_id=low, high_user_id=high, token=token)
+            for token in set(tokenize(content))
+        )
+        if len(tokens) >= 10000:
+            MessageSearchToken.objects.bulk_create(tokens, batch_size=1000, ignore_conflicts=True)
+            tokens = []
+    MessageSearchToken.objects.bulk_create(tokens, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0009_message_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('high_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('low_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('message', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.message')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['low_user', 'token', 'message'], name='chat_msg_search_low_idx'), models.Index(fields=['high_user', 'token', 'message'], name='chat_msg_search_high_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='messagesearchtoken',
+            constraint=models.UniqueConstraint(fields=('message', 'token'), name='chat_msg_search_token_uniq'),
+        ),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
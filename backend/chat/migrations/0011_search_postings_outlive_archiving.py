@@ -0,0 +1,35 @@
+# Generated by Django 4.2.25 on 2026-10-18 21:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_search_token'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='messagesearchtoken',
+            name='chat_msg_search_low_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='messagesearchtoken',
+            name='chat_msg_search_high_idx',
+        ),
+        migrations.AlterField(
+            model_name='messagesearchtoken',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='chat.message'),
+        ),
+        migrations.AddIndex(
+            model_name='messagesearchtoken',
+            index=models.Index(fields=['low_user', 'token', 'message'], name='chat_msg_search_low_idx', opclasses=['int8_ops', 'varchar_pattern_ops', 'int8_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='messagesearchtoken',
+            index=models.Index(fields=['high_user', 'token', 'message'], name='chat_msg_search_high_idx', opclasses=['int8_ops', 'varchar_pattern_ops', 'int8_ops']),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.25 on 2026-10-18 21:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_search_words(apps, schema_editor):
+    MessageSearchToken = apps.get_model('chat', 'MessageSearchToken')
+    MessageSearchWord = apps.get_model('chat', 'MessageSearchWord')
+
+    for side in ('low_user_id', 'high_user_id'):
+        words = []
+        for user_id, token in MessageSearchToken.objects.values_list(side, 'token').distinct().iterator():
+            words.append(MessageSearchWord(user_id=user_id, token=token))
+            if len(words) >= 10000:
+                MessageSearchWord.objects.bulk_create(words, batch_size=1000, ignore_conflicts=True)
+                words = []
+        MessageSearchWord.objects.bulk_create(words, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0011_search_postings_outlive_archiving'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'token'], name='chat_msg_search_word_idx', opclasses=['int8_ops', 'varchar_pattern_ops'])],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='messagesearchword',
+            constraint=models.UniqueConstraint(fields=('user', 'token'), name='chat_msg_search_word_uniq'),
+        ),
+        migrations.RunPython(backfill_search_words, migrations.RunPython.noop),
+    ]
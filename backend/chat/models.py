@@ -1,6 +1,23 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.conf import settings
 
+class FriendshipManager(models.Manager):
+    def send_invite(self, sender, receiver):
+        """
+        Create a pending request from ``sender`` to ``receiver``.
+
+        Returns None when the pair already has a friendship in either
+        direction. The unique pair key decides that in the INSERT itself, so
+        concurrent invites cannot both succeed.
+        """
+        try:
+            with transaction.atomic():
+                return self.create(sender=sender, receiver=receiver, status=Friendship.PENDING)
+        except IntegrityError:
+            return None
+
 class Friendship(models.Model):
     PENDING = 'PENDING'
     ACCEPTED = 'ACCEPTED'
@@ -16,23 +33,364 @@ class Friendship(models.Model):
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_friend_requests')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
+    # "<low user id>_<high user id>", the same for both directions of a pair
+    pair_key = models.CharField(max_length=41, unique=True, editable=False)
+
+    objects = FriendshipManager()
 
     class Meta:
-        unique_together = ('sender', 'receiver')
         ordering = ['-created_at']
 
     def __str__(self):
         return f"{self.sender} -> {self.receiver} ({self.status})"
 
+    def save(self, *args, **kwargs):
+        self.pair_key = Conversation.key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
+
+class FriendAdjacencyManager(models.Manager):
+    def friends_of(self, user_id):
+        """Return a user's friends, most recent friendship first, in one query."""
+        edges = self.filter(user_id=user_id).select_related('friend').order_by('-friendship_id')
+        return [edge.friend for edge in edges]
+
+    def friend_ids(self, user_id):
+        return list(self.filter(user_id=user_id).values_list('friend_id', flat=True))
+
+    def friend_ids_many(self, user_ids):
+        """Return ``{user_id: [friend ids]}`` for several users in one query."""
+        friends = {user_id: [] for user_id in user_ids}
+        for user_id, friend_id in self.filter(user_id__in=user_ids).values_list('user_id', 'friend_id'):
+            friends[user_id].append(friend_id)
+        return friends
+
+    def are_friends(self, user_id, other_user_id):
+        return self.filter(user_id=user_id, friend_id=other_user_id).exists()
+
+    def sync(self, friendship):
+        """Bring both edges of ``friendship`` in line with its status."""
+        if friendship.status == Friendship.ACCEPTED:
+            self.bulk_create(
+                [
+                    FriendAdjacency(user_id=friendship.sender_id, friend_id=friendship.receiver_id, friendship=friendship),
+                    FriendAdjacency(user_id=friendship.receiver_id, friend_id=friendship.sender_id, friendship=friendship),
+                ],
+                ignore_conflicts=True,
+            )
+        else:
+            self.filter(friendship=friendship).delete()
+
+class FriendAdjacency(models.Model):
+    """
+    Accepted friendships stored once per direction, so every lookup is a
+    read of the (user, friend) index. Kept in sync with Friendship by
+    ``chat.signals``; the rows go away with their Friendship.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    friend = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    friendship = models.ForeignKey(Friendship, on_delete=models.CASCADE, related_name='+')
+
+    objects = FriendAdjacencyManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='chat_friend_adjacency_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} is friends with {self.friend_id}"
+
+def are_friends(user_id, other_user_id):
+    """True if the two users have an accepted friendship."""
+    return FriendAdjacency.objects.are_friends(user_id, other_user_id)
+
 class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Superseded by the per-conversation read watermarks on Conversation
     is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination walks one direction of a conversation by id.
+            models.Index(fields=['sender', 'receiver', 'id'], name='chat_msg_pair_id_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender} to {self.receiver} at {self.timestamp}"
+
+class ConversationManager(models.Manager):
+    def record_messages(self, messages):
+        """
+        Fold freshly written messages into their conversations.
+
+        A single conversation costs one UPDATE (plus an INSERT for its first
+        message). A batch spanning several conversations, as written by the
+        group-commit buffer, costs three statements however many it touches.
+        """
+        pending = {}
+        for message in messages:
+            pair = Conversation.pair(message.sender_id, message.receiver_id)
+            entry = pending.setdefault(pair, {'latest': message, 'unread': {pair[0]: 0, pair[1]: 0}})
+            if message.id > entry['latest'].id:
+                entry['latest'] = message
+            if message.sender_id != message.receiver_id:
+                entry['unread'][message.receiver_id] += 1
+
+        if len(pending) > 1:
+            self._apply_many(pending)
+            return
+
+        for (low, high), entry in pending.items():
+            if not self.filter(low_user_id=low, high_user_id=high).update(**self._changes(low, high, entry)):
+                try:
+                    with transaction.atomic():
+                        self.create(
+                            low_user_id=low,
+                            high_user_id=high,
+                            last_message=entry['latest'],
+                            last_activity=entry['latest'].timestamp,
+                            low_unread_count=entry['unread'][low],
+                            high_unread_count=entry['unread'][high],
+                        )
+                except IntegrityError:
+                    # Another writer created the row first
+                    self.filter(low_user_id=low, high_user_id=high).update(**self._changes(low, high, entry))
+
+    def mark_read(self, user_id, other_user_id, up_to_id=None):
+        """
+        Advance ``user_id``'s read watermark in the conversation with
+        ``other_user_id`` and re-derive their unread counter from it.
+
+        Without ``up_to_id`` everything up to the last message is marked read.
+        The watermark never moves backwards or past the last message, and the
+        whole operation is a single UPDATE of the conversation row.
+        """
+        low, high = Conversation.pair(user_id, other_user_id)
+        side = 'low' if int(user_id) == low else 'high'
+        read_field, unread_field = f'{side}_read_id', f'{side}_unread_count'
+        last_message_id = Coalesce(F('last_message_id'), Value(0), output_field=models.BigIntegerField())
+
+        if up_to_id is None:
+            updates = {read_field: Greatest(F(read_field), last_message_id), unread_field: 0}
+        else:
+            still_unread = Message.objects.filter(
+                sender_id=other_user_id,
+                receiver_id=user_id,
+                id__gt=Greatest(OuterRef(read_field), Value(up_to_id)),
+            ).order_by().values('receiver_id').annotate(count=Count('id')).values('count')
+            updates = {
+                read_field: Greatest(F(read_field), Least(Value(up_to_id), last_message_id)),
+                unread_field: Coalesce(Subquery(still_unread), Value(0)),
+            }
+        return self.filter(low_user_id=low, high_user_id=high).update(**updates)
+
+    def read_watermarks(self, user_id, other_user_id):
+        """Return ``{user_id: last read message id}`` for both sides of a pair."""
+        return self.page_state(user_id, other_user_id)[0]
+
+    def page_state(self, user_id, other_user_id):
+        """
+        Return ``(read watermarks, archived_up_to_id)`` for a pair, which is
+        what paging through its history needs, in one query.
+        """
+        low, high = Conversation.pair(user_id, other_user_id)
+        state = self.filter(low_user_id=low, high_user_id=high).values_list('low_read_id', 'high_read_id', 'archived_up_to_id').first()
+        if state is None:
+            return {low: 0, high: 0}, 0
+        return {low: state[0], high: state[1]}, state[2]
+
+    def read_watermarks_many(self, pairs):
+        """Return ``{(low, high): read watermarks}`` for several pairs in one query."""
+        pairs = {Conversation.pair(*pair) for pair in pairs}
+        watermarks = {(low, high): {low: 0, high: 0} for low, high in pairs}
+        if not pairs:
+            return watermarks
+        condition = Q()
+        for low, high in pairs:
+            condition |= Q(low_user_id=low, high_user_id=high)
+        for low, high, low_read_id, high_read_id in self.filter(condition).values_list('low_user_id', 'high_user_id', 'low_read_id', 'high_read_id'):
+            watermarks[(low, high)] = {low: low_read_id, high: high_read_id}
+        return watermarks
+
+    def _apply_many(self, pending):
+        # Make sure every row exists, then fold all changes into one UPDATE
+        self.bulk_create(
+            [Conversation(low_user_id=low, high_user_id=high) for low, high in pending],
+            ignore_conflicts=True,
+        )
+        pairs = Q()
+        for low, high in pending:
+            pairs |= Q(low_user_id=low, high_user_id=high)
+        conversations = list(self.filter(pairs).only('id', 'low_user_id', 'high_user_id'))
+
+        fields = set()
+        for conversation in conversations:
+            changes = self._changes(conversation.low_user_id, conversation.high_user_id, pending[(conversation.low_user_id, conversation.high_user_id)])
+            for field, value in changes.items():
+                setattr(conversation, field, value)
+            fields.update(changes)
+        self.bulk_update(conversations, sorted(fields))
+
+    def _changes(self, low, high, entry):
+        latest, unread = entry['latest'], entry['unread']
+        # Writers can commit out of order; never move last_message backwards
+        return {
+            'last_message_id': Greatest(
+                Coalesce(F('last_message_id'), Value(0), output_field=models.BigIntegerField()),
+                Value(latest.id),
+            ),
+            'last_activity': Greatest(
+                Coalesce(F('last_activity'), Value(latest.timestamp), output_field=models.DateTimeField()),
+                Value(latest.timestamp),
+            ),
+            'low_unread_count': F('low_unread_count') + unread[low],
+            'high_unread_count': F('high_unread_count') + unread[high],
+        }
+
+class Conversation(models.Model):
+    """
+    One row per pair of users, keyed by (low user id, high user id).
+
+    Denormalizes the state of the conversation so the inbox never has to
+    scan the message table.
+    """
+    low_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    high_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity = models.DateTimeField(null=True, blank=True)
+    low_unread_count = models.PositiveIntegerField(default=0)
+    high_unread_count = models.PositiveIntegerField(default=0)
+    # Each side has read every message up to and including these ids
+    low_read_id = models.BigIntegerField(default=0)
+    high_read_id = models.BigIntegerField(default=0)
+    # Messages up to this id have moved to archive segments (see chat.archive)
+    archived_up_to_id = models.BigIntegerField(default=0)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['low_user', 'high_user'], name='chat_conversation_pair_uniq'),
+            models.CheckConstraint(check=Q(low_user__lte=F('high_user')), name='chat_conversation_pair_ordered'),
+        ]
+        indexes = [
+            # Message ids grow with activity, so the inbox pages on last_message_id
+            models.Index(fields=['low_user', 'last_message'], name='chat_conv_low_activity_idx'),
+            models.Index(fields=['high_user', 'last_message'], name='chat_conv_high_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversation between {self.low_user_id} and {self.high_user_id}"
+
+    @staticmethod
+    def pair(user_id, other_user_id):
+        """Return the canonical (low, high) ordering of two user ids."""
+        user_id, other_user_id = int(user_id), int(other_user_id)
+        return (user_id, other_user_id) if user_id <= other_user_id else (other_user_id, user_id)
+
+    @staticmethod
+    def key(user_id, other_user_id):
+        """Stable "<low>_<high>" identifier clients use to tag conversations."""
+        return "{}_{}".format(*Conversation.pair(user_id, other_user_id))
+
+    @property
+    def conversation_key(self):
+        return f"{self.low_user_id}_{self.high_user_id}"
+
+    def other_user_id(self, user_id):
+        return self.high_user_id if self.low_user_id == user_id else self.low_user_id
+
+    def unread_count_for(self, user_id):
+        return self.low_unread_count if self.low_user_id == user_id else self.high_unread_count
+
+    def read_id_for(self, user_id):
+        return self.low_read_id if self.low_user_id == user_id else self.high_read_id
+
+class ArchiveSegment(models.Model):
+    """
+    One compressed, immutable file of a conversation's archived messages.
+
+    Written by ``manage.py archive_messages``; ``chat.archive`` reads it.
+    A conversation's segments never overlap and all lie below its oldest
+    message still in the message table.
+    """
+    low_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    high_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # Relative to CHAT_ARCHIVE['DIRECTORY']
+    path = models.CharField(max_length=255, unique=True)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['low_user', 'high_user', 'last_id'], name='chat_archive_pair_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archive {self.path} ({self.first_id}-{self.last_id})"
+
+class MessageSearchToken(models.Model):
+    """
+    One row per distinct word of a message, the inverted index behind
+    ``chat.search``. Carries the conversation's (low, high) pair, so a
+    user's search reads only their own conversations' postings from the
+    (low_user, token, message) and (high_user, token, message) indexes.
+    Written with the message by ``chat.signals``. The rows stay when the
+    message is archived, so they can't be constrained to the message table;
+    they go away with either user.
+    """
+    # Covered by the unique (message, token) and (side, token, message) indexes
+    message = models.ForeignKey(
+        Message, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', db_index=False,
+    )
+    low_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    high_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'token'], name='chat_msg_search_token_uniq'),
+        ]
+        # varchar_pattern_ops lets prefix (LIKE 'term%') lookups use them whatever the database's collation
+        indexes = [
+            models.Index(
+                fields=['low_user', 'token', 'message'], name='chat_msg_search_low_idx',
+                opclasses=['int8_ops', 'varchar_pattern_ops', 'int8_ops'],
+            ),
+            models.Index(
+                fields=['high_user', 'token', 'message'], name='chat_msg_search_high_idx',
+                opclasses=['int8_ops', 'varchar_pattern_ops', 'int8_ops'],
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.token} in message {self.message_id}"
+
+class MessageSearchWord(models.Model):
+    """
+    A distinct word of the messages in a user's conversations: the
+    dictionary ``chat.search`` expands a prefix term against before it
+    reads any postings. Written with the postings and, like them, kept when
+    messages are archived.
+    """
+    # Covered by the unique (user, token) and pattern_ops indexes
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'token'], name='chat_msg_search_word_uniq'),
+        ]
+        indexes = [
+            # Prefix (LIKE 'term%') lookups, whatever the database's collation
+            models.Index(fields=['user', 'token'], name='chat_msg_search_word_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} for user {self.user_id}"
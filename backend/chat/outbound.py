@@ -0,0 +1,219 @@
+"""
+Bounded outbound queues for chat sockets.
+
+Every frame a ChatConsumer sends goes through its connection's
+OutboundQueue and is written by a single writer task. ``websocket.send``
+returns as soon as the ASGI server has the frame, stalled client or not,
+so the queue can't count on the writer blocking. Instead clients
+acknowledge what they have read, ``{"type": "ack", "received": <n>}``
+with the number of frames read on the socket so far, or
+``{"type": "ack", "last_message_id": <id>}`` for everything up to and
+including that message frame. A queue's depth is the frames waiting for
+the writer plus the ones sent but not yet acknowledged, and a client that
+stops reading (or acking) holds at most CHAT_OUTBOUND['MAX_QUEUE'] of
+them in the worker and the server's buffers.
+
+Acks are opt-in: frames only count as unacknowledged once the connection
+has sent its first ack. Older clients, and the per-conversation
+``ws/chat/<id>/`` endpoint, never ack; for them the depth is just the
+frames waiting for the writer, as it was before acks existed.
+
+When a frame arrives at a full queue, POLICY decides what gives:
+
+``drop_ephemeral``
+    Typing and presence frames are dropped, the incoming one or else the
+    oldest queued; they are stale by the time a slow client gets to them.
+``coalesce``
+    The incoming frame is first merged into a waiting frame it supersedes
+    (a newer typing state for the same pair, another presence batch),
+    then ephemeral frames are dropped as above.
+``close``
+    Nothing is dropped.
+
+If there is still no room, the queue is emptied and the client is sent a
+``resume`` frame, then disconnected. The frame says what it last received
+so it can catch up over the REST API and ``notifications_since`` after it
+reconnects.
+"""
+import weakref
+from collections import deque
+from django.conf import settings
+
+DEFAULTS = {
+    # Frames waiting for or unacknowledged by one slow client before the policy applies
+    'MAX_QUEUE': 256,
+    'POLICY': 'drop_ephemeral',
+}
+
+DROP_EPHEMERAL, COALESCE, CLOSE = 'drop_ephemeral', 'coalesce', 'close'
+POLICIES = (DROP_EPHEMERAL, COALESCE, CLOSE)
+
+# Frame types that are only worth delivering while they're fresh
+EPHEMERAL = frozenset(['typing', 'presence'])
+
+# Close code sent after the resume frame
+OVERFLOW_CLOSE_CODE = 4008
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'CHAT_OUTBOUND', {})}
+    if config['POLICY'] not in POLICIES:
+        raise ValueError(f"CHAT_OUTBOUND['POLICY'] must be one of {', '.join(POLICIES)}")
+    return config
+
+
+def coalesce_key(frame):
+    """Frames with the same key supersede each other; None if nothing does."""
+    if frame['type'] == 'typing':
+        return ('typing', frame['conversation_key'], frame['user_id'])
+    if frame['type'] == 'presence':
+        return ('presence',)
+    return None
+
+
+def merge_presence(older, newer):
+    """One presence frame with the net effect of ``older`` then ``newer``."""
+    online = (set(older['online']) - set(newer['offline'])) | set(newer['online'])
+    offline = (set(older['offline']) - set(newer['online'])) | set(newer['offline'])
+    return {'type': 'presence', 'online': sorted(online), 'offline': sorted(offline)}
+
+
+class OutboundQueue:
+    def __init__(self, max_size, policy, user_id=None, channel_name=None):
+        self.max_size = max_size
+        self.policy = policy
+        self.user_id = user_id
+        self.channel_name = channel_name
+        self._frames = deque()
+        # The message id, or None, of each frame sent and not yet acknowledged
+        self._unacked = deque()
+        self.acked = 0
+        # Whether the client has ever acknowledged anything
+        self.acking = False
+        self.overflowed = False
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # What the client has been given, for the resume frame
+        self.last_message_id = None
+        self.last_notification_id = None
+        _queues.add(self)
+
+    def __len__(self):
+        """Frames waiting for the writer."""
+        return len(self._frames)
+
+    @property
+    def depth(self):
+        return len(self._frames) + len(self._unacked)
+
+    def put(self, frame):
+        """Queue ``frame``; returns False once the queue has overflowed for good."""
+        if self.overflowed:
+            return False
+        if self.depth >= self.max_size:
+            if self.policy == COALESCE and self._coalesce(frame):
+                return True
+            if self.policy != CLOSE and frame['type'] in EPHEMERAL:
+                self.dropped += 1
+                return True
+            if self.policy == CLOSE or not self._drop_oldest_ephemeral():
+                self.overflowed = True
+                self.dropped += len(self._frames) + 1
+                self._frames.clear()
+                self._frames.append(self.resume_frame())
+                return False
+        self._frames.append(frame)
+        self.max_depth = max(self.max_depth, self.depth)
+        return True
+
+    def _coalesce(self, frame):
+        key = coalesce_key(frame)
+        if key is None:
+            return False
+        for index, queued in enumerate(self._frames):
+            if coalesce_key(queued) == key:
+                # The merged frame takes the newer one's place in line
+                del self._frames[index]
+                self._frames.append(merge_presence(queued, frame) if frame['type'] == 'presence' else frame)
+                self.coalesced += 1
+                return True
+        return False
+
+    def _drop_oldest_ephemeral(self):
+        for queued in self._frames:
+            if queued['type'] in EPHEMERAL:
+                self._frames.remove(queued)
+                self.dropped += 1
+                return True
+        return False
+
+    def pop(self):
+        """The next frame for the writer, counted as unacknowledged from now on if the client acks."""
+        frame = self._frames.popleft()
+        self.sent += 1
+        if self.acking:
+            self._unacked.append(frame['message']['id'] if frame['type'] == 'message' else None)
+        else:
+            # Nothing to wait for; the client never acks, or hasn't yet
+            self.acked += 1
+        if frame['type'] == 'message':
+            self.last_message_id = max(self.last_message_id or 0, frame['message']['id'])
+        elif frame['type'] == 'notification':
+            self.last_notification_id = max(self.last_notification_id or 0, frame['notification']['id'])
+        elif frame['type'] == 'notifications' and frame['notifications']:
+            self.last_notification_id = max(self.last_notification_id or 0, frame['notifications'][-1]['id'])
+        return frame
+
+    def ack(self, received=None, last_message_id=None):
+        """
+        The client has read ``received`` frames in all, or every frame up to
+        and including message ``last_message_id``. Stale or repeated acks
+        are harmless. The first ack opts the client in to ack accounting.
+        """
+        self.acking = True
+        if received is not None:
+            count = received - self.acked
+        else:
+            count = 0
+            for index, message_id in enumerate(self._unacked):
+                if message_id is not None and message_id <= last_message_id:
+                    count = index + 1
+        for i in range(max(0, min(count, len(self._unacked)))):
+            self._unacked.popleft()
+            self.acked += 1
+
+    def resume_frame(self):
+        return {
+            'type': 'resume',
+            'reason': 'slow_consumer',
+            'last_message_id': self.last_message_id,
+            'notifications_since': self.last_notification_id,
+        }
+
+    def discard(self):
+        """Stop reporting this queue; its connection has closed."""
+        _queues.discard(self)
+
+    def stats(self):
+        return {
+            'user_id': self.user_id,
+            'channel_name': self.channel_name,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'unacked': len(self._unacked),
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'overflowed': self.overflowed,
+        }
+
+
+# Every live connection's queue in this process
+_queues = weakref.WeakSet()
+
+
+def connection_stats():
+    """Queue metrics for each open socket in this process, deepest first."""
+    return sorted((queue.stats() for queue in list(_queues)), key=lambda stats: -stats['depth'])
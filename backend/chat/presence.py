@@ -0,0 +1,221 @@
+"""
+Who is online, pushed to friends in batches.
+
+Every open socket registers with the process's PresenceTracker and counts
+as a connection of its user; a user is online while any of their
+connections is. A connection that hasn't been heard from for
+CHAT_PRESENCE['TTL'] seconds is dropped even if its socket never closed,
+so clients send a heartbeat frame more often than that.
+
+Changes are not pushed as they happen. Every BROADCAST_INTERVAL seconds
+the tracker works out whose state actually changed since it was last
+published and sends each friend of theirs one ``presence`` event with
+every change they should see. Events go to every friend's user group, not
+just friends connected here, because the groups are shared through the
+channel broker and a friend may be connected to another worker; a group
+with no sockets costs the broker next to nothing. A user whose last socket closes stays
+online for OFFLINE_GRACE more seconds, so reconnecting devices and
+flapping networks produce no traffic at all.
+
+Workers share one online count per user. Each tracker reports to the
+store when a user gains their first or loses their last socket on its
+worker (after the grace period), and only the report that takes the user
+from no workers to one, or from one to none, is published. So a user with
+sockets on two workers stays online when one of them closes, and the
+``{"type": "presence"}`` snapshot covers friends on every worker. With the
+channel broker the count lives in the broker process; with any other
+channel layer there is only one worker and it lives in LocalPresenceStore.
+"""
+import asyncio
+import time
+import weakref
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .models import FriendAdjacency
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Seconds a connection stays online without a heartbeat
+    'TTL': 60,
+    # Changes are published at most this often
+    'BROADCAST_INTERVAL': 1.0,
+    # Seconds a user stays online after their last connection goes away
+    'OFFLINE_GRACE': 10,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_PRESENCE', {})}
+
+
+class LocalPresenceStore:
+    """The shared online count for a single process; see the broker's ``presence`` op."""
+
+    def __init__(self):
+        self._online = set()
+
+    async def update_presence(self, user_id, online):
+        """Record whether this worker has ``user_id`` online; True if the user's overall state changed."""
+        changed = online != (user_id in self._online)
+        if online:
+            self._online.add(user_id)
+        else:
+            self._online.discard(user_id)
+        return changed
+
+    async def online_users(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self._online}
+
+
+class PresenceTracker:
+    def __init__(self, ttl, broadcast_interval, offline_grace, clock=time.monotonic, store=None):
+        self.ttl = ttl
+        self.broadcast_interval = broadcast_interval
+        self.offline_grace = offline_grace
+        self.clock = clock
+        self.store = store if store is not None else LocalPresenceStore()
+        # user id -> {channel name: expiry}
+        self._connections = {}
+        # Users last reported to the store as online
+        self._published = set()
+        # user id -> when their last connection went away
+        self._offline_since = {}
+        self._dirty = set()
+        self._next_sweep = 0
+        self._task = None
+        self.broadcasts = 0
+
+    def connect(self, user_id, channel_name):
+        self._connections.setdefault(user_id, {})[channel_name] = self.clock() + self.ttl
+        self._offline_since.pop(user_id, None)
+        self._changed(user_id)
+
+    def heartbeat(self, user_id, channel_name):
+        connections = self._connections.get(user_id)
+        if connections is not None and channel_name in connections:
+            connections[channel_name] = self.clock() + self.ttl
+        else:
+            # Swept after missing its heartbeats, but the socket is alive
+            self.connect(user_id, channel_name)
+
+    def disconnect(self, user_id, channel_name):
+        connections = self._connections.get(user_id)
+        if connections is None or connections.pop(channel_name, None) is None:
+            return
+        if not connections:
+            self._lost(user_id)
+
+    def is_online(self, user_id):
+        return user_id in self._connections or user_id in self._published
+
+    async def online(self, user_ids):
+        """The subset of ``user_ids`` currently online on any worker."""
+        user_ids = list(user_ids)
+        local = {user_id for user_id in user_ids if self.is_online(user_id)}
+        return local | await self.store.online_users([user_id for user_id in user_ids if user_id not in local])
+
+    def _lost(self, user_id):
+        del self._connections[user_id]
+        self._offline_since[user_id] = self.clock()
+        self._changed(user_id)
+
+    def _changed(self, user_id):
+        self._dirty.add(user_id)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._connections or self._dirty:
+                await asyncio.sleep(self.broadcast_interval)
+                await self.flush()
+        finally:
+            self._task = None
+
+    def _sweep(self, now):
+        for user_id, connections in list(self._connections.items()):
+            for channel_name, expires in list(connections.items()):
+                if expires <= now:
+                    del connections[channel_name]
+            if not connections:
+                self._lost(user_id)
+
+    def pending_changes(self):
+        """
+        Take the users whose state on this worker differs from what was last
+        reported, as ``{user_id: online}``, and treat them as reported.
+        """
+        now = self.clock()
+        if now >= self._next_sweep:
+            self._sweep(now)
+            self._next_sweep = now + self.ttl / 4
+
+        changes = {}
+        dirty, self._dirty = self._dirty, set()
+        for user_id in dirty:
+            online = user_id in self._connections
+            if not online and user_id in self._published:
+                if now - self._offline_since.get(user_id, now) < self.offline_grace:
+                    # Look again once the grace period is over
+                    self._dirty.add(user_id)
+                    continue
+            self._offline_since.pop(user_id, None)
+            if online != (user_id in self._published):
+                changes[user_id] = online
+                if online:
+                    self._published.add(user_id)
+                else:
+                    self._published.discard(user_id)
+        return changes
+
+    async def global_changes(self):
+        """
+        Report this worker's changes to the store and return the ones that
+        changed the user's state across all workers.
+        """
+        changes = {}
+        for user_id, online in self.pending_changes().items():
+            if await self.store.update_presence(user_id, online):
+                changes[user_id] = online
+        return changes
+
+    async def flush(self):
+        changes = await self.global_changes()
+        if not changes:
+            return
+        edges = await database_sync_to_async(FriendAdjacency.objects.friend_ids_many)(list(changes))
+
+        batches = {}
+        for user_id, friend_ids in edges.items():
+            for friend_id in friend_ids:
+                batch = batches.setdefault(friend_id, {'online': [], 'offline': []})
+                batch['online' if changes[user_id] else 'offline'].append(user_id)
+
+        from .consumers import user_group_name
+        channel_layer = get_channel_layer()
+        for friend_id, batch in batches.items():
+            await channel_layer.group_send(user_group_name(friend_id), {
+                'type': 'presence_changed',
+                'online': sorted(batch['online']),
+                'offline': sorted(batch['offline']),
+            })
+        self.broadcasts += len(batches)
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_presence_tracker():
+    """Return the presence tracker shared by all consumers on the running loop."""
+    loop = asyncio.get_running_loop()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        config = get_config()
+        channel_layer = get_channel_layer()
+        # A layer shared between workers also shares their online counts
+        store = channel_layer if 'presence' in getattr(channel_layer, 'extensions', ()) else None
+        tracker = _trackers[loop] = PresenceTracker(
+            config['TTL'], config['BROADCAST_INTERVAL'], config['OFFLINE_GRACE'], store=store,
+        )
+    return tracker
@@ -0,0 +1,199 @@
+"""
+Full-text search over a user's message history.
+
+Every message is indexed as its distinct lowercase words in
+MessageSearchToken, tagged with the conversation's (low, high) pair, and
+each word is added to both participants' MessageSearchWord dictionaries.
+A user's postings for a word are read newest first straight off the
+(side, token, message) index for each side of the pairs they sit on, so
+the cost of a search depends on how many of *their* messages it reads,
+not on the message table. Postings outlive archiving (see
+``chat.archive``), and matches that have left the message table are read
+back from their segments.
+
+Terms match whole words; terms of MIN_PREFIX_LENGTH or more letters also
+match words starting with them, so a query typed so far still finds
+something. A prefix is first expanded against the user's dictionary to
+at most MAX_EXPANSIONS words, shortest first. Messages must match every
+term and rank by how well they match (an exact word beats a prefix),
+newest first.
+
+Only the newest MAX_CANDIDATES matches of the longest term are ranked,
+exact words first. A term common enough to have more reports
+``has_more`` whatever page is asked for.
+"""
+import os
+import re
+from collections import defaultdict
+from django.db.models import Q
+from django.db.models.functions import Length
+from core.search import prefix_filter
+from .archive import archived_messages, get_config, get_segment_cache
+from .history import MESSAGE_ROW_FIELDS
+from .models import ArchiveSegment, Conversation, Message, MessageSearchToken, MessageSearchWord
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_TERMS = 4
+MAX_TOKEN_LENGTH = 64
+# Shorter terms only match whole words, keeping their scans tight
+MIN_PREFIX_LENGTH = 3
+# Words a prefix term is expanded to, the term itself included
+MAX_EXPANSIONS = 8
+# Postings read for the longest term; the candidates every other term narrows down
+MAX_CANDIDATES = 500
+
+# Exact word matches rank above prefix matches
+EXACT_MATCH, PREFIX_MATCH = 2, 1
+
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Split free text into the lowercase words the index stores."""
+    return [word[:MAX_TOKEN_LENGTH] for word in WORD.findall((text or '').lower())]
+
+
+def message_tokens(message_id, sender_id, receiver_id, content):
+    low, high = Conversation.pair(sender_id, receiver_id)
+    return [
+        MessageSearchToken(message_id=message_id, low_user_id=low, high_user_id=high, token=token)
+        for token in set(tokenize(content))
+    ]
+
+
+def _index(messages, batch_size=1000):
+    """Write the postings and dictionary words of ``(id, sender_id, receiver_id, content)`` tuples."""
+    tokens = [token for message in messages for token in message_tokens(*message)]
+    MessageSearchToken.objects.bulk_create(tokens, batch_size=batch_size, ignore_conflicts=True)
+    words = {(user_id, token.token) for token in tokens for user_id in (token.low_user_id, token.high_user_id)}
+    MessageSearchWord.objects.bulk_create(
+        [MessageSearchWord(user_id=user_id, token=token) for user_id, token in words], batch_size=batch_size, ignore_conflicts=True,
+    )
+
+
+def index_messages(messages):
+    """Index freshly stored messages, in the caller's transaction."""
+    _index([(message.id, message.sender_id, message.receiver_id, message.content) for message in messages])
+
+
+def rebuild_index(batch_size=1000):
+    """Rebuild the whole index, archived messages included; returns the number of messages indexed."""
+    MessageSearchToken.objects.all().delete()
+    MessageSearchWord.objects.all().delete()
+    count = 0
+    last_id = 0
+    while True:
+        messages = list(
+            Message.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'sender_id', 'receiver_id', 'content')[:batch_size]
+        )
+        if not messages:
+            break
+        _index(messages, batch_size)
+        count += len(messages)
+        last_id = messages[-1][0]
+
+    directory = get_config()['DIRECTORY']
+    cache = get_segment_cache()
+    for path in ArchiveSegment.objects.order_by('id').values_list('path', flat=True).iterator():
+        records = cache.get(os.path.join(directory, path)).read()
+        for start in range(0, len(records), batch_size):
+            _index(
+                [
+                    (message_id, sender_id, receiver_id, content)
+                    for message_id, sender_id, receiver_id, micros, is_read, content in records[start:start + batch_size]
+                ],
+                batch_size,
+            )
+        count += len(records)
+    return count
+
+
+def _term_filter(term):
+    if len(term) < MIN_PREFIX_LENGTH:
+        return Q(token=term)
+    return prefix_filter(term)
+
+
+def _score(postings, term):
+    scores = {}
+    for message_id, token in postings:
+        score = EXACT_MATCH if token == term else PREFIX_MATCH
+        scores[message_id] = max(scores.get(message_id, 0), score)
+    return scores
+
+
+def _expand(user_id, term):
+    """The words of the user's dictionary ``term`` matches, shortest (so ``term`` itself) first, and whether some were left out."""
+    if len(term) < MIN_PREFIX_LENGTH:
+        return [term], False
+    words = list(
+        MessageSearchWord.objects.filter(prefix_filter(term), user_id=user_id)
+        .order_by(Length('token'), 'token').values_list('token', flat=True)[:MAX_EXPANSIONS + 1]
+    )
+    return words[:MAX_EXPANSIONS], len(words) > MAX_EXPANSIONS
+
+
+def _leading_candidates(user_id, term):
+    """
+    Up to MAX_CANDIDATES ``{message_id: (score, pair)}`` matches of ``term``
+    in the user's conversations, exact ones first and then newest first,
+    and whether any were left unread.
+    """
+    words, truncated = _expand(user_id, term)
+    matches = {}
+    for word in words:
+        for side in ('low_user_id', 'high_user_id'):
+            # Index order: one seek into (side, token, message), read backwards
+            postings = list(
+                MessageSearchToken.objects.filter(token=word, **{side: user_id}).order_by('-message_id')
+                .values_list('message_id', 'low_user_id', 'high_user_id')[:MAX_CANDIDATES + 1]
+            )
+            truncated = truncated or len(postings) > MAX_CANDIDATES
+            score = EXACT_MATCH if word == term else PREFIX_MATCH
+            for message_id, low, high in postings[:MAX_CANDIDATES]:
+                if matches.get(message_id, (0,))[0] < score:
+                    matches[message_id] = (score, (low, high))
+    best = sorted(matches, key=lambda message_id: (-matches[message_id][0], -message_id))
+    truncated = truncated or len(best) > MAX_CANDIDATES
+    return {message_id: matches[message_id] for message_id in best[:MAX_CANDIDATES]}, truncated
+
+
+def search_messages(user_id, query, offset=0, limit=DEFAULT_LIMIT):
+    """
+    Return ``(rows, has_more)`` for the user's messages matching every term
+    of ``query``, best first, as dicts of ``history.MESSAGE_ROW_FIELDS``.
+
+    The longest term bounds the candidates to MAX_CANDIDATES; each further
+    term is one lookup of the (message, token) index for those candidates
+    only. When the bound cuts matches off, ``has_more`` is True and only
+    the candidates read are ranked.
+    """
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)[:MAX_TERMS]
+    if not terms:
+        return [], False
+
+    candidates, truncated = _leading_candidates(user_id, terms[0])
+    scores = {message_id: score for message_id, (score, pair) in candidates.items()}
+    for term in terms[1:]:
+        if not scores:
+            return [], False
+        term_scores = _score(
+            MessageSearchToken.objects.filter(_term_filter(term), message_id__in=list(scores)).values_list('message_id', 'token'),
+            term,
+        )
+        scores = {message_id: scores[message_id] + score for message_id, score in term_scores.items()}
+    if not scores:
+        return [], False
+
+    ranked = sorted(scores, key=lambda message_id: (-scores[message_id], -message_id))
+    page = ranked[offset:offset + limit]
+    rows = {row['id']: row for row in Message.objects.filter(id__in=page).values(*MESSAGE_ROW_FIELDS)}
+    # The rest have been archived since they were indexed
+    archived = defaultdict(list)
+    for message_id in page:
+        if message_id not in rows:
+            archived[candidates[message_id][1]].append(message_id)
+    for (low, high), message_ids in archived.items():
+        rows.update((row['id'], row) for row in archived_messages(low, high, message_ids))
+    return [rows[message_id] for message_id in page if message_id in rows], truncated or len(ranked) > offset + limit
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Friendship, Message
+from django.db import transaction
+from .models import Conversation, Friendship, Message
+from .signals import messages_stored
 from django.shortcuts import get_object_or_404
 
 User = get_user_model()
@@ -31,17 +33,16 @@ class FriendshipSerializer(serializers.ModelSerializer):
         if sender == receiver:
             raise serializers.ValidationError("You cannot invite yourself.")
         
-        if Friendship.objects.filter(sender=sender, receiver=receiver).exists() or \
-           Friendship.objects.filter(sender=receiver, receiver=sender).exists():
+        friendship = Friendship.objects.send_invite(sender, receiver)
+        if friendship is None:
             raise serializers.ValidationError("Friendship request already exists.")
-
-        friendship = Friendship.objects.create(sender=sender, receiver=receiver, status=Friendship.PENDING)
         return friendship
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     receiver = UserSerializer(read_only=True)
     receiver_id = serializers.IntegerField(write_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
@@ -53,5 +54,89 @@ class MessageSerializer(serializers.ModelSerializer):
         receiver = get_object_or_404(User, id=receiver_id)
         
         # sender is already in validated_data because it was passed to save() in perform_create
-        message = Message.objects.create(receiver=receiver, **validated_data)
+        with transaction.atomic():
+            message = Message.objects.create(receiver=receiver, **validated_data)
+            Conversation.objects.record_messages([message])
+            messages_stored.send(sender=Message, messages=[message])
         return message
+
+    def get_is_read(self, obj):
+        # Derived from the receiver's read watermark; the column is no longer kept up to date
+        watermarks = self.context.get('read_watermarks')
+        if watermarks is None:
+            # Looked up once per conversation, shared by every message of a many=True render
+            by_pair = self.context.setdefault('conversation_read_watermarks', {})
+            pair = Conversation.pair(obj.sender_id, obj.receiver_id)
+            if pair not in by_pair:
+                by_pair[pair] = Conversation.objects.read_watermarks(*pair)
+            watermarks = by_pair[pair]
+        return obj.id <= watermarks.get(obj.receiver_id, 0)
+
+def serialize_message_rows(rows, read_watermarks):
+    """
+    Render ``history.fetch_message_rows`` output the way
+    ``MessageSerializer(many=True)`` renders the same messages.
+
+    A page only ever involves the conversation's two users, so each user's
+    payload is built once and shared by every message that references it.
+    """
+    timestamp_field = serializers.DateTimeField()
+    users = {}
+
+    def user_payload(row, prefix):
+        user_id = row[f'{prefix}_id']
+        payload = users.get(user_id)
+        if payload is None:
+            payload = users[user_id] = {
+                'id': user_id,
+                'email': row[f'{prefix}__email'],
+                'first_name': row[f'{prefix}__first_name'],
+                'last_name': row[f'{prefix}__last_name'],
+            }
+        return payload
+
+    return [
+        {
+            'id': row['id'],
+            'sender': user_payload(row, 'sender'),
+            'receiver': user_payload(row, 'receiver'),
+            'content': row['content'],
+            'timestamp': timestamp_field.to_representation(row['timestamp']),
+            'is_read': row['id'] <= read_watermarks.get(row['receiver_id'], 0),
+        }
+        for row in rows
+    ]
+
+class ReadWatermarkSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    message_id = serializers.IntegerField(min_value=1)
+
+class MarkReadSerializer(serializers.Serializer):
+    watermarks = ReadWatermarkSerializer(many=True, allow_empty=False, max_length=100)
+
+class ConversationMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ('id', 'sender', 'content', 'timestamp')
+
+class ConversationSerializer(serializers.ModelSerializer):
+    key = serializers.CharField(source='conversation_key', read_only=True)
+    other_user = serializers.SerializerMethodField()
+    last_message = ConversationMessageSerializer(read_only=True)
+    unread_count = serializers.SerializerMethodField()
+    read_up_to = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ('id', 'key', 'other_user', 'last_message', 'last_activity', 'unread_count', 'read_up_to')
+
+    def get_other_user(self, obj):
+        user_id = self.context['request'].user.id
+        other_user = obj.high_user if obj.low_user_id == user_id else obj.low_user
+        return UserSerializer(other_user).data
+
+    def get_unread_count(self, obj):
+        return obj.unread_count_for(self.context['request'].user.id)
+
+    def get_read_up_to(self, obj):
+        return obj.read_id_for(self.context['request'].user.id)
@@ -0,0 +1,20 @@
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+from .models import FriendAdjacency, Friendship
+from .search import index_messages
+
+# Sent with ``messages=[...]`` inside the transaction that stored them.
+# Messages are bulk inserted, so post_save doesn't fire for them.
+messages_stored = Signal()
+
+@receiver(post_save, sender=Friendship)
+def sync_friend_adjacency(sender, instance, created, **kwargs):
+    # New requests are pending; only status changes can add or drop edges
+    if created and instance.status != Friendship.ACCEPTED:
+        return
+    FriendAdjacency.objects.sync(instance)
+
+@receiver(messages_stored)
+def index_stored_messages(sender, messages, **kwargs):
+    # Postings commit with their messages, so a search never misses one
+    index_messages(messages)
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import tempfile
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+from chat.broker import ChannelBroker
+from chat.layers import LocalBrokerChannelLayer
+
+def run_with_broker(scenario, **broker_options):
+    """Run ``scenario(path)`` with a broker listening on a temporary socket."""
+    async def main():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'broker.sock')
+            broker = ChannelBroker(**broker_options)
+            server = asyncio.create_task(broker.serve(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            try:
+                return await scenario(path)
+            finally:
+                server.cancel()
+    return async_to_sync(main)()
+
+async def receive(layer, channel, timeout=2):
+    return await asyncio.wait_for(layer.receive(channel), timeout)
+
+class LocalBrokerChannelLayerTest(SimpleTestCase):
+    def test_group_send_reaches_channels_in_every_process(self):
+        async def scenario(path):
+            # Two layer instances stand in for two worker processes
+            worker_1, worker_2 = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path)
+            channel_1, channel_2 = await worker_1.new_channel(), await worker_2.new_channel()
+            await worker_1.group_add('user_1', channel_1)
+            await worker_2.group_add('user_1', channel_2)
+
+            await worker_1.group_send('user_1', {'type': 'chat.message', 'text': 'hello'})
+            first = await receive(worker_1, channel_1)
+            second = await receive(worker_2, channel_2)
+
+            await worker_2.group_discard('user_1', channel_2)
+            await worker_1.group_send('user_1', {'type': 'chat.message', 'text': 'again'})
+            again = await receive(worker_1, channel_1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await receive(worker_2, channel_2, timeout=0.2)
+
+            await worker_1.close()
+            await worker_2.close()
+            return first, second, again
+
+        first, second, again = run_with_broker(scenario)
+        self.assertEqual(first, {'type': 'chat.message', 'text': 'hello'})
+        self.assertEqual(second, first)
+        self.assertEqual(again['text'], 'again')
+
+    def test_send_to_channel_owned_by_another_process(self):
+        async def scenario(path):
+            worker_1, worker_2 = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path)
+            channel = await worker_2.new_channel()
+            # The owner must be connected before anything can be routed to it
+            await worker_2.group_add('warmup', channel)
+
+            await worker_1.send(channel, {'type': 'direct'})
+            message = await receive(worker_2, channel)
+            await worker_1.close()
+            await worker_2.close()
+            return message
+
+        self.assertEqual(run_with_broker(scenario), {'type': 'direct'})
+
+    def test_plain_channel_messages_wait_for_a_listener(self):
+        async def scenario(path):
+            producer, consumer = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path)
+            await producer.send('background-tasks', {'type': 'task', 'n': 1})
+            message = await receive(consumer, 'background-tasks')
+            await producer.close()
+            await consumer.close()
+            return message
+
+        self.assertEqual(run_with_broker(scenario), {'type': 'task', 'n': 1})
+
+    def test_local_queues_are_bounded(self):
+        async def scenario(path):
+            sender, slow = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path, capacity=2)
+            channel = await slow.new_channel()
+            await slow.group_add('flood', channel)
+            for i in range(5):
+                await sender.group_send('flood', {'type': 'flood', 'n': i})
+            await asyncio.sleep(0.1)
+
+            received = [await receive(slow, channel) for i in range(2)]
+            with self.assertRaises(asyncio.TimeoutError):
+                await receive(slow, channel, timeout=0.2)
+            await sender.close()
+            await slow.close()
+            return [m['n'] for m in received]
+
+        self.assertEqual(run_with_broker(scenario), [0, 1])
+
+    def test_group_memberships_survive_a_broker_restart(self):
+        async def main():
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'broker.sock')
+                broker = ChannelBroker()
+                server = asyncio.create_task(broker.serve(path))
+                while not os.path.exists(path):
+                    await asyncio.sleep(0.01)
+
+                sender, listener = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path)
+                channel = await listener.new_channel()
+                await listener.group_add('user_1', channel)
+                await listener.group_add('user_2', channel)
+                await listener.group_discard('user_2', channel)
+                # The listener only waits for deliveries from now on
+                waiting = asyncio.ensure_future(receive(listener, channel, timeout=5))
+
+                server.cancel()
+                for writer in list(broker.clients.values()):
+                    writer.close()
+                restarted = ChannelBroker()
+                server = asyncio.create_task(restarted.serve(path))
+                for i in range(100):
+                    if restarted.groups.get('user_1'):
+                        break
+                    await asyncio.sleep(0.05)
+                try:
+                    await sender.group_send('user_1', {'type': 'chat.message', 'text': 'after restart'})
+                    message = await waiting
+                    groups = dict(restarted.groups)
+                finally:
+                    await sender.close()
+                    await listener.close()
+                    server.cancel()
+                return message, groups
+
+        message, groups = async_to_sync(main)()
+        self.assertEqual(message, {'type': 'chat.message', 'text': 'after restart'})
+        self.assertEqual(list(groups), ['user_1'])
+
+class ChannelBrokerTest(SimpleTestCase):
+    def test_plain_channel_queue_is_bounded_and_expires(self):
+        broker = ChannelBroker(capacity=2, expiry=60)
+        for i in range(3):
+            broker.send('tasks', {'n': i})
+        self.assertEqual(len(broker.pending['tasks']), 2)
+        self.assertEqual(broker.dropped, 1)
+
+        broker.expiry = -1
+        broker.send('other', {'n': 0})
+        broker.clean_expired()
+        self.assertNotIn('other', broker.pending)
+
+    def test_group_membership_expires(self):
+        broker = ChannelBroker(group_expiry=-1)
+        broker.groups['user_1']['specific.abc!def'] = 0
+        broker.clean_expired()
+        self.assertNotIn('user_1', broker.groups)
@@ -0,0 +1,101 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase
+from django.contrib.auth import get_user_model
+from chat.models import Conversation, Message
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+def communicator_for(user, path='/ws/chat/'):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    return communicator
+
+class MultiplexedChatConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+    def test_one_socket_receives_every_conversation(self):
+        async def exchange():
+            socket_a = communicator_for(self.user_a)
+            socket_b = communicator_for(self.user_b)
+            socket_c = communicator_for(self.user_c)
+            for socket in (socket_a, socket_b, socket_c):
+                self.assertTrue((await socket.connect())[0])
+
+            await socket_b.send_json_to({'type': 'message', 'recipient_id': self.user_a.id, 'message': 'From B'})
+            from_b = await socket_a.receive_json_from(timeout=5)
+            await socket_c.send_json_to({'type': 'message', 'recipient_id': self.user_a.id, 'message': 'From C'})
+            from_c = await socket_a.receive_json_from(timeout=5)
+
+            # Senders get their own copy for their other devices
+            echo_b = await socket_b.receive_json_from(timeout=5)
+            await socket_c.receive_json_from(timeout=5)
+            self.assertTrue(await socket_b.receive_nothing())
+
+            for socket in (socket_a, socket_b, socket_c):
+                await socket.disconnect()
+            return from_b, from_c, echo_b
+
+        from_b, from_c, echo_b = async_to_sync(exchange)()
+        self.assertEqual(from_b['type'], 'message')
+        self.assertEqual(from_b['conversation_key'], Conversation.key(self.user_a.id, self.user_b.id))
+        self.assertEqual(from_b['message']['content'], 'From B')
+        self.assertEqual(from_c['conversation_key'], Conversation.key(self.user_a.id, self.user_c.id))
+        self.assertEqual(echo_b, from_b)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_socket_joins_only_its_user_group(self):
+        async def connect_and_inspect():
+            socket = communicator_for(self.user_a)
+            await socket.connect()
+            groups = dict(get_channel_layer().groups)
+            await socket.disconnect()
+            return groups
+
+        groups = async_to_sync(connect_and_inspect)()
+        self.assertEqual(list(groups), [f'user_{self.user_a.id}'])
+
+    def test_legacy_route_filters_to_its_conversation(self):
+        async def exchange():
+            legacy_a = communicator_for(self.user_a, f'/ws/chat/{self.user_b.id}/')
+            socket_c = communicator_for(self.user_c)
+            await legacy_a.connect()
+            await socket_c.connect()
+
+            await socket_c.send_json_to({'recipient_id': self.user_a.id, 'message': 'From C'})
+            await socket_c.receive_json_from(timeout=5)
+            filtered = await legacy_a.receive_nothing()
+
+            # The recipient defaults to the peer in the URL
+            await legacy_a.send_json_to({'message': 'Hello B'})
+            echoed = await legacy_a.receive_json_from(timeout=5)
+
+            await legacy_a.disconnect()
+            await socket_c.disconnect()
+            return filtered, echoed
+
+        filtered, echoed = async_to_sync(exchange)()
+        self.assertTrue(filtered)
+        self.assertEqual(echoed['message']['content'], 'Hello B')
+        self.assertTrue(Message.objects.filter(sender=self.user_a, receiver=self.user_b).exists())
+
+    def test_invalid_frames_get_error_replies(self):
+        async def exchange():
+            socket = communicator_for(self.user_a)
+            await socket.connect()
+            replies = []
+            for frame in ('not json', '{"message": "no recipient"}', '{"recipient_id": 999999, "message": "hi"}', '{"type": "bogus"}'):
+                await socket.send_to(text_data=frame)
+                replies.append(await socket.receive_json_from(timeout=5))
+            await socket.disconnect()
+            return replies
+
+        replies = async_to_sync(exchange)()
+        self.assertEqual([r['type'] for r in replies], ['error'] * 4)
+        self.assertFalse(Message.objects.exists())
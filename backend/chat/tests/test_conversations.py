@@ -0,0 +1,151 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from chat.models import Conversation, Message
+
+User = get_user_model()
+
+class ConversationInboxTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+        self.client_b = APIClient()
+        self.client_b.force_authenticate(user=self.user_b)
+
+    def send(self, client, receiver, content):
+        response = client.post('/api/chat/messages/', {'receiver_id': receiver.id, 'content': content}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_message_write_updates_conversation(self):
+        self.send(self.client_b, self.user_a, 'Hello')
+        last_id = self.send(self.client_b, self.user_a, 'Are you there?')
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(Conversation.pair(self.user_b.id, self.user_a.id), (conversation.low_user_id, conversation.high_user_id))
+        self.assertEqual(conversation.last_message_id, last_id)
+        self.assertEqual(conversation.unread_count_for(self.user_a.id), 2)
+        self.assertEqual(conversation.unread_count_for(self.user_b.id), 0)
+
+    def test_out_of_order_record_keeps_latest_message(self):
+        first = Message.objects.create(sender=self.user_a, receiver=self.user_b, content='first')
+        second = Message.objects.create(sender=self.user_a, receiver=self.user_b, content='second')
+        Conversation.objects.record_messages([second])
+        Conversation.objects.record_messages([first])
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.last_message_id, second.id)
+        self.assertEqual(conversation.unread_count_for(self.user_b.id), 2)
+
+    def test_inbox_is_ordered_by_last_activity(self):
+        self.send(self.client_a, self.user_b, 'To B')
+        self.send(self.client_a, self.user_c, 'To C')
+
+        response = self.client_a.get('/api/chat/inbox/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['other_user']['id'] for c in response.data], [self.user_c.id, self.user_b.id])
+        self.assertEqual(response.data[0]['last_message']['content'], 'To C')
+        self.assertEqual(response.data[0]['unread_count'], 0)
+
+        # Activity in the older conversation moves it back to the top
+        self.send(self.client_b, self.user_a, 'Reply from B')
+        response = self.client_a.get('/api/chat/inbox/')
+        self.assertEqual([c['other_user']['id'] for c in response.data], [self.user_b.id, self.user_c.id])
+        self.assertEqual(response.data[0]['unread_count'], 1)
+
+    def test_inbox_pages_with_before_id(self):
+        self.send(self.client_a, self.user_b, 'To B')
+        self.send(self.client_a, self.user_c, 'To C')
+
+        response = self.client_a.get('/api/chat/inbox/?limit=1')
+        self.assertEqual(len(response.data), 1)
+        cursor = response.data[0]['last_message']['id']
+
+        response = self.client_a.get(f'/api/chat/inbox/?limit=1&before_id={cursor}')
+        self.assertEqual([c['other_user']['id'] for c in response.data], [self.user_b.id])
+
+        with self.assertNumQueries(2):
+            self.client_a.get('/api/chat/inbox/?limit=50')
+
+class ReadWatermarkTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+        self.from_b = [self.create_message(self.user_b, self.user_a, f"B {i}") for i in range(4)]
+        self.from_c = [self.create_message(self.user_c, self.user_a, f"C {i}") for i in range(2)]
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def create_message(self, sender, receiver, content):
+        message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+        Conversation.objects.record_messages([message])
+        return message
+
+    def conversation(self, other):
+        return Conversation.objects.get(**dict(zip(('low_user_id', 'high_user_id'), Conversation.pair(self.user_a.id, other.id))))
+
+    def test_chat_room_view_marks_conversation_read_in_one_write(self):
+        self.client.force_login(self.user_a)
+        response = self.client.get(f'/chat/room/{self.user_b.id}/')
+        self.assertEqual(response.status_code, 200)
+
+        conversation = self.conversation(self.user_b)
+        self.assertEqual(conversation.read_id_for(self.user_a.id), self.from_b[-1].id)
+        self.assertEqual(conversation.unread_count_for(self.user_a.id), 0)
+        # Rows are left untouched; read state lives on the conversation
+        self.assertFalse(Message.objects.filter(is_read=True).exists())
+
+        with self.assertNumQueries(1):
+            Conversation.objects.mark_read(self.user_a.id, self.user_b.id)
+
+    def test_is_read_is_derived_from_watermark(self):
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id, up_to_id=self.from_b[1].id)
+
+        response = self.client_a.get(f'/api/chat/messages/?user_id={self.user_b.id}')
+        self.assertEqual([m['is_read'] for m in response.data], [True, True, False, False])
+
+    def test_message_detail_and_create_derive_is_read_from_watermark(self):
+        url = f'/api/chat/messages/{self.from_b[1].id}/'
+        self.assertFalse(self.client_a.get(url).data['is_read'])
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id, up_to_id=self.from_b[1].id)
+        self.assertTrue(self.client_a.get(url).data['is_read'])
+        self.assertFalse(self.client_a.get(f'/api/chat/messages/{self.from_b[2].id}/').data['is_read'])
+
+        client_b = APIClient()
+        client_b.force_authenticate(user=self.user_b)
+        response = client_b.post('/api/chat/messages/', {'receiver_id': self.user_a.id, 'content': "B 4"})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['is_read'])
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id)
+        self.assertTrue(client_b.get(f"/api/chat/messages/{response.data['id']}/").data['is_read'])
+
+    def test_batch_mark_read_advances_several_watermarks(self):
+        response = self.client_a.post('/api/chat/inbox/mark_read/', {'watermarks': [
+            {'user_id': self.user_b.id, 'message_id': self.from_b[2].id},
+            {'user_id': self.user_c.id, 'message_id': self.from_c[-1].id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 2)
+
+        self.assertEqual(self.conversation(self.user_b).unread_count_for(self.user_a.id), 1)
+        self.assertEqual(self.conversation(self.user_c).unread_count_for(self.user_a.id), 0)
+
+    def test_watermark_never_moves_backwards_or_past_last_message(self):
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id, up_to_id=self.from_b[2].id)
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id, up_to_id=self.from_b[0].id)
+        self.assertEqual(self.conversation(self.user_b).read_id_for(self.user_a.id), self.from_b[2].id)
+
+        Conversation.objects.mark_read(self.user_a.id, self.user_b.id, up_to_id=10 ** 12)
+        self.assertEqual(self.conversation(self.user_b).read_id_for(self.user_a.id), self.from_b[-1].id)
+
+    def test_batch_mark_read_rejects_empty_payload(self):
+        response = self.client_a.post('/api/chat/inbox/mark_read/', {'watermarks': []}, format='json')
+        self.assertEqual(response.status_code, 400)
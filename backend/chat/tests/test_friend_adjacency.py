@@ -0,0 +1,57 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from chat.models import FriendAdjacency, Friendship, are_friends
+
+User = get_user_model()
+
+class FriendAdjacencyTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def befriend(self, sender, receiver):
+        friendship = Friendship.objects.create(sender=sender, receiver=receiver)
+        friendship.status = Friendship.ACCEPTED
+        friendship.save()
+        return friendship
+
+    def test_edges_follow_friendship_status(self):
+        friendship = Friendship.objects.create(sender=self.user_a, receiver=self.user_b)
+        self.assertFalse(are_friends(self.user_a.id, self.user_b.id))
+
+        friendship.status = Friendship.ACCEPTED
+        friendship.save()
+        self.assertTrue(are_friends(self.user_a.id, self.user_b.id))
+        self.assertTrue(are_friends(self.user_b.id, self.user_a.id))
+
+        friendship.status = Friendship.REJECTED
+        friendship.save()
+        self.assertFalse(FriendAdjacency.objects.exists())
+
+        friendship.status = Friendship.ACCEPTED
+        friendship.save()
+        friendship.delete()
+        self.assertFalse(FriendAdjacency.objects.exists())
+
+    def test_list_friends_is_one_query(self):
+        self.befriend(self.user_a, self.user_b)
+        self.befriend(self.user_c, self.user_a)
+        Friendship.objects.create(sender=self.user_b, receiver=self.user_c)
+
+        with self.assertNumQueries(1):
+            response = self.client_a.get('/api/chat/friendship/list_friends/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([u['email'] for u in response.data], ['user_c@example.com', 'user_b@example.com'])
+        self.assertEqual(FriendAdjacency.objects.friend_ids(self.user_b.id), [self.user_a.id])
+
+    def test_friends_page_lists_friends(self):
+        self.befriend(self.user_b, self.user_a)
+        self.client.force_login(self.user_a)
+        response = self.client.get('/chat/friends/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['friends'], [self.user_b])
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from chat.models import Friendship
+
+User = get_user_model()
+
+class FriendInviteTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+        self.client_b = APIClient()
+        self.client_b.force_authenticate(user=self.user_b)
+
+    def test_pair_key_is_the_same_in_both_directions(self):
+        friendship = Friendship.objects.send_invite(self.user_b, self.user_a)
+        self.assertEqual(friendship.pair_key, f'{self.user_a.id}_{self.user_b.id}')
+        self.assertIsNone(Friendship.objects.send_invite(self.user_a, self.user_b))
+        self.assertIsNone(Friendship.objects.send_invite(self.user_b, self.user_a))
+        self.assertEqual(Friendship.objects.count(), 1)
+
+    def test_api_reports_existing_request_in_either_direction(self):
+        response = self.client_a.post('/api/chat/friendship/send_invite/', {'receiver_email': 'user_b@example.com'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client_b.post('/api/chat/friendship/send_invite/', {'receiver_email': 'user_a@example.com'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Friendship request already exists.", response.data)
+        self.assertEqual(Friendship.objects.count(), 1)
+
+    def test_web_view_reports_existing_request(self):
+        Friendship.objects.send_invite(self.user_a, self.user_b)
+        self.client.force_login(self.user_b)
+        response = self.client.get(f'/chat/invite/{self.user_a.id}/', follow=True)
+        self.assertEqual(
+            [str(m) for m in response.context['messages']],
+            [f"Friendship request already exists with {self.user_a.email}."],
+        )
+        self.assertEqual(Friendship.objects.count(), 1)
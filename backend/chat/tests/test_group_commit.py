@@ -0,0 +1,92 @@
+import asyncio
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from chat import group_commit
+from chat.models import Conversation, Message
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+class MessageWriteBufferTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+    def test_concurrent_submissions_share_one_write(self):
+        async def submit_all():
+            buffer = group_commit.MessageWriteBuffer(flush_interval=1, max_batch=4)
+            return await asyncio.gather(
+                buffer.submit(self.user_a.id, self.user_b.id, 'one'),
+                buffer.submit(self.user_b.id, self.user_a.id, 'two'),
+                buffer.submit(self.user_a.id, self.user_c.id, 'three'),
+                buffer.submit(self.user_a.id, self.user_b.id, 'four'),
+            )
+
+        with mock.patch.object(group_commit, 'write_messages', wraps=group_commit.write_messages) as write:
+            payloads = async_to_sync(submit_all)()
+
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual([p['content'] for p in payloads], ['one', 'two', 'three', 'four'])
+        self.assertEqual(payloads[0]['sender']['id'], self.user_a.id)
+        self.assertEqual(sorted(p['id'] for p in payloads), list(Message.objects.order_by('id').values_list('id', flat=True)))
+
+        conversation = Conversation.objects.get(low_user=self.user_a, high_user=self.user_b)
+        self.assertEqual(conversation.last_message_id, payloads[3]['id'])
+        self.assertEqual(conversation.unread_count_for(self.user_b.id), 2)
+        self.assertEqual(conversation.unread_count_for(self.user_a.id), 1)
+
+    def test_flush_interval_bounds_the_wait(self):
+        async def submit_one():
+            buffer = group_commit.MessageWriteBuffer(flush_interval=0.01, max_batch=100)
+            return await asyncio.wait_for(buffer.submit(self.user_a.id, self.user_b.id, 'alone'), timeout=5)
+
+        payload = async_to_sync(submit_one)()
+        self.assertEqual(Message.objects.get().id, payload['id'])
+
+    def test_unknown_receiver_only_fails_its_own_submission(self):
+        async def submit_all():
+            buffer = group_commit.MessageWriteBuffer(flush_interval=1, max_batch=2)
+            return await asyncio.gather(
+                buffer.submit(self.user_a.id, 999999, 'lost'),
+                buffer.submit(self.user_a.id, self.user_b.id, 'kept'),
+                return_exceptions=True,
+            )
+
+        lost, kept = async_to_sync(submit_all)()
+        self.assertIsInstance(lost, User.DoesNotExist)
+        self.assertEqual(kept['content'], 'kept')
+        self.assertEqual(Message.objects.count(), 1)
+
+@override_settings(CHAT_GROUP_COMMIT={'ENABLED': True, 'FLUSH_INTERVAL': 0.01, 'MAX_BATCH': 10})
+class GroupCommitConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+    def test_message_is_broadcast_with_assigned_id(self):
+        async def exchange():
+            sender = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.user_b.id}/')
+            sender.scope['user'] = self.user_a
+            receiver = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.user_a.id}/')
+            receiver.scope['user'] = self.user_b
+            self.assertTrue((await sender.connect())[0])
+            self.assertTrue((await receiver.connect())[0])
+
+            await sender.send_json_to({'message': 'Hello B'})
+            received = await receiver.receive_json_from(timeout=5)
+            echoed = await sender.receive_json_from(timeout=5)
+
+            await sender.disconnect()
+            await receiver.disconnect()
+            return received, echoed
+
+        received, echoed = async_to_sync(exchange)()
+        message = Message.objects.get()
+        self.assertEqual(received['message']['id'], message.id)
+        self.assertEqual(received['message']['content'], 'Hello B')
+        self.assertEqual(echoed, received)
@@ -0,0 +1,105 @@
+import datetime
+import io
+import os
+import tempfile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from chat.archive import Segment, archive_conversation, archive_messages, get_config
+from chat.models import ArchiveSegment, Conversation, Message
+
+User = get_user_model()
+
+class MessageArchiveTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CHAT_ARCHIVE={'DIRECTORY': directory.name, 'MIN_AGE_DAYS': 30, 'BLOCK_MESSAGES': 4})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+
+        self.messages = []
+        for i in range(30):
+            sender, receiver = (self.user_a, self.user_b) if i % 3 else (self.user_b, self.user_a)
+            message = Message.objects.create(sender=sender, receiver=receiver, content=f"Msg {i} ünïcode")
+            Conversation.objects.record_messages([message])
+            self.messages.append(message)
+        self.age(self.messages[:20], days=60)
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def age(self, messages, days):
+        Message.objects.filter(id__in=[m.id for m in messages]).update(timestamp=timezone.now() - datetime.timedelta(days=days))
+
+    def walk(self, limit, ascending=False):
+        """Every page of the conversation, following the cursors."""
+        pages = []
+        query = '' if not ascending else '&after_id=0'
+        while True:
+            response = self.client_a.get(f'/api/chat/messages/?user_id={self.user_b.id}&limit={limit}{query}')
+            self.assertEqual(response.status_code, 200)
+            if not response.data:
+                return pages
+            pages.append(response.content)
+            query = f"&before_id={response.data[0]['id']}" if not ascending else f"&after_id={response.data[-1]['id']}"
+
+    def test_pages_are_unchanged_by_archiving(self):
+        Conversation.objects.mark_read(self.user_b.id, self.user_a.id, up_to_id=self.messages[10].id)
+        before = (self.walk(7), self.walk(7, ascending=True))
+
+        self.assertEqual(archive_messages(), (1, 20))
+        self.assertEqual(Message.objects.count(), 10)
+        self.assertEqual((self.walk(7), self.walk(7, ascending=True)), before)
+
+    def test_last_message_is_never_archived(self):
+        Message.objects.filter(id__in=[m.id for m in self.messages[20:29]]).delete()
+        self.age(self.messages[29:], days=60)
+        archive_messages()
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [self.messages[29].id])
+        self.assertEqual(Conversation.objects.get().archived_up_to_id, self.messages[19].id)
+
+    def test_archiving_is_incremental(self):
+        archive_messages()
+        self.assertEqual(archive_messages(), (0, 0))
+
+        self.age(self.messages[20:25], days=45)
+        out = io.StringIO()
+        call_command('archive_messages', stdout=out)
+        self.assertIn("Archived 5 messages older than 30 days from 1 conversations.", out.getvalue())
+
+        segments = list(ArchiveSegment.objects.order_by('first_id'))
+        self.assertEqual([(s.first_id, s.last_id, s.message_count) for s in segments], [
+            (self.messages[0].id, self.messages[19].id, 20),
+            (self.messages[20].id, self.messages[24].id, 5),
+        ])
+        segment = Segment(os.path.join(self.directory, segments[0].path))
+        self.assertEqual(len(segment.blocks), 5)
+        self.assertEqual([r[0] for r in segment.read(before_id=self.messages[10].id, limit=3, newest=True)], [m.id for m in self.messages[7:10]])
+        segment.close()
+
+    def test_hot_pages_do_not_touch_the_archive(self):
+        archive_messages()
+        # The conversation's state, then one query per direction
+        with self.assertNumQueries(3):
+            response = self.client_a.get(f'/api/chat/messages/?user_id={self.user_b.id}&limit=5')
+        self.assertEqual([m['id'] for m in response.data], [m.id for m in self.messages[25:]])
+
+    def test_overlapping_runs_archive_each_message_once(self):
+        before = self.walk(7)
+        # Both runs read the conversation before either has written anything
+        first, second = Conversation.objects.get(), Conversation.objects.get()
+        cutoff = timezone.now() - datetime.timedelta(days=30)
+        self.assertEqual(archive_conversation(first, cutoff, get_config()), 20)
+        self.assertEqual(archive_conversation(second, cutoff, get_config()), 0)
+
+        segment = ArchiveSegment.objects.get()
+        # The losing run removed its file
+        self.assertEqual(os.listdir(os.path.join(self.directory, os.path.dirname(segment.path))), [os.path.basename(segment.path)])
+        self.assertEqual(self.walk(7), before)
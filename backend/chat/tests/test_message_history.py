@@ -0,0 +1,51 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from chat.models import Message
+
+User = get_user_model()
+
+class MessageHistoryPaginationTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+        # Alternate directions so both halves of the keyset merge are exercised
+        self.messages = []
+        for i in range(10):
+            sender, receiver = (self.user_a, self.user_b) if i % 2 == 0 else (self.user_b, self.user_a)
+            self.messages.append(Message.objects.create(sender=sender, receiver=receiver, content=f"Msg {i}"))
+        Message.objects.create(sender=self.user_c, receiver=self.user_a, content="Other conversation")
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def get_ids(self, query):
+        response = self.client_a.get(f'/api/chat/messages/?user_id={self.user_b.id}{query}')
+        self.assertEqual(response.status_code, 200)
+        return [m['id'] for m in response.data]
+
+    def test_default_page_is_newest_messages_oldest_first(self):
+        ids = self.get_ids('&limit=4')
+        self.assertEqual(ids, [m.id for m in self.messages[-4:]])
+
+    def test_before_id_walks_backwards_through_history(self):
+        ids = self.get_ids(f'&limit=4&before_id={self.messages[6].id}')
+        self.assertEqual(ids, [m.id for m in self.messages[2:6]])
+
+        ids = self.get_ids(f'&limit=4&before_id={self.messages[2].id}')
+        self.assertEqual(ids, [m.id for m in self.messages[:2]])
+
+    def test_after_id_returns_oldest_messages_first(self):
+        ids = self.get_ids(f'&limit=3&after_id={self.messages[3].id}')
+        self.assertEqual(ids, [m.id for m in self.messages[4:7]])
+
+    def test_invalid_limit_falls_back_to_default(self):
+        ids = self.get_ids('&limit=abc')
+        self.assertEqual(ids, [m.id for m in self.messages])
+
+    def test_page_query_count_does_not_depend_on_history_length(self):
+        # One query per direction plus the conversation's read watermarks
+        with self.assertNumQueries(3):
+            self.get_ids('&limit=2')
@@ -0,0 +1,143 @@
+import datetime
+import io
+import tempfile
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from django.utils import timezone
+from chat.archive import archive_messages
+from chat.group_commit import write_messages
+from chat.models import Conversation, Message, MessageSearchToken
+from chat.search import search_messages
+
+User = get_user_model()
+
+class MessageSearchTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def send(self, sender, receiver, content):
+        client = APIClient()
+        client.force_authenticate(user=sender)
+        response = client.post('/api/chat/messages/', {'receiver_id': receiver.id, 'content': content})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def search_ids(self, user, query, **kwargs):
+        rows, has_more = search_messages(user.id, query, **kwargs)
+        return [row['id'] for row in rows]
+
+    def test_messages_are_indexed_as_they_are_stored(self):
+        first = self.send(self.user_a, self.user_b, "Lunch on Friday?")
+        [stored] = write_messages([(self.user_b.id, self.user_a.id, "Friday works, lunch at noon")])
+
+        self.assertEqual(self.search_ids(self.user_a, 'lunch'), [stored['id'], first])
+        self.assertEqual(self.search_ids(self.user_b, 'FRIDAY noon'), [stored['id']])
+        self.assertEqual(self.search_ids(self.user_a, 'dinner'), [])
+
+    def test_search_is_limited_to_own_conversations(self):
+        mine = self.send(self.user_a, self.user_b, "secret plans")
+        theirs = self.send(self.user_b, self.user_c, "secret plans too")
+        self.assertEqual(self.search_ids(self.user_a, 'secret'), [mine])
+
+        note = self.send(self.user_c, self.user_c, "secret note to self")
+        self.assertEqual(self.search_ids(self.user_c, 'secret'), [note, theirs])
+
+    def test_exact_words_rank_above_prefixes_then_newest(self):
+        exact_old = self.send(self.user_a, self.user_b, "the project deadline")
+        prefix = self.send(self.user_b, self.user_a, "projector is broken")
+        exact_new = self.send(self.user_a, self.user_b, "new project")
+
+        self.assertEqual(self.search_ids(self.user_a, 'project'), [exact_new, exact_old, prefix])
+        # Short terms only match whole words
+        self.assertEqual(self.search_ids(self.user_a, 'pr'), [])
+        self.assertEqual(self.search_ids(self.user_a, 'is'), [prefix])
+
+    def test_deleted_users_leave_the_index(self):
+        self.send(self.user_a, self.user_b, "delete me")
+        self.user_b.delete()
+        self.assertFalse(MessageSearchToken.objects.exists())
+        self.assertEqual(self.search_ids(self.user_a, 'delete'), [])
+
+    def test_archived_messages_stay_searchable(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CHAT_ARCHIVE={'DIRECTORY': directory.name, 'BLOCK_MESSAGES': 2})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        old = [self.send(self.user_a, self.user_b, f"old news {i}") for i in range(5)]
+        Message.objects.filter(id__in=old).update(timestamp=timezone.now() - datetime.timedelta(days=60))
+        new = self.send(self.user_b, self.user_a, "news today")
+        self.assertEqual(archive_messages(min_age_days=30), (1, 5))
+        self.assertFalse(Message.objects.filter(id__in=old).exists())
+
+        self.assertEqual(self.search_ids(self.user_a, 'news'), [new] + old[::-1])
+        rows, has_more = search_messages(self.user_b.id, 'old 3')
+        self.assertEqual([(row['id'], row['content'], row['sender__email']) for row in rows], [(old[3], "old news 3", self.user_a.email)])
+
+        MessageSearchToken.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_message_search_index', stdout=out)
+        self.assertIn("Indexed 6 messages.", out.getvalue())
+        self.assertEqual(self.search_ids(self.user_a, 'news'), [new] + old[::-1])
+
+    def test_common_terms_read_a_bounded_number_of_candidates(self):
+        exact = self.send(self.user_a, self.user_b, "project kickoff")
+        prefixes = [self.send(self.user_b, self.user_a, f"projector {i}") for i in range(5)]
+        note = self.send(self.user_a, self.user_a, "projects to self")
+        self.assertEqual(self.search_ids(self.user_a, 'project'), [exact, note] + prefixes[::-1])
+
+        with mock.patch('chat.search.MAX_CANDIDATES', 2):
+            # The only exact match is the oldest message, and still comes first
+            rows, has_more = search_messages(self.user_a.id, 'project')
+            self.assertEqual([row['id'] for row in rows], [exact, note])
+            self.assertTrue(has_more)
+            self.assertEqual(self.search_ids(self.user_a, 'project kickoff'), [exact])
+        with mock.patch('chat.search.MAX_EXPANSIONS', 2):
+            # The shortest words starting with the prefix
+            rows, has_more = search_messages(self.user_a.id, 'proj')
+            self.assertEqual([row['id'] for row in rows], [note, exact])
+            self.assertTrue(has_more)
+        self.assertEqual(self.search_ids(self.user_b, 'projectors'), [])
+
+    def test_rebuild_index(self):
+        ids = [self.send(self.user_a, self.user_b, f"word{i} common") for i in range(5)]
+        MessageSearchToken.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('rebuild_message_search_index', '--batch-size', '2', stdout=out)
+        self.assertIn("Indexed 5 messages.", out.getvalue())
+        self.assertEqual(self.search_ids(self.user_a, 'common'), ids[::-1])
+        self.assertEqual(self.search_ids(self.user_a, 'word3'), [ids[3]])
+
+    def test_search_api_pages_results(self):
+        ids = [self.send(self.user_b if i % 2 else self.user_a, self.user_a if i % 2 else self.user_b, f"status update {i}") for i in range(5)]
+        Conversation.objects.mark_read(self.user_b.id, self.user_a.id, up_to_id=ids[2])
+
+        # The dictionary lookup, one per side, the page's rows and their watermarks
+        with self.assertNumQueries(5):
+            response = self.client_a.get('/api/chat/messages/search/', {'q': 'update', 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in response.data['results']], ids[:1:-1])
+        self.assertEqual(response.data['next_offset'], 3)
+
+        first = response.data['results'][0]
+        self.assertEqual(first['content'], "status update 4")
+        self.assertEqual(first['conversation_key'], Conversation.key(self.user_a.id, self.user_b.id))
+        self.assertFalse(first['is_read'])
+        self.assertTrue(response.data['results'][2]['is_read'])
+
+        response = self.client_a.get('/api/chat/messages/search/', {'q': 'update', 'limit': 3, 'offset': 3})
+        self.assertEqual([m['id'] for m in response.data['results']], ids[1::-1])
+        self.assertIsNone(response.data['next_offset'])
+
+        response = self.client_a.get('/api/chat/messages/search/', {'q': '  '})
+        self.assertEqual(response.data, {'results': [], 'next_offset': None})
@@ -0,0 +1,66 @@
+import datetime
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from chat.models import Conversation, Message
+from chat.renderers import FastJSONRenderer
+from chat.serializers import MessageSerializer
+
+User = get_user_model()
+
+class MessageListFastPathTest(TestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        Message.objects.bulk_create([
+            Message(sender=self.user_a if i % 3 else self.user_b, receiver=self.user_b if i % 3 else self.user_a, content=f"Msg {i} \u2028 ünïcode")
+            for i in range(300)
+        ])
+        Conversation.objects.record_messages(list(Message.objects.all()))
+        self.client_a = APIClient()
+        self.client_a.force_authenticate(user=self.user_a)
+
+    def get_page(self, query=''):
+        response = self.client_a.get(f'/api/chat/messages/?user_id={self.user_b.id}{query}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_output_matches_message_serializer(self):
+        Conversation.objects.mark_read(self.user_b.id, self.user_a.id, up_to_id=Message.objects.order_by('id')[150].id)
+        response = self.get_page('&limit=200')
+
+        # The newest 200 of the 300 messages, oldest first
+        messages = Message.objects.select_related('sender', 'receiver').filter(
+            Q(sender=self.user_a, receiver=self.user_b) | Q(sender=self.user_b, receiver=self.user_a)
+        ).order_by('id')[100:]
+        watermarks = Conversation.objects.read_watermarks(self.user_a.id, self.user_b.id)
+        expected = MessageSerializer(messages, many=True, context={'read_watermarks': watermarks}).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+        self.assertEqual(len(response.json()), 200)
+        self.assertTrue(any(m['is_read'] for m in response.json()))
+        self.assertFalse(all(m['is_read'] for m in response.json()))
+
+    def test_query_count_is_fixed_regardless_of_page_size(self):
+        for limit in (1, 50, 200):
+            # One query per direction plus the read watermarks
+            with self.assertNumQueries(3):
+                self.get_page(f'&limit={limit}')
+
+class FastJSONRendererTest(SimpleTestCase):
+    def test_matches_json_renderer(self):
+        data = {
+            'text': 'line\u2028separator \u2029 ünïcode "quoted"',
+            'when': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'nested': [{'id': 1, 'ok': True, 'none': None}],
+            7: 'int key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indented_output_falls_back(self):
+        data = {'id': 1}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from channels.routing import URLRouter
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from chat.outbound import CLOSE, COALESCE, DROP_EPHEMERAL, OVERFLOW_CLOSE_CODE, OutboundQueue, connection_stats
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+def communicator_for(user, path='/ws/chat/'):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    return communicator
+
+def message(message_id):
+    return {'type': 'message', 'conversation_key': '1_2', 'message': {'id': message_id}}
+
+def typing(state):
+    return {'type': 'typing', 'conversation_key': '1_2', 'user_id': 2, 'state': state}
+
+def presence(online=(), offline=()):
+    return {'type': 'presence', 'online': list(online), 'offline': list(offline)}
+
+class OutboundQueueTest(SimpleTestCase):
+    def drain(self, queue):
+        """Send every waiting frame, and have the client acknowledge them."""
+        frames = [queue.pop() for i in range(len(queue))]
+        queue.ack(received=queue.sent)
+        return frames
+
+    def test_drop_ephemeral_keeps_durable_frames(self):
+        queue = OutboundQueue(3, DROP_EPHEMERAL)
+        for frame in (typing('start'), message(1), presence([5]), typing('stop'), message(2)):
+            self.assertTrue(queue.put(frame))
+        # The incoming typing frame, then the oldest queued one, made way
+        self.assertEqual(self.drain(queue), [message(1), presence([5]), message(2)])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_coalesce_merges_superseded_frames(self):
+        queue = OutboundQueue(3, COALESCE)
+        for frame in (typing('start'), presence([5]), message(1), typing('stop'), presence([6], [5])):
+            self.assertTrue(queue.put(frame))
+        self.assertEqual(self.drain(queue), [message(1), typing('stop'), presence([6], [5])])
+        self.assertEqual((queue.coalesced, queue.dropped), (2, 0))
+
+    def test_overflow_leaves_only_a_resume_frame(self):
+        queue = OutboundQueue(2, CLOSE)
+        queue.put({'type': 'notifications', 'notifications': [{'id': 7}], 'unread_count': 1})
+        queue.put(message(10))
+        self.drain(queue)
+        queue.put(typing('start'))
+        queue.put(message(11))
+        self.assertFalse(queue.put(message(12)))
+        self.assertFalse(queue.put(message(13)))
+        self.assertEqual(self.drain(queue), [
+            {'type': 'resume', 'reason': 'slow_consumer', 'last_message_id': 10, 'notifications_since': 7},
+        ])
+        self.assertEqual(queue.stats()['dropped'], 3)
+        self.assertTrue(queue.stats()['overflowed'])
+
+    def test_unacknowledged_frames_count_against_the_queue(self):
+        queue = OutboundQueue(3, DROP_EPHEMERAL)
+        queue.ack(received=0)
+        for frame in (message(1), typing('start'), message(2)):
+            queue.put(frame)
+        [queue.pop() for i in range(3)]
+        self.assertEqual((len(queue), queue.depth), (0, 3))
+        # Sent but unread frames leave no room; ephemeral ones make way
+        self.assertTrue(queue.put(typing('stop')))
+        self.assertEqual((queue.depth, queue.dropped), (3, 1))
+
+        queue.ack(last_message_id=1)
+        self.assertEqual(queue.depth, 2)
+        queue.ack(received=1)
+        self.assertEqual(queue.depth, 2)
+        queue.ack(last_message_id=2)
+        self.assertEqual(queue.stats()['unacked'], 0)
+        self.assertTrue(queue.put(message(3)))
+        queue.pop()
+        queue.ack(received=4)
+        self.assertEqual(queue.depth, 0)
+
+    def test_sent_frames_are_not_counted_until_the_client_acks(self):
+        queue = OutboundQueue(3, DROP_EPHEMERAL)
+        for i in range(10):
+            self.assertTrue(queue.put(message(i)))
+            queue.pop()
+        self.assertEqual((queue.depth, queue.stats()['unacked'], queue.dropped), (0, 0, 0))
+
+        queue.ack(received=10)
+        for i in range(3):
+            queue.put(message(10 + i))
+            queue.pop()
+        self.assertEqual(queue.depth, 3)
+        queue.ack(received=12)
+        self.assertEqual(queue.depth, 1)
+
+@override_settings(CHAT_OUTBOUND={'MAX_QUEUE': 5, 'POLICY': 'drop_ephemeral'})
+class SlowConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+    async def send_messages(self, count):
+        sender = communicator_for(self.user_b)
+        await sender.connect()
+        for i in range(count):
+            await sender.send_json_to({'type': 'message', 'recipient_id': self.user_a.id, 'message': f"Msg {i}"})
+            await sender.receive_json_from(timeout=5)
+            await sender.send_json_to({'type': 'ack', 'received': i + 1})
+        await sender.disconnect()
+
+    def test_client_that_stops_acking_is_closed_with_a_resume_hint(self):
+        async def scenario():
+            stalled = communicator_for(self.user_a)
+            await stalled.connect()
+            # Opts in to acks, then never reads another frame
+            await stalled.send_json_to({'type': 'ack', 'received': 0})
+            await self.send_messages(20)
+
+            frames = []
+            while True:
+                output = await stalled.receive_output(timeout=5)
+                if output['type'] == 'websocket.close':
+                    break
+                frames.append(json.loads(output['text']))
+            stats = [stats for stats in connection_stats() if stats['user_id'] == self.user_a.id]
+            # Let the consumer leave its group, as the server would
+            await stalled.disconnect()
+            return frames, output, stats
+
+        frames, closed, stats = async_to_sync(scenario)()
+        # The queue's worth of messages went out unacknowledged, then the resume frame
+        self.assertEqual([frame['message']['content'] for frame in frames[:-1]], [f"Msg {i}" for i in range(5)])
+        self.assertEqual(frames[-1], {
+            'type': 'resume', 'reason': 'slow_consumer',
+            'last_message_id': frames[-2]['message']['id'], 'notifications_since': None,
+        })
+        self.assertEqual(closed['code'], OVERFLOW_CLOSE_CODE)
+        self.assertEqual([(s['sent'], s['unacked'], s['overflowed']) for s in stats], [(6, 6, True)])
+
+    def test_acking_client_receives_everything(self):
+        async def scenario():
+            reader = communicator_for(self.user_a)
+            await reader.connect()
+            sending = asyncio.ensure_future(self.send_messages(20))
+            frames = []
+            for i in range(20):
+                frames.append(await reader.receive_json_from(timeout=5))
+                await reader.send_json_to({'type': 'ack', 'last_message_id': frames[-1]['message']['id']})
+            await sending
+            [stats] = [stats for stats in connection_stats() if stats['user_id'] == self.user_a.id]
+            await reader.disconnect()
+            return frames, stats
+
+        frames, stats = async_to_sync(scenario)()
+        self.assertEqual([frame['message']['content'] for frame in frames], [f"Msg {i}" for i in range(20)])
+        self.assertFalse(stats['overflowed'])
+        self.assertLessEqual(stats['max_depth'], 5)
+
+    def test_client_that_never_acks_keeps_reading(self):
+        async def scenario():
+            # The per-conversation endpoint's clients predate acks
+            reader = communicator_for(self.user_a, f'/ws/chat/{self.user_b.id}/')
+            await reader.connect()
+            sending = asyncio.ensure_future(self.send_messages(20))
+            frames = [await reader.receive_json_from(timeout=5) for i in range(20)]
+            await sending
+            still_open = await reader.receive_nothing(timeout=0.2)
+            [stats] = [stats for stats in connection_stats() if stats['user_id'] == self.user_a.id]
+            await reader.disconnect()
+            return frames, still_open, stats
+
+        frames, still_open, stats = async_to_sync(scenario)()
+        self.assertEqual([frame['message']['content'] for frame in frames], [f"Msg {i}" for i in range(20)])
+        self.assertTrue(still_open)
+        self.assertEqual((stats['sent'], stats['unacked'], stats['overflowed']), (20, 0, False))
+
+    def test_metrics_endpoint_is_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user_a)
+        self.assertEqual(client.get('/api/chat/metrics/connections/').status_code, 403)
+
+        self.user_a.is_staff = True
+        self.user_a.save()
+        response = client.get('/api/chat/metrics/connections/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['totals']), {'connections', 'queued', 'dropped', 'coalesced', 'overflowed'})
@@ -0,0 +1,173 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from channels.routing import URLRouter
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from chat.models import Friendship
+from chat.consumers import user_group_name
+from chat.layers import LocalBrokerChannelLayer
+from chat.presence import PresenceTracker
+from chat.routing import websocket_urlpatterns
+from chat.tests.test_channel_layer import run_with_broker
+
+User = get_user_model()
+
+def communicator_for(user, path='/ws/chat/'):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    return communicator
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class PresenceTrackerTest(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = PresenceTracker(ttl=30, broadcast_interval=60, offline_grace=5, clock=self.clock)
+
+    def test_devices_and_flapping_only_publish_real_changes(self):
+        async def scenario():
+            changes = []
+            self.tracker.connect(1, 'phone')
+            self.tracker.connect(1, 'laptop')
+            changes.append(self.tracker.pending_changes())
+
+            # One device of two going away changes nothing
+            self.tracker.disconnect(1, 'phone')
+            changes.append(self.tracker.pending_changes())
+
+            # Dropping and reconnecting within the grace period is invisible
+            for i in range(20):
+                self.tracker.disconnect(1, 'laptop')
+                self.tracker.connect(1, 'laptop')
+            self.tracker.disconnect(1, 'laptop')
+            changes.append(self.tracker.pending_changes())
+            self.clock.now += 6
+            changes.append(self.tracker.pending_changes())
+
+            # Online and gone again between two flushes: never published
+            self.tracker.connect(2, 'phone')
+            self.tracker.disconnect(2, 'phone')
+            changes.append(self.tracker.pending_changes())
+            self.tracker._task.cancel()
+            return changes
+
+        self.assertEqual(async_to_sync(scenario)(), [{1: True}, {}, {}, {1: False}, {}])
+
+    def test_connections_expire_without_heartbeats(self):
+        async def scenario():
+            self.tracker.connect(1, 'phone')
+            self.tracker.connect(2, 'phone')
+            self.tracker.pending_changes()
+
+            self.clock.now += 20
+            self.tracker.heartbeat(1, 'phone')
+            self.clock.now += 20
+            expired = self.tracker.pending_changes()
+            self.clock.now += 6
+            expired.update(self.tracker.pending_changes())
+            online = await self.tracker.online([1, 2, 3])
+            self.tracker._task.cancel()
+            return expired, online
+
+        self.assertEqual(async_to_sync(scenario)(), ({2: False}, {1}))
+
+    def test_user_stays_online_while_connected_to_another_worker(self):
+        async def scenario(path):
+            layer_1, layer_2 = LocalBrokerChannelLayer(path), LocalBrokerChannelLayer(path)
+            worker_1 = PresenceTracker(ttl=30, broadcast_interval=60, offline_grace=0, clock=self.clock, store=layer_1)
+            worker_2 = PresenceTracker(ttl=30, broadcast_interval=60, offline_grace=0, clock=self.clock, store=layer_2)
+            changes = []
+            worker_1.connect(1, 'phone')
+            changes.append(await worker_1.global_changes())
+            # Already online elsewhere: nothing to publish
+            worker_2.connect(1, 'laptop')
+            changes.append(await worker_2.global_changes())
+            # Worker 2's snapshot sees users connected only to worker 1
+            worker_1.connect(2, 'phone')
+            await worker_1.global_changes()
+            snapshot = await worker_2.online([1, 2, 3])
+
+            worker_1.disconnect(1, 'phone')
+            changes.append(await worker_1.global_changes())
+            worker_2.disconnect(1, 'laptop')
+            changes.append(await worker_2.global_changes())
+
+            for tracker in (worker_1, worker_2):
+                tracker._task.cancel()
+            await layer_1.close()
+            await layer_2.close()
+            return changes, snapshot
+
+        changes, snapshot = run_with_broker(scenario)
+        self.assertEqual(changes, [{1: True}, {}, {}, {1: False}])
+        self.assertEqual(snapshot, {1, 2})
+
+@override_settings(CHAT_PRESENCE={'TTL': 30, 'BROADCAST_INTERVAL': 0.05, 'OFFLINE_GRACE': 0.3})
+class PresenceBroadcastTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        self.user_c = User.objects.create_user(email='user_c@example.com', password='password123', first_name='User', last_name='C')
+        friendship = Friendship.objects.create(sender=self.user_a, receiver=self.user_b)
+        friendship.status = Friendship.ACCEPTED
+        friendship.save()
+
+    def test_friends_get_batched_presence_changes(self):
+        async def scenario():
+            socket_a = communicator_for(self.user_a)
+            socket_c = communicator_for(self.user_c)
+            await socket_a.connect()
+            await socket_c.connect()
+
+            socket_b = communicator_for(self.user_b)
+            await socket_b.connect()
+            came_online = await socket_a.receive_json_from(timeout=5)
+            # B's friends online when B asks
+            await socket_b.send_json_to({'type': 'presence'})
+            snapshot = await socket_b.receive_json_from(timeout=5)
+
+            # A flapping connection produces no broadcasts
+            for i in range(10):
+                await socket_b.disconnect()
+                socket_b = communicator_for(self.user_b)
+                await socket_b.connect()
+                await socket_b.send_json_to({'type': 'heartbeat'})
+            flapping_quiet = await socket_a.receive_nothing(timeout=0.2)
+
+            await socket_b.disconnect()
+            went_offline = await socket_a.receive_json_from(timeout=5)
+            stranger_quiet = await socket_c.receive_nothing(timeout=0.1)
+            await socket_a.disconnect()
+            await socket_c.disconnect()
+            return came_online, snapshot, flapping_quiet, went_offline, stranger_quiet
+
+        came_online, snapshot, flapping_quiet, went_offline, stranger_quiet = async_to_sync(scenario)()
+        self.assertEqual(came_online, {'type': 'presence', 'online': [self.user_b.id], 'offline': []})
+        self.assertEqual(snapshot, {'type': 'presence', 'online': [self.user_a.id], 'offline': []})
+        self.assertTrue(flapping_quiet)
+        self.assertEqual(went_offline, {'type': 'presence', 'online': [], 'offline': [self.user_b.id]})
+        self.assertTrue(stranger_quiet)
+
+    def test_friends_on_other_workers_get_presence_changes(self):
+        async def scenario():
+            # B is connected to another worker: only its user group is shared
+            channel_layer = get_channel_layer()
+            channel_b = await channel_layer.new_channel()
+            await channel_layer.group_add(user_group_name(self.user_b.id), channel_b)
+
+            tracker = PresenceTracker(ttl=30, broadcast_interval=60, offline_grace=0)
+            tracker.connect(self.user_a.id, 'laptop')
+            await tracker.flush()
+            tracker._task.cancel()
+            event = await asyncio.wait_for(channel_layer.receive(channel_b), timeout=5)
+            await channel_layer.group_discard(user_group_name(self.user_b.id), channel_b)
+            return event
+
+        self.assertEqual(async_to_sync(scenario)(), {'type': 'presence_changed', 'online': [self.user_a.id], 'offline': []})
@@ -0,0 +1,233 @@
+"""
+Query budgets for every REST and web endpoint.
+
+Each endpoint is requested as a user with plenty of friends, pending
+requests, messages and notifications. A view that runs a query per row
+(an N+1) blows its query budget, and the failure lists the SQL it ran,
+grouped by statement shape so the repeated one stands out. Every named
+route in the project's URLconfs must have an entry in ENDPOINTS, so a new
+view can't ship without a budget. Wall-clock budgets are only checked by
+benchmarks/bench_endpoint_budgets.py, which times the same table at larger
+fan-out; timings in a shared test run are too noisy to fail a build on.
+"""
+import re
+import time
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from chat.group_commit import write_messages
+from chat.models import Friendship
+from notifications.models import Notification, NotificationCounter
+
+User = get_user_model()
+
+PASSWORD = 'password123'
+
+# Named routes that aren't ours to budget
+UNBUDGETED_NAMESPACES = ('admin',)
+UNBUDGETED_NAMES = ('schema-json', 'schema-swagger-ui', 'schema-redoc')
+
+
+class Fanout:
+    """The seeded rows the endpoint paths and payloads refer to."""
+
+
+def seed_fanout(friends=30, pending=10, messages=60, notifications=40, prefix='fanout'):
+    """
+    Create a user with ``friends`` accepted friends, ``pending`` incoming
+    requests, ``messages`` messages with their first friend and a few with
+    every other one, and ``notifications`` notifications.
+    """
+    data = Fanout()
+    data.user = User.objects.create_user(email=f'{prefix}@example.com', password=PASSWORD, first_name='Fan', last_name='Out')
+    data.admin = User.objects.create(email=f'{prefix}.admin@example.com', password='!', is_staff=True)
+    Token.objects.create(user_id=data.user.id)
+    others = [
+        User.objects.create(email=f'{prefix}{i}@example.com', password='!', first_name=f'Friend{i}', last_name='Fanout')
+        for i in range(friends + pending + 1)
+    ]
+    data.friends, requesters, (data.stranger,) = others[:friends], others[friends:friends + pending], others[friends + pending:]
+
+    for friend in data.friends:
+        Friendship.objects.create(sender=data.user, receiver=friend, status=Friendship.ACCEPTED)
+    data.requests = [
+        Friendship.objects.create(sender=requester, receiver=data.user, status=Friendship.PENDING)
+        for requester in requesters
+    ]
+
+    data.friend = data.friends[0]
+    rows = [
+        (data.user.id, data.friend.id, f'hello fanout {i}') if i % 2 else (data.friend.id, data.user.id, f'hello fanout {i}')
+        for i in range(messages)
+    ]
+    rows += [(friend.id, data.user.id, 'hello from a friend') for friend in data.friends[1:]]
+    data.messages = write_messages(rows)
+
+    Notification.objects.bulk_create([
+        Notification(recipient=data.user, source=data.friends[i % friends], notification_type='message', content=f'Notification {i}')
+        for i in range(notifications)
+    ])
+    NotificationCounter.objects.add_unread({data.user.id: notifications})
+    data.notification = Notification.objects.filter(recipient=data.user).latest('id')
+    return data
+
+
+def endpoint(name, method, path, queries, seconds=0.5, data=None, anonymous=False, staff=False):
+    """
+    A budget for one route. ``path`` and ``data`` are called with the
+    seeded Fanout; ``queries`` is the most one request may run, and
+    ``seconds`` the median time benchmarks/bench_endpoint_budgets.py allows
+    it. Requests are made as the fanned-out user unless ``anonymous``, or
+    as a staff user for ``staff``.
+    """
+    return {
+        'name': name, 'method': method, 'path': path, 'data': data,
+        'queries': queries, 'seconds': seconds, 'anonymous': anonymous, 'staff': staff,
+    }
+
+
+ENDPOINTS = [
+    # core/urls.py; logging in and signing up pay for a password hash
+    endpoint('api-signup', 'post', lambda d: '/api/signup/', 8, seconds=3, anonymous=True, data=lambda d: {
+        'email': 'new.fanout@example.com', 'password': PASSWORD, 'password2': PASSWORD, 'first_name': 'New', 'last_name': 'User',
+    }),
+    endpoint('api-login', 'post', lambda d: '/api/login/', 2, seconds=3, anonymous=True,
+             data=lambda d: {'email': d.user.email, 'password': PASSWORD}),
+    endpoint('api-logout', 'post', lambda d: '/api/logout/', 2),
+    # Exact and prefix token reads, ranking rows, then the page's users
+    endpoint('api-user-search', 'get', lambda d: '/api/users/search/?q=friend', 4),
+
+    # chat/urls.py
+    endpoint('api-root', 'get', lambda d: '/api/chat/', 0),
+    endpoint('api-root', 'get', lambda d: '/api/', 0),
+    endpoint('friendship-list', 'get', lambda d: '/api/chat/friendship/', 1),
+    endpoint('friendship-list', 'post', lambda d: '/api/chat/friendship/', 5, data=lambda d: {'receiver_email': d.stranger.email}),
+    endpoint('friendship-detail', 'get', lambda d: f'/api/chat/friendship/{d.requests[0].id}/', 1),
+    endpoint('friendship-send-invite', 'post', lambda d: '/api/chat/friendship/send_invite/', 5,
+             data=lambda d: {'receiver_email': d.stranger.email}),
+    endpoint('friendship-accept-invite', 'post', lambda d: f'/api/chat/friendship/{d.requests[0].id}/accept_invite/', 6),
+    endpoint('friendship-reject-invite', 'post', lambda d: f'/api/chat/friendship/{d.requests[0].id}/reject_invite/', 3),
+    endpoint('friendship-list-friends', 'get', lambda d: '/api/chat/friendship/list_friends/', 1),
+    endpoint('friendship-list-pending-requests', 'get', lambda d: '/api/chat/friendship/list_pending_requests/', 1),
+    endpoint('messages-list', 'get', lambda d: f'/api/chat/messages/?user_id={d.friend.id}', 3),
+    endpoint('messages-list', 'post', lambda d: '/api/chat/messages/', 9,
+             data=lambda d: {'receiver_id': d.friend.id, 'content': 'hello again'}),
+    # The message, then its conversation's read watermarks
+    endpoint('messages-detail', 'get', lambda d: f"/api/chat/messages/{d.messages[0]['id']}/", 2),
+    endpoint('messages-search', 'get', lambda d: '/api/chat/messages/search/?q=hello', 5),
+    endpoint('inbox-list', 'get', lambda d: '/api/chat/inbox/', 2),
+    endpoint('inbox-mark-read', 'post', lambda d: '/api/chat/inbox/mark_read/', 3,
+             data=lambda d: {'watermarks': [{'user_id': d.friend.id, 'message_id': d.messages[-1]['id']}]}),
+    endpoint('chat-connection-metrics', 'get', lambda d: '/api/chat/metrics/connections/', 0, staff=True),
+
+    # notifications/urls.py
+    endpoint('notification-list', 'get', lambda d: '/api/notifications/', 2),
+    endpoint('notification-mark-read', 'post', lambda d: f'/api/notifications/{d.notification.id}/mark_read/', 4),
+    endpoint('notification-mark-all-read', 'post', lambda d: '/api/notifications/mark_all_read/', 2),
+    endpoint('notification-unread-count', 'get', lambda d: '/api/notifications/unread_count/', 1),
+    endpoint('notification-preferences', 'get', lambda d: '/api/notifications/preferences/', 1),
+    endpoint('notification-preferences', 'patch', lambda d: '/api/notifications/preferences/', 3, data=lambda d: {'digest': True}),
+
+    # core/web_urls.py and chat/web_urls.py; a session costs two queries
+    endpoint('web-home', 'get', lambda d: '/', 2),
+    endpoint('web-login', 'get', lambda d: '/login/', 0, anonymous=True),
+    endpoint('web-login', 'post', lambda d: '/login/', 10, seconds=3, anonymous=True,
+             data=lambda d: {'username': d.user.email, 'password': PASSWORD}),
+    endpoint('web-logout', 'post', lambda d: '/logout/', 6),
+    endpoint('web-signup', 'get', lambda d: '/signup/', 0, anonymous=True),
+    endpoint('web-signup', 'post', lambda d: '/signup/', 17, seconds=3, anonymous=True, data=lambda d: {
+        'email': 'new.fanout@example.com', 'password': PASSWORD, 'password2': PASSWORD, 'first_name': 'New', 'last_name': 'User',
+    }),
+    endpoint('chat-friends', 'get', lambda d: '/chat/friends/', 4),
+    endpoint('chat-search', 'get', lambda d: '/chat/search/?q=friend', 6),
+    endpoint('chat-invite', 'get', lambda d: f'/chat/invite/{d.stranger.id}/', 7),
+    endpoint('chat-handle-request', 'get', lambda d: f'/chat/request/{d.requests[0].id}/accept/', 9),
+    endpoint('chat-room', 'get', lambda d: f'/chat/room/{d.friend.id}/', 4),
+]
+
+
+def route_names(resolver=None):
+    """The names of every route under ``resolver``, skipping UNBUDGETED_NAMESPACES."""
+    names = set()
+    for pattern in (resolver or get_resolver()).url_patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace not in UNBUDGETED_NAMESPACES:
+                names |= route_names(pattern)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def statement_shape(sql):
+    """``sql`` with its literals blanked, so repeats of one statement compare equal."""
+    return re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", '?', sql)
+
+
+def describe_queries(queries):
+    """Captured queries, the most repeated statement shapes first, then in order."""
+    shapes = Counter(statement_shape(query['sql']) for query in queries)
+    lines = ['Statements by shape:']
+    lines += [f'  {count:3d}x {shape}' for shape, count in shapes.most_common()]
+    lines.append('In order:')
+    lines += [f'  {i:3d}. {query["sql"]}' for i, query in enumerate(queries, 1)]
+    return '\n'.join(lines)
+
+
+def request_endpoint(client, spec, data):
+    """Send ``spec``'s request; returns ``(response, queries, seconds)``."""
+    path = spec['path'](data)
+    kwargs = {}
+    if spec['data'] is not None:
+        kwargs['data'] = spec['data'](data)
+        if path.startswith('/api/'):
+            kwargs['format'] = 'json'
+    with CaptureQueriesContext(connection) as captured:
+        start = time.perf_counter()
+        response = getattr(client, spec['method'])(path, **kwargs)
+        seconds = time.perf_counter() - start
+    return response, captured.captured_queries, seconds
+
+
+def client_for(spec, data):
+    """A client logged in as ``spec`` asks, with a fresh user instance so nothing is cached on it."""
+    user = None if spec['anonymous'] else User.objects.get(pk=(data.admin if spec['staff'] else data.user).pk)
+    if spec['path'](data).startswith('/api/'):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user=user)
+    else:
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+    return client
+
+
+class EndpointQueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed_fanout()
+
+    def test_every_route_has_a_budget(self):
+        budgeted = {spec['name'] for spec in ENDPOINTS}
+        missing = route_names() - budgeted - set(UNBUDGETED_NAMES)
+        self.assertFalse(missing, f"Add these routes to ENDPOINTS: {', '.join(sorted(missing))}")
+
+    def test_endpoints_stay_within_budget(self):
+        for spec in ENDPOINTS:
+            label = f"{spec['method'].upper()} {spec['path'](self.data)}"
+            with self.subTest(label):
+                client = client_for(spec, self.data)
+                # Each request sees the seeded rows, not the previous request's writes
+                with transaction.atomic():
+                    response, queries, _ = request_endpoint(client, spec, self.data)
+                    transaction.set_rollback(True)
+                self.assertLess(response.status_code, 400, f"{label} returned {response.status_code}")
+                self.assertLessEqual(
+                    len(queries), spec['queries'],
+                    f"{label} ran {len(queries)} queries, budget {spec['queries']}\n{describe_queries(queries)}",
+                )
@@ -0,0 +1,171 @@
+import asyncio
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from channels.routing import URLRouter
+from django.test import TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from chat.models import Conversation, Message
+from chat.routing import websocket_urlpatterns
+from chat.typing_events import get_typing_throttle
+from core import ratelimit
+from core.ratelimit import RateLimiter
+
+User = get_user_model()
+
+def communicator_for(user, path='/ws/chat/'):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope['user'] = user
+    return communicator
+
+async def drain(socket, quiet=0.3):
+    """Every frame the socket receives until it has been quiet for ``quiet`` seconds."""
+    frames = []
+    while not await socket.receive_nothing(timeout=quiet):
+        frames.append(await socket.receive_json_from())
+    return frames
+
+@override_settings(CHAT_TYPING={'WINDOW': 0.1, 'REFRESH': 5.0})
+class TypingEventsTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+    def test_keystroke_flood_becomes_a_handful_of_events(self):
+        async def flood():
+            socket_a = communicator_for(self.user_a)
+            socket_b = communicator_for(self.user_b)
+            await socket_a.connect()
+            await socket_b.connect()
+
+            # 100 keystrokes in about half a second, then the typist stops
+            for i in range(100):
+                await socket_a.send_json_to({'type': 'typing', 'recipient_id': self.user_b.id, 'state': 'start'})
+                await asyncio.sleep(0.005)
+            await socket_a.send_json_to({'type': 'typing', 'recipient_id': self.user_b.id, 'state': 'stop'})
+            received = await drain(socket_b)
+
+            throttle = get_typing_throttle()
+            counts = throttle.received, throttle.forwarded
+            sender_quiet = await socket_a.receive_nothing()
+            await socket_a.disconnect()
+            await socket_b.disconnect()
+            return received, counts, sender_quiet
+
+        received, (submitted, forwarded), sender_quiet = async_to_sync(flood)()
+        self.assertEqual(submitted, 101)
+        self.assertEqual(forwarded, 2)
+        self.assertEqual(received, [
+            {'type': 'typing', 'conversation_key': Conversation.key(self.user_a.id, self.user_b.id), 'user_id': self.user_a.id, 'state': state}
+            for state in ('start', 'stop')
+        ])
+        self.assertTrue(sender_quiet)
+        self.assertFalse(Message.objects.exists())
+
+    def test_start_stop_flood_is_bounded_by_the_window(self):
+        async def flood():
+            socket_a = communicator_for(self.user_a)
+            socket_b = communicator_for(self.user_b)
+            await socket_a.connect()
+            await socket_b.connect()
+
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            for i in range(200):
+                state = 'start' if i % 2 == 0 else 'stop'
+                await socket_a.send_json_to({'type': 'typing', 'recipient_id': self.user_b.id, 'state': state})
+                await asyncio.sleep(0.005)
+            elapsed = loop.time() - started
+            received = await drain(socket_b)
+            await socket_a.disconnect()
+            await socket_b.disconnect()
+            return received, elapsed
+
+        received, elapsed = async_to_sync(flood)()
+        # At most two events (a start and a stop) per window, however fast the frames come
+        self.assertLessEqual(len(received), 2 * (elapsed / 0.1 + 1))
+        self.assertEqual(received[-1]['state'], 'stop')
+
+    def test_disconnecting_mid_typing_sends_a_stop(self):
+        async def scenario():
+            socket_a = communicator_for(self.user_a)
+            socket_b = communicator_for(self.user_b)
+            await socket_a.connect()
+            await socket_b.connect()
+
+            await socket_a.send_json_to({'type': 'typing', 'recipient_id': self.user_b.id, 'state': 'start'})
+            started = await socket_b.receive_json_from(timeout=5)
+            await socket_a.disconnect()
+            received = await drain(socket_b)
+            pairs = dict(get_typing_throttle()._pairs)
+            await socket_b.disconnect()
+            return started, received, pairs
+
+        started, received, pairs = async_to_sync(scenario)()
+        self.assertEqual([started['state']] + [frame['state'] for frame in received], ['start', 'stop'])
+        self.assertEqual(pairs, {})
+
+    def test_closing_one_socket_leaves_the_other_typing(self):
+        async def scenario():
+            typing_socket = communicator_for(self.user_a)
+            other_socket = communicator_for(self.user_a)
+            socket_b = communicator_for(self.user_b)
+            for socket in (typing_socket, other_socket, socket_b):
+                await socket.connect()
+
+            await typing_socket.send_json_to({'type': 'typing', 'recipient_id': self.user_b.id, 'state': 'start'})
+            started = await socket_b.receive_json_from(timeout=5)
+            await other_socket.disconnect()
+            still_typing = await drain(socket_b)
+            await typing_socket.disconnect()
+            stopped = await drain(socket_b)
+            await socket_b.disconnect()
+            return started, still_typing, stopped
+
+        started, still_typing, stopped = async_to_sync(scenario)()
+        self.assertEqual(started['state'], 'start')
+        self.assertEqual(still_typing, [])
+        self.assertEqual([frame['state'] for frame in stopped], ['stop'])
+
+    def test_typing_at_many_recipients_draws_on_the_senders_budget(self):
+        recipients = [
+            User.objects.create_user(email=f'user_{i}@example.com', password='password123', first_name='User', last_name=str(i))
+            for i in range(6)
+        ]
+
+        async def scenario():
+            sockets = [communicator_for(user) for user in recipients]
+            socket_a = communicator_for(self.user_a)
+            for socket in sockets + [socket_a]:
+                await socket.connect()
+
+            for user in recipients:
+                await socket_a.send_json_to({'type': 'typing', 'recipient_id': user.id, 'state': 'start'})
+            received = [await drain(socket) for socket in sockets]
+            refused = get_typing_throttle().rate_limited
+            await socket_a.disconnect()
+            stopped = [await drain(socket) for socket in sockets]
+            for socket in sockets:
+                await socket.disconnect()
+            return received, refused, stopped
+
+        limiter = RateLimiter({'typing': {'RATE': 0.01, 'BURST': 4}})
+        with mock.patch.object(ratelimit, '_limiter', limiter):
+            received, refused, stopped = async_to_sync(scenario)()
+        # Four starts went out, each to its own recipient; only those four are stopped
+        self.assertEqual(sorted(len(frames) for frames in received), [0, 0, 1, 1, 1, 1])
+        self.assertEqual(refused, 2)
+        self.assertEqual([len(a) for a in stopped], [len(b) for b in received])
+
+    def test_invalid_typing_frames_get_error_replies(self):
+        async def exchange():
+            socket = communicator_for(self.user_a)
+            await socket.connect()
+            replies = []
+            for frame in ({'type': 'typing', 'state': 'start'}, {'type': 'typing', 'recipient_id': self.user_b.id, 'state': 'maybe'}):
+                await socket.send_json_to(frame)
+                replies.append(await socket.receive_json_from(timeout=5))
+            await socket.disconnect()
+            return replies
+
+        self.assertEqual([r['type'] for r in async_to_sync(exchange)()], ['error'] * 2)
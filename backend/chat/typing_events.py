@@ -0,0 +1,146 @@
+"""
+Typing indicators, throttled and coalesced before they reach the channel layer.
+
+Typing frames never touch the database. A client may report every
+keystroke; the process's TypingThrottle forwards at most one event per
+(sender, recipient) pair every CHAT_TYPING['WINDOW'] seconds, carrying the
+latest state reported in that window. While a user keeps typing, repeated
+"start" events are dropped until REFRESH seconds have passed, so
+recipients see one event every few seconds instead of one per key.
+
+Pairs only bound what one recipient sees. A sender typing at many
+recipients also draws on their ``typing`` rate limit (see
+``core.ratelimit``) for every "start" forwarded, whichever the recipient;
+a refused start is dropped, and so is the "stop" that would have followed
+it. When a socket closes, the pairs it last reported on are stopped, so
+recipients aren't left with an indicator that never clears, while the
+user's other sockets keep theirs.
+"""
+import asyncio
+import weakref
+from channels.layers import get_channel_layer
+from django.conf import settings
+from core.ratelimit import check_rate
+from .models import Conversation
+
+DEFAULTS = {
+    # Seconds over which a pair's typing events are merged into one
+    'WINDOW': 0.25,
+    # A repeated "start" is only forwarded this long after the previous one
+    'REFRESH': 3.0,
+}
+
+START, STOP = 'start', 'stop'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_TYPING', {})}
+
+
+class _PairState:
+    __slots__ = ('sent', 'sent_at', 'pending', 'timer', 'channel_name')
+
+    def __init__(self):
+        self.sent = STOP
+        self.sent_at = None
+        self.pending = None
+        self.timer = None
+        # The socket that last reported on the pair
+        self.channel_name = None
+
+
+class TypingThrottle:
+    def __init__(self, window, refresh):
+        self.window = window
+        self.refresh = refresh
+        self._pairs = {}
+        # sender id -> receiver ids with a pair in _pairs
+        self._receivers = {}
+        self._sends = set()
+        self.received = 0
+        self.forwarded = 0
+        self.rate_limited = 0
+
+    def submit(self, sender_id, receiver_id, state, channel_name=None):
+        """Record ``sender_id``'s typing ``state`` towards ``receiver_id``, reported by socket ``channel_name``."""
+        self.received += 1
+        self._update(sender_id, receiver_id, state, channel_name)
+
+    def disconnect(self, sender_id, channel_name=None):
+        """Stop what ``sender_id`` is typing on socket ``channel_name``; call when it closes."""
+        for receiver_id in list(self._receivers.get(sender_id, ())):
+            if self._pairs[(sender_id, receiver_id)].channel_name == channel_name:
+                self._update(sender_id, receiver_id, STOP, channel_name)
+
+    def _update(self, sender_id, receiver_id, state, channel_name):
+        loop = asyncio.get_running_loop()
+        pair = self._pairs.get((sender_id, receiver_id))
+        if pair is None:
+            pair = self._pairs[(sender_id, receiver_id)] = _PairState()
+            self._receivers.setdefault(sender_id, set()).add(receiver_id)
+        pair.pending = state
+        pair.channel_name = channel_name
+        if pair.timer is not None:
+            # Already due to go out; it will carry this state
+            return
+
+        delay = 0 if pair.sent_at is None else max(0, pair.sent_at + self.window - loop.time())
+        pair.timer = loop.call_later(delay, self._flush, sender_id, receiver_id)
+
+    def _flush(self, sender_id, receiver_id):
+        loop = asyncio.get_running_loop()
+        pair = self._pairs[(sender_id, receiver_id)]
+        pair.timer = None
+        state, pair.pending = pair.pending, None
+        now = loop.time()
+        if state == pair.sent and (state == STOP or now - pair.sent_at < self.refresh):
+            if state == STOP:
+                # Started and stopped within one window; the recipient saw neither
+                self._forget(sender_id, receiver_id)
+            return
+        if state == START and not check_rate(sender_id, 'typing')[0]:
+            self.rate_limited += 1
+            if pair.sent == STOP:
+                # The recipient never saw it start, so there's nothing to stop
+                self._forget(sender_id, receiver_id)
+            return
+
+        pair.sent, pair.sent_at = state, now
+        if state == STOP:
+            # Nothing left to throttle until they start again
+            self._forget(sender_id, receiver_id)
+        self.forwarded += 1
+        # Hold a reference so the task isn't garbage collected mid-send
+        task = loop.create_task(self._send(sender_id, receiver_id, state))
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
+
+    def _forget(self, sender_id, receiver_id):
+        del self._pairs[(sender_id, receiver_id)]
+        receivers = self._receivers[sender_id]
+        receivers.discard(receiver_id)
+        if not receivers:
+            del self._receivers[sender_id]
+
+    async def _send(self, sender_id, receiver_id, state):
+        from .consumers import user_group_name
+
+        await get_channel_layer().group_send(user_group_name(receiver_id), {
+            'type': 'typing_changed',
+            'conversation_key': Conversation.key(sender_id, receiver_id),
+            'user_id': sender_id,
+            'state': state,
+        })
+
+
+_throttles = weakref.WeakKeyDictionary()
+
+
+def get_typing_throttle():
+    """Return the typing throttle shared by all consumers on the running loop."""
+    loop = asyncio.get_running_loop()
+    throttle = _throttles.get(loop)
+    if throttle is None:
+        config = get_config()
+        throttle = _throttles[loop] = TypingThrottle(config['WINDOW'], config['REFRESH'])
+    return throttle
@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import FriendshipViewSet
-from .api_views import MessageViewSet
+from .api_views import ConnectionMetricsView, ConversationViewSet, MessageViewSet
 
 router = DefaultRouter()
 router.register(r'friendship', FriendshipViewSet, basename='friendship')
 router.register(r'messages', MessageViewSet, basename='messages')
+router.register(r'inbox', ConversationViewSet, basename='inbox')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/connections/', ConnectionMetricsView.as_view(), name='chat-connection-metrics'),
 ]
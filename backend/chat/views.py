@@ -1,8 +1,9 @@
 from rest_framework import viewsets, status, decorators
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 from django.db.models import Q
-from .models import Friendship
+from .models import FriendAdjacency, Friendship
 from .serializers import FriendshipSerializer, UserSerializer
 from django.contrib.auth import get_user_model
 
@@ -14,7 +15,7 @@ class FriendshipViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return Friendship.objects.filter(Q(sender=user) | Q(receiver=user))
+        return Friendship.objects.filter(Q(sender=user) | Q(receiver=user)).select_related('sender', 'receiver')
 
     @decorators.action(detail=False, methods=['post'])
     def send_invite(self, request):
@@ -30,7 +31,9 @@ class FriendshipViewSet(viewsets.ModelViewSet):
             return Response({"detail": "You can only accept requests sent to you."}, status=status.HTTP_403_FORBIDDEN)
         
         friendship.status = Friendship.ACCEPTED
-        friendship.save()
+        with transaction.atomic():
+            # Commits together with the adjacency rows and queued notification
+            friendship.save()
         return Response({"detail": "Friend request accepted."}, status=status.HTTP_200_OK)
 
     @decorators.action(detail=True, methods=['post'])
@@ -45,17 +48,7 @@ class FriendshipViewSet(viewsets.ModelViewSet):
 
     @decorators.action(detail=False, methods=['get'])
     def list_friends(self, request):
-        user = request.user
-        friendships = Friendship.objects.filter(
-            (Q(sender=user) | Q(receiver=user)) & Q(status=Friendship.ACCEPTED)
-        )
-        friends = []
-        for f in friendships:
-            if f.sender == user:
-                friends.append(f.receiver)
-            else:
-                friends.append(f.sender)
-        
+        friends = FriendAdjacency.objects.friends_of(request.user.id)
         serializer = UserSerializer(friends, many=True)
         return Response(serializer.data)
 
@@ -63,6 +56,6 @@ class FriendshipViewSet(viewsets.ModelViewSet):
     def list_pending_requests(self, request):
         user = request.user
         # Requests received by me that are pending
-        friendships = Friendship.objects.filter(receiver=user, status=Friendship.PENDING)
+        friendships = Friendship.objects.filter(receiver=user, status=Friendship.PENDING).select_related('sender', 'receiver')
         serializer = self.get_serializer(friendships, many=True)
         return Response(serializer.data)
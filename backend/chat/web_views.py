@@ -1,29 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
-from django.db.models import Q
 from django.contrib import messages
-from .models import Friendship, Message
+from django.db import transaction
+from core.search import search_users
+from .models import Conversation, FriendAdjacency, Friendship
 
 User = get_user_model()
 
+SEARCH_PAGE_SIZE = 20
+
 @login_required
 def friends_list_view(request):
     user = request.user
     
     # Friends
-    friendships = Friendship.objects.filter(
-        (Q(sender=user) | Q(receiver=user)) & Q(status=Friendship.ACCEPTED)
-    )
-    friends = []
-    for f in friendships:
-        if f.sender == user:
-            friends.append(f.receiver)
-        else:
-            friends.append(f.sender)
-            
+    friends = FriendAdjacency.objects.friends_of(user.id)
+
     # Pending Requests (Received)
-    pending_requests = Friendship.objects.filter(receiver=user, status=Friendship.PENDING)
+    pending_requests = Friendship.objects.filter(receiver=user, status=Friendship.PENDING).select_related('sender')
     
     context = {
         'friends': friends,
@@ -34,17 +29,17 @@ def friends_list_view(request):
 @login_required
 def search_users_view(request):
     query = request.GET.get('q')
-    users = []
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    users, has_next = [], False
     if query:
-        users = User.objects.filter(
-            Q(email__icontains=query) | 
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query)
-        ).exclude(id=request.user.id)
+        users, has_next = search_users(query, exclude_user_id=request.user.id, offset=(page - 1) * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE)
         
     context = {
         'users': users,
-        'query': query
+        'query': query,
+        'page': page,
+        'has_next': has_next,
     }
     return render(request, 'chat/search.html', context)
 
@@ -53,11 +48,9 @@ def send_invite_view(request, user_id):
     receiver = get_object_or_404(User, id=user_id)
     sender = request.user
     
-    if Friendship.objects.filter(sender=sender, receiver=receiver).exists() or \
-       Friendship.objects.filter(sender=receiver, receiver=sender).exists():
+    if Friendship.objects.send_invite(sender, receiver) is None:
         messages.warning(request, f"Friendship request already exists with {receiver.email}.")
     else:
-        Friendship.objects.create(sender=sender, receiver=receiver, status=Friendship.PENDING)
         messages.success(request, f"Friend request sent to {receiver.email}.")
         
     return redirect('chat-search')
@@ -68,7 +61,9 @@ def handle_request_view(request, friendship_id, action):
     
     if action == 'accept':
         friendship.status = Friendship.ACCEPTED
-        friendship.save()
+        with transaction.atomic():
+            # Commits together with the adjacency rows and queued notification
+            friendship.save()
         messages.success(request, "Friend request accepted.")
     elif action == 'reject':
         friendship.status = Friendship.REJECTED
@@ -82,7 +77,7 @@ def chat_room_view(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
     
     # Mark messages as read
-    Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True)
+    Conversation.objects.mark_read(request.user.id, other_user.id)
     
     context = {
         'other_user': other_user,
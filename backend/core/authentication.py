@@ -1,11 +1,45 @@
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
+from .token_cache import get_token_cache
+
+# Cookie carrying the auth token for the API, the web pages and WebSockets
+AUTH_COOKIE = 'auth_token'
+AUTH_COOKIE_MAX_AGE = 3600 * 24 * 7  # 1 week
+
+
+def set_auth_cookie(response, key):
+    # Set HttpOnly cookie
+    response.set_cookie(
+        AUTH_COOKIE,
+        key,
+        httponly=True,
+        samesite='Lax',
+        secure=False,  # Set to True in production
+        max_age=AUTH_COOKIE_MAX_AGE,
+    )
+
 
 class CookieTokenAuthentication(TokenAuthentication):
     def authenticate(self, request):
         # Check if 'auth_token' is in cookies
-        token = request.COOKIES.get('auth_token')
+        token = request.COOKIES.get(AUTH_COOKIE)
         if not token:
             return super().authenticate(request)
         
         return self.authenticate_credentials(token)
+
+    def authenticate_credentials(self, key):
+        # Served from the token cache when possible; misses go to the database
+        cache = get_token_cache()
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            return cached
+        return self.load_credentials(key)
+
+    def load_credentials(self, key):
+        """Look ``key`` up in the database and cache the result."""
+        user, token = super().authenticate_credentials(key)
+        cache = get_token_cache()
+        if cache is not None:
+            cache.set(key, user, token)
+        return user, token
@@ -0,0 +1,45 @@
+"""
+WebSocket authentication from the ``auth_token`` cookie.
+
+Sockets are authenticated the same way as API requests: the token cookie
+is looked up through the token cache, so a reconnecting client usually
+costs no queries at all. Connections without a valid token cookie fall
+back to Channels' session authentication.
+"""
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.http.cookie import parse_cookie
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import AUTH_COOKIE, CookieTokenAuthentication
+from .token_cache import get_token_cache
+
+
+class TokenCookieAuthMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_auth = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        user = await self.token_user(scope)
+        if user is None:
+            return await self.session_auth(scope, receive, send)
+        return await self.inner(dict(scope, user=user), receive, send)
+
+    async def token_user(self, scope):
+        key = self.cookies(scope).get(AUTH_COOKIE)
+        if not key:
+            return None
+        cache = get_token_cache()
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            try:
+                cached = await database_sync_to_async(CookieTokenAuthentication().load_credentials)(key)
+            except AuthenticationFailed:
+                return None
+        return cached[0]
+
+    def cookies(self, scope):
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                return parse_cookie(value.decode('latin1'))
+        return {}
@@ -96,12 +96,16 @@ class UserRegistrationForm(forms.ModelForm):
             raise ValidationError("The two password fields must match.")
         return password2
 
-    def save(self, commit=True):
+    def save(self, commit=True, password_hash=None):
         """
-        Save the new User object.
+        Save the new User object. Pass ``password_hash`` when the password
+        has already been hashed off the request thread.
         """
         user = super().save(commit=False)
-        user.set_password(self.cleaned_data['password'])
+        if password_hash is None:
+            user.set_password(self.cleaned_data['password'])
+        else:
+            user.password = password_hash
         if commit:
             user.save()
         return user
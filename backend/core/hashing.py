@@ -0,0 +1,142 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2 deliberately burns CPU for a large fraction of a second. Run inline
+under ASGI it holds the single thread that serves every sync view, so a
+login burst stalls unrelated requests. The async login and signup views
+hash in a small process pool instead; once PASSWORD_HASHING_POOL
+['MAX_PENDING'] hashes are queued or running, new ones are refused with
+``HashingPoolFull`` rather than queued, and the views answer 503.
+
+A worker that dies (OOM-killed, say) breaks its ProcessPoolExecutor for
+good, so the pool drops a broken executor and starts a fresh one.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+DEFAULTS = {
+    'WORKERS': 2,
+    # Hashes allowed to wait or run at once, across all workers
+    'MAX_PENDING': 32,
+}
+
+
+class HashingPoolFull(Exception):
+    """Raised instead of queueing a hash when the pool is saturated."""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING_POOL', {})}
+
+
+def _init_worker():
+    # Spawned workers start from a fresh interpreter
+    import django
+    django.setup()
+
+
+def _verify(password, encoded):
+    from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher
+
+    if not check_password(password, encoded):
+        return False, False
+    preferred = get_hasher('default')
+    hasher = identify_hasher(encoded)
+    return True, hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def _make(password):
+    from django.contrib.auth.hashers import make_password
+
+    return make_password(password)
+
+
+class HashingPool:
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingPoolFull(f"{self.pending} password hashes already pending")
+            self.pending += 1
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # Broken before this hash was queued: it can still run on a fresh pool
+                self._discard(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(lambda future: self._done(executor, future))
+        return future
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Not forked: the server process has an event loop and threads running
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _done(self, executor, future):
+        with self._lock:
+            self.pending -= 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._discard(executor)
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = get_config()
+                _pool = HashingPool(config['WORKERS'], config['MAX_PENDING'])
+    return _pool
+
+
+async def averify_password(password, encoded):
+    """Return ``(matches, needs_rehash)`` for ``password`` against ``encoded``."""
+    if not encoded:
+        return False, False
+    return await get_hashing_pool().run(_verify, password, encoded)
+
+
+async def amake_password(password):
+    return await get_hashing_pool().run(_make, password)
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.25 on 2026-10-18 20:13
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# A copy of core.search's tokenizer as it was when this migration was written,
+# so later changes to it don't change what this backfill does
+MAX_TOKEN_LENGTH = 64
+WORD_SPLIT = re.compile(r"[\s._+@-]+")
+
+
+def tokenize(text):
+    return [word[:MAX_TOKEN_LENGTH] for word in WORD_SPLIT.split((text or '').lower()) if word]
+
+
+def user_tokens(email, first_name, last_name):
+    tokens = set(tokenize(first_name)) | set(tokenize(last_name)) | set(tokenize(email))
+    if email:
+        tokens.add(email.lower()[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def backfill_search_tokens(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    UserSearchToken = apps.get_model('core', 'UserSearchToken')
+
+    tokens = [
+        UserSearchToken(user_id=user_id, token=token)
+        for user_id, email, first_name, last_name in User.objects.values_list('id', 'email', 'first_name', 'last_name').iterator()
+        for token in user_tokens(email, first_name, last_name)
+    ]
+    UserSearchToken.objects.bulk_create(tokens, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='usersearchtoken',
+            constraint=models.UniqueConstraint(fields=('token', 'user'), name='core_user_search_token_uniq'),
+        ),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
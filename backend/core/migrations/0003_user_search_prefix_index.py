@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-18 21:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_user_search_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersearchtoken',
+            index=models.Index(fields=['token'], name='core_user_search_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
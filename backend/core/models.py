@@ -17,6 +17,14 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def create_user_with_hash(self, email, password_hash, **extra_fields):
+        """Like create_user, for a password already hashed (see core.hashing)."""
+        if not email:
+            raise ValueError("Email must be set")
+        user = self.model(email=self.normalize_email(email), password=password_hash, **extra_fields)
+        user.save(using=self._db)
+        return user
+
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -36,4 +44,26 @@ class User(AbstractUser):
 
 
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+class UserSearchToken(models.Model):
+    """
+    One lowercase word of a user's name or email; see ``core.search``.
+
+    Maintained by ``core.signals`` and rebuilt with
+    ``manage.py rebuild_user_search_index``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['token', 'user'], name='core_user_search_token_uniq'),
+        ]
+        indexes = [
+            # Prefix (LIKE 'term%') lookups scan this index whatever the database's collation
+            models.Index(fields=['token'], name='core_user_search_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.user_id}"
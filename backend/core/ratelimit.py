@@ -0,0 +1,137 @@
+"""
+In-process token-bucket rate limiting, keyed by user and action.
+
+Each action in RATE_LIMITS['ACTIONS'] refills RATE tokens per second up
+to BURST; every attempt takes one and is refused while the bucket is
+empty. The WebSocket and REST send paths check the same buckets, so a
+user can't double their allowance by switching transport.
+
+Buckets are spread over SHARDS dicts, each with its own lock held only
+for a few arithmetic operations, so checks from different threads rarely
+contend. A shard at MAX_BUCKETS_PER_SHARD forgets its least recently used
+bucket to make room, which costs the same however many users are active.
+Limits are per worker process.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SHARDS': 16,
+    # Buckets kept per shard before the least recently used is forgotten
+    'MAX_BUCKETS_PER_SHARD': 10000,
+    'ACTIONS': {
+        'send_message': {'RATE': 10, 'BURST': 30},
+        # Typing "start" events forwarded, over all recipients
+        'typing': {'RATE': 1, 'BURST': 10},
+    },
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def validate_actions(actions):
+    for name, limit in actions.items():
+        if limit['RATE'] <= 0 or limit['BURST'] < 1:
+            raise ValueError(f"RATE_LIMITS['ACTIONS'][{name!r}] needs RATE > 0 and BURST >= 1")
+
+
+class _Shard:
+    __slots__ = ('lock', 'buckets')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> [tokens, last refill], least recently used first
+        self.buckets = OrderedDict()
+
+
+class RateLimiter:
+    def __init__(self, actions, shards=16, max_buckets_per_shard=10000, clock=time.monotonic):
+        validate_actions(actions)
+        # action -> (tokens per second, capacity)
+        self.actions = {name: (float(limit['RATE']), float(limit['BURST'])) for name, limit in actions.items()}
+        self.max_buckets_per_shard = max_buckets_per_shard
+        self.clock = clock
+        self._shards = [_Shard() for i in range(shards)]
+        self.rejected = 0
+
+    def check(self, user_id, action):
+        """
+        Take a token from ``user_id``'s ``action`` bucket. Returns
+        ``(allowed, retry_after)``, where ``retry_after`` is the seconds
+        until a token is available again (0 when allowed). Actions without
+        a configured limit are always allowed.
+        """
+        limit = self.actions.get(action)
+        if limit is None:
+            return True, 0.0
+        rate, burst = limit
+        key = (user_id, action)
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = self.clock()
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            if bucket is None:
+                if len(shard.buckets) >= self.max_buckets_per_shard:
+                    shard.buckets.popitem(last=False)
+                bucket = shard.buckets[key] = [burst, now]
+            else:
+                shard.buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return True, 0.0
+            bucket[0] = tokens
+        self.rejected += 1
+        return False, (1 - tokens) / rate
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide limiter, or None when RATE_LIMITS is disabled."""
+    global _limiter
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(config['ACTIONS'], config['SHARDS'], config['MAX_BUCKETS_PER_SHARD'])
+    return _limiter
+
+
+def check_rate(user_id, action):
+    """``RateLimiter.check`` on the shared limiter; always allowed when disabled."""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return True, 0.0
+    return limiter.check(user_id, action)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    DRF throttle drawing on the same buckets as the WebSocket paths, so
+    over-limit requests get a 429 with Retry-After.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return True
+        allowed, self.retry_after = check_rate(request.user.pk, self.action)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,152 @@
+"""
+Prefix search over users' names and email addresses.
+
+Every user is indexed as a handful of lowercase tokens in UserSearchToken:
+each word of their first and last name, their email address and the parts
+of it. A query term matches tokens that start with it (``LIKE 'term%'``),
+an index scan rather than a scan of the user table. Postgres only uses a
+btree for LIKE when it has ``varchar_pattern_ops`` or the C collation, so
+the token has a pattern_ops index of its own. Terms shorter than
+MIN_PREFIX_LENGTH only match whole words.
+
+Typeahead runs on every keystroke, so a query reads at most MAX_CANDIDATES
+index rows for its longest term, exact matches first. A term common
+enough to have more ranks only the ones read, and reports ``has_more``.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import User, UserSearchToken
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_TERMS = 4
+MAX_TOKEN_LENGTH = 64
+# Shorter terms only match whole words, keeping their scans tight
+MIN_PREFIX_LENGTH = 2
+# Index rows read for the leading term; the candidates every other term narrows down
+MAX_CANDIDATES = 200
+
+# Exact token matches rank above prefix matches
+EXACT_MATCH, PREFIX_MATCH = 2, 1
+
+WORD_SPLIT = re.compile(r"[\s._+@-]+")
+
+
+def tokenize(text):
+    """Split free text into the lowercase words the index stores."""
+    return [word[:MAX_TOKEN_LENGTH] for word in WORD_SPLIT.split((text or '').lower()) if word]
+
+
+def user_tokens(email, first_name, last_name):
+    tokens = set(tokenize(first_name)) | set(tokenize(last_name)) | set(tokenize(email))
+    if email:
+        tokens.add(email.lower()[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def index_user(user):
+    """Replace ``user``'s tokens with ones built from their current fields."""
+    UserSearchToken.objects.filter(user=user).delete()
+    UserSearchToken.objects.bulk_create(
+        [UserSearchToken(user=user, token=token) for token in user_tokens(user.email, user.first_name, user.last_name)],
+        ignore_conflicts=True,
+    )
+
+
+def rebuild_index(batch_size=1000):
+    """Rebuild the whole index; returns the number of users indexed."""
+    UserSearchToken.objects.all().delete()
+    count = 0
+    last_id = 0
+    while True:
+        users = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'email', 'first_name', 'last_name')[:batch_size]
+        )
+        if not users:
+            return count
+        UserSearchToken.objects.bulk_create(
+            [
+                UserSearchToken(user_id=user_id, token=token)
+                for user_id, email, first_name, last_name in users
+                for token in user_tokens(email, first_name, last_name)
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        count += len(users)
+        last_id = users[-1][0]
+
+
+def prefix_filter(term, field='token'):
+    """A filter for ``field`` values starting with ``term``."""
+    lookup = Q(**{f'{field}__startswith': term})
+    if connection.vendor == 'sqlite':
+        # SQLite's LIKE never uses an index, but under its binary collation a prefix is also a range
+        lookup &= Q(**{f'{field}__gte': term, f'{field}__lt': term[:-1] + chr(ord(term[-1]) + 1)})
+    return lookup
+
+
+def _term_filter(term):
+    if len(term) < MIN_PREFIX_LENGTH:
+        return Q(token=term)
+    return prefix_filter(term)
+
+
+def _leading_candidates(term):
+    """
+    Up to MAX_CANDIDATES ``(user_id, token)`` rows matching ``term``, exact
+    matches first, and whether any were left unread.
+    """
+    rows = list(UserSearchToken.objects.filter(token=term).order_by('user_id').values_list('user_id', 'token')[:MAX_CANDIDATES + 1])
+    if len(term) >= MIN_PREFIX_LENGTH and len(rows) <= MAX_CANDIDATES:
+        # Unordered, so the scan stops as soon as it has enough rows
+        prefixed = UserSearchToken.objects.filter(prefix_filter(term)).exclude(token=term).values_list('user_id', 'token')
+        rows += prefixed[:MAX_CANDIDATES + 1 - len(rows)]
+    return rows[:MAX_CANDIDATES], len(rows) > MAX_CANDIDATES
+
+
+def _score(rows, term):
+    scores = {}
+    for user_id, token in rows:
+        score = EXACT_MATCH if token == term else PREFIX_MATCH
+        scores[user_id] = max(scores.get(user_id, 0), score)
+    return scores
+
+
+def search_users(query, exclude_user_id=None, offset=0, limit=DEFAULT_LIMIT):
+    """
+    Return ``(users, has_more)`` for users matching every term of ``query``.
+
+    Results are ranked by how well the terms match (an exact word beats a
+    prefix) and then by email. The longest term is looked up first and
+    bounds the candidates to MAX_CANDIDATES, so the cost of a search is
+    bounded however large the user table is or however common the term.
+    When the bound cuts candidates off, ``has_more`` is True and only the
+    candidates read are ranked.
+    """
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)[:MAX_TERMS]
+    if not terms:
+        return [], False
+
+    rows, truncated = _leading_candidates(terms[0])
+    scores = _score(rows, terms[0])
+    for term in terms[1:]:
+        scores.pop(exclude_user_id, None)
+        if not scores:
+            return [], False
+        term_scores = _score(
+            UserSearchToken.objects.filter(_term_filter(term), user_id__in=list(scores)).values_list('user_id', 'token'), term,
+        )
+        scores = {user_id: scores[user_id] + score for user_id, score in term_scores.items()}
+    scores.pop(exclude_user_id, None)
+    if not scores:
+        return [], False
+
+    # Rank on plain rows, then load only the page
+    emails = User.objects.filter(id__in=list(scores)).values_list('id', 'email')
+    ranked = [user_id for user_id, email in sorted(emails, key=lambda row: (-scores[row[0]], row[1]))]
+    page = ranked[offset:offset + limit]
+    users = User.objects.only('id', 'email', 'first_name', 'last_name').in_bulk(page)
+    return [users[user_id] for user_id in page], truncated or len(ranked) > offset + limit
+
@@ -1,5 +1,4 @@
 from rest_framework import serializers
-from django.contrib.auth import authenticate
 from .models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -26,30 +25,13 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 class CustomAuthTokenSerializer(serializers.Serializer):
+    """
+    Login credentials. The password is checked by the login view, which
+    hashes off the request thread (see core.hashing).
+    """
     email = serializers.EmailField(label="Email")
     password = serializers.CharField(
         label="Password",
         style={'input_type': 'password'},
         trim_whitespace=False
     )
-
-    def validate(self, attrs):
-        email = attrs.get('email')
-        password = attrs.get('password')
-
-        if email and password:
-            user = authenticate(request=self.context.get('request'),
-                                email=email, password=password)
-
-            # The authenticate call simply returns None for is_active=False
-            # users. (Assuming the default ModelBackend authentication
-            # backend.)
-            if not user:
-                msg = 'Unable to log in with provided credentials.'
-                raise serializers.ValidationError(msg, code='authorization')
-        else:
-            msg = 'Must include "email" and "password".'
-            raise serializers.ValidationError(msg, code='authorization')
-
-        attrs['user'] = user
-        return attrs
\ No newline at end of file
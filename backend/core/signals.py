@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .models import User
+from .search import index_user
+from .token_cache import get_token_cache
+
+SEARCHABLE_FIELDS = {'email', 'first_name', 'last_name'}
+
+@receiver(post_save, sender=User)
+def update_search_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login alone; only reindex when a searchable field may have changed
+    if update_fields is not None and not SEARCHABLE_FIELDS.intersection(update_fields):
+        return
+    index_user(instance)
+
+@receiver(post_save, sender=User)
+def drop_cached_tokens(sender, instance, **kwargs):
+    # Deactivated users must stop authenticating, and others must not see stale fields
+    cache = get_token_cache()
+    if cache is not None:
+        cache.invalidate_user(instance.pk)
+
+@receiver(post_delete, sender=Token)
+def drop_cached_token(sender, instance, **kwargs):
+    cache = get_token_cache()
+    if cache is not None:
+        cache.invalidate(instance.key)
@@ -1,7 +1,23 @@
-from django.test import TestCase
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from core.models import User
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from chat.routing import websocket_urlpatterns
+from core.channels_auth import TokenCookieAuthMiddleware
+from core.hashing import HashingPool, _make, get_hashing_pool
+from core import ratelimit
+from core.models import UserSearchToken
+from core.ratelimit import RateLimiter
+from core.search import rebuild_index, search_users
+from core.token_cache import TokenCache, get_token_cache
 
 
 class UserModelTests(TestCase):
@@ -49,4 +65,334 @@ class UserModelTests(TestCase):
     def test_user_str_method(self):
         """Test the string representation of the user"""
         user = User.objects.create_user(email='strtest@example.com', password='pass')
-        self.assertEqual(str(user), 'strtest@example.com')
\ No newline at end of file
+        self.assertEqual(str(user), 'strtest@example.com')
+
+
+class UserSearchTests(TestCase):
+
+    def setUp(self):
+        self.me = User.objects.create_user(email='me@example.com', password='pass', first_name='Alice', last_name='Me')
+        self.alice = User.objects.create_user(email='alice.smith@example.com', password='pass', first_name='Alice', last_name='Smith')
+        self.alicia = User.objects.create_user(email='alicia@example.com', password='pass', first_name='Alicia', last_name='Jones')
+        self.bob = User.objects.create_user(email='bob@sample.org', password='pass', first_name='Bob', last_name='Alison')
+
+    def test_prefix_search_ranks_exact_words_first(self):
+        """Test exact word matches come before prefix matches"""
+        users, has_more = search_users('alice', exclude_user_id=self.me.id)
+        self.assertEqual(users, [self.alice])
+        users, has_more = search_users('ali', exclude_user_id=self.me.id)
+        self.assertEqual(set(users), {self.alice, self.alicia, self.bob})
+        self.assertFalse(has_more)
+
+    def test_every_term_must_match(self):
+        """Test multi-word queries narrow the results"""
+        users, has_more = search_users('ali smi')
+        self.assertEqual(users, [self.alice])
+        users, has_more = search_users('sample.org')
+        self.assertEqual(users, [self.bob])
+
+    def test_index_follows_profile_changes(self):
+        """Test saving a user reindexes their searchable fields"""
+        self.bob.last_name = 'Builder'
+        self.bob.save()
+        self.assertEqual(search_users('alison')[0], [])
+        self.assertEqual(search_users('build')[0], [self.bob])
+
+        self.bob.delete()
+        self.assertEqual(search_users('build')[0], [])
+
+    def test_rebuild_index(self):
+        """Test the index can be rebuilt from scratch"""
+        UserSearchToken.objects.all().delete()
+        self.assertEqual(rebuild_index(batch_size=2), 4)
+        self.assertEqual(search_users('alicia')[0], [self.alicia])
+
+    def test_search_api_pages_results(self):
+        """Test the typeahead API returns limited pages"""
+        client = APIClient()
+        client.force_authenticate(user=self.me)
+        response = client.get('/api/users/search/', {'q': 'ali', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['next_offset'], 2)
+        self.assertNotIn('password', response.data['results'][0])
+
+        response = client.get('/api/users/search/', {'q': 'ali', 'limit': 2, 'offset': 2})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next_offset'])
+
+    def test_common_terms_read_a_bounded_number_of_candidates(self):
+        """Test a term matching more than MAX_CANDIDATES tokens prefers exact words and reports more"""
+        User.objects.bulk_create([
+            User(email=f'alien{i}@example.com', password='!', first_name='Alien', last_name=f'Number{i}') for i in range(7)
+        ])
+        rebuild_index()
+        with mock.patch('core.search.MAX_CANDIDATES', 2):
+            users, has_more = search_users('alice', exclude_user_id=self.me.id)
+            self.assertEqual(users, [self.alice])
+            self.assertTrue(has_more)
+            users, has_more = search_users('alien', limit=50)
+            self.assertEqual(len(users), 2)
+            self.assertTrue(has_more)
+        users, has_more = search_users('ali', exclude_user_id=self.me.id, limit=50)
+        self.assertEqual(len(users), 10)
+        self.assertFalse(has_more)
+
+    def test_short_terms_match_whole_words(self):
+        """Test one-letter terms don't scan every token starting with them"""
+        self.assertEqual(search_users('a')[0], [])
+        self.assertEqual(search_users('m', exclude_user_id=self.alice.id)[0], [])
+        self.bob.first_name = 'B'
+        self.bob.save()
+        self.assertEqual(search_users('b alison')[0], [self.bob])
+
+
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.cookies['auth_token'] = self.token.key
+
+    def test_cached_requests_skip_the_auth_query(self):
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').status_code, 200)
+        # Only the view's own counter query is left
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notifications/unread_count/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_token_cache().stats(), {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1})
+
+    def test_header_tokens_are_cached_too(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        client.get('/api/notifications/unread_count/')
+        with self.assertNumQueries(1):
+            client.get('/api/notifications/unread_count/')
+
+    def test_logout_invalidates(self):
+        self.client.get('/api/notifications/unread_count/')
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.client.cookies['auth_token'] = self.token.key
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').status_code, 401)
+
+    def test_deactivation_invalidates(self):
+        self.client.get('/api/notifications/unread_count/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(get_token_cache().stats()['size'], 0)
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').status_code, 401)
+
+    def test_entries_expire_and_least_recently_used_are_evicted(self):
+        now = [0]
+        cache = TokenCache(max_size=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', self.user, 'token-a')
+        cache.set('b', self.user, 'token-b')
+        self.assertEqual(cache.get('a')[1], 'token-a')
+        cache.set('c', self.user, 'token-c')
+        self.assertIsNone(cache.get('b'))
+
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 1, 'size': 1})
+        cache.invalidate_user(self.user.pk)
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class TokenCookieSocketAuthTests(TransactionTestCase):
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.token = Token.objects.create(user=self.user)
+
+    def connect(self, cookie=''):
+        async def attempt():
+            headers = [(b'cookie', cookie.encode())] if cookie else []
+            socket = WebsocketCommunicator(TokenCookieAuthMiddleware(URLRouter(websocket_urlpatterns)), '/ws/chat/', headers=headers)
+            connected, code = await socket.connect()
+            await socket.disconnect()
+            return connected
+        return async_to_sync(attempt)()
+
+    def test_token_cookie_authenticates_from_the_cache(self):
+        for i in range(3):
+            self.assertTrue(self.connect(f'auth_token={self.token.key}'))
+        self.assertEqual(get_token_cache().stats()['misses'], 1)
+        self.assertEqual(get_token_cache().stats()['hits'], 2)
+
+    def test_unknown_token_without_session_is_rejected(self):
+        self.assertFalse(self.connect('auth_token=bogus'))
+        self.assertFalse(self.connect())
+
+    def test_session_fallback(self):
+        self.client.force_login(self.user)
+        self.assertTrue(self.connect(f'sessionid={self.client.cookies["sessionid"].value}'))
+
+    def test_logout_closes_the_door(self):
+        self.assertTrue(self.connect(f'auth_token={self.token.key}'))
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        client.post('/api/logout/')
+        self.assertFalse(self.connect(f'auth_token={self.token.key}'))
+
+    def test_web_login_and_logout_manage_the_token_cookie(self):
+        response = self.client.post('/login/', {'username': 'user_a@example.com', 'password': 'password123'})
+        self.assertEqual(response.cookies['auth_token'].value, self.token.key)
+
+        response = self.client.post('/logout/')
+        self.assertEqual(response.cookies['auth_token'].value, '')
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertFalse(self.connect(f'auth_token={self.token.key}'))
+
+
+class AsyncLoginSignupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.client = APIClient()
+
+    def login(self, email, password):
+        return self.client.post('/api/login/', {'email': email, 'password': password}, format='json')
+
+    def test_login_checks_the_password_in_the_pool(self):
+        response = self.login('user_a@example.com', 'password123')
+        self.assertEqual(response.status_code, 200)
+        token = Token.objects.get(user=self.user)
+        self.assertEqual(response.json(), {'token': token.key, 'user_id': self.user.id, 'email': 'user_a@example.com'})
+        self.assertEqual(response.cookies['auth_token'].value, token.key)
+
+    def test_bad_credentials_are_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        for email, password in (('user_a@example.com', 'password123'), ('user_a@example.com', 'wrong'), ('nobody@example.com', 'password123')):
+            response = self.login(email, password)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'non_field_errors': ['Unable to log in with provided credentials.']})
+        self.assertEqual(self.client.post('/api/login/', {'email': 'user_a@example.com'}, format='json').status_code, 400)
+
+    def test_signup_stores_pool_hashed_password(self):
+        response = self.client.post('/api/signup/', {'email': 'New@Example.com', 'password': 'secret123', 'first_name': 'New'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='new@example.com')
+        self.assertTrue(user.check_password('secret123'))
+        self.assertEqual(response.json()['token'], Token.objects.get(user=user).key)
+
+        response = self.client.post('/api/signup/', {'email': 'new@example.com', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+    def test_web_signup_logs_in(self):
+        response = self.client.post('/signup/', {'email': 'web@example.com', 'password': 'secret123', 'password2': 'secret123'})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertTrue(User.objects.get(email='web@example.com').check_password('secret123'))
+        self.assertIn('auth_token', response.cookies)
+
+    def test_saturated_pool_answers_503(self):
+        with mock.patch.object(get_hashing_pool(), 'max_pending', 0):
+            response = self.login('user_a@example.com', 'password123')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+
+            response = self.client.post('/signup/', {'email': 'web@example.com', 'password': 'secret123', 'password2': 'secret123'})
+            self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(email='web@example.com').exists())
+
+
+class HashingPoolTests(SimpleTestCase):
+
+    def test_pool_recovers_after_a_worker_dies(self):
+        """Test a killed worker doesn't break hashing or leak pending slots"""
+        pool = HashingPool(workers=1, max_pending=2)
+        self.addCleanup(pool.shutdown)
+        before = set(multiprocessing.active_children())
+        self.assertTrue(pool.submit(_make, 'secret123').result(timeout=60))
+        for process in set(multiprocessing.active_children()) - before:
+            process.kill()
+            process.join()
+
+        # Depending on when the executor notices, this hash fails or runs on a new pool
+        try:
+            pool.submit(_make, 'secret123').result(timeout=60)
+        except BrokenProcessPool:
+            pass
+        for i in range(3):
+            self.assertTrue(pool.submit(_make, 'secret123').result(timeout=60))
+        # Waits for the done callbacks too
+        pool.shutdown()
+        self.assertEqual(pool.pending, 0)
+        self.assertEqual(pool.rejected, 0)
+
+
+class RateLimitTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.other = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+        # Three messages, then one every 100 seconds
+        limiter = mock.patch.object(ratelimit, '_limiter', RateLimiter({'send_message': {'RATE': 0.01, 'BURST': 3}}))
+        limiter.start()
+        self.addCleanup(limiter.stop)
+
+    def test_buckets_refill_at_the_configured_rate(self):
+        """Test a bucket allows a burst, then one attempt per refill"""
+        now = [0]
+        limiter = RateLimiter({'send_message': {'RATE': 2, 'BURST': 3}}, shards=4, clock=lambda: now[0])
+        self.assertEqual([limiter.check(1, 'send_message')[0] for i in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.check(1, 'send_message'), (False, 0.5))
+        self.assertTrue(limiter.check(2, 'send_message')[0])
+        self.assertTrue(limiter.check(1, 'unlimited')[0])
+
+        now[0] = 0.5
+        self.assertTrue(limiter.check(1, 'send_message')[0])
+        self.assertFalse(limiter.check(1, 'send_message')[0])
+        self.assertEqual(limiter.rejected, 3)
+
+    def test_least_recently_used_bucket_is_forgotten(self):
+        """Test a full shard evicts the bucket checked longest ago"""
+        limiter = RateLimiter({'send_message': {'RATE': 1, 'BURST': 1}}, shards=1, max_buckets_per_shard=2)
+        limiter.check(1, 'send_message')
+        limiter.check(2, 'send_message')
+        limiter.check(1, 'send_message')
+        limiter.check(3, 'send_message')
+        self.assertEqual(list(limiter._shards[0].buckets), [(1, 'send_message'), (3, 'send_message')])
+
+    def test_rate_must_be_positive(self):
+        """Test a zero rate is rejected instead of dividing by zero later"""
+        with self.assertRaises(ValueError):
+            RateLimiter({'send_message': {'RATE': 0, 'BURST': 3}})
+        with self.settings(RATE_LIMITS={'ACTIONS': {'send_message': {'RATE': -1, 'BURST': 3}}}):
+            with mock.patch.object(ratelimit, '_limiter', None), self.assertRaises(ValueError):
+                ratelimit.get_rate_limiter()
+
+    def test_rest_and_websocket_share_a_bucket(self):
+        """Test over-limit sends get a 429 or an error frame"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        for i in range(2):
+            response = client.post('/api/chat/messages/', {'receiver_id': self.other.id, 'content': f'REST {i}'})
+            self.assertEqual(response.status_code, 201)
+        # Reading isn't limited
+        self.assertEqual(client.get(f'/api/chat/messages/?user_id={self.other.id}').status_code, 200)
+
+        async def send_frames():
+            socket = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/')
+            socket.scope['user'] = self.user
+            await socket.connect()
+            replies = []
+            for i in range(2):
+                await socket.send_json_to({'type': 'message', 'recipient_id': self.other.id, 'message': f'WS {i}'})
+                replies.append(await socket.receive_json_from(timeout=5))
+            await socket.disconnect()
+            return replies
+
+        delivered, rejected = async_to_sync(send_frames)()
+        self.assertEqual(delivered['type'], 'message')
+        self.assertEqual(rejected['type'], 'error')
+        self.assertEqual(rejected['code'], 'rate_limited')
+        self.assertGreater(rejected['retry_after'], 90)
+
+        response = client.post('/api/chat/messages/', {'receiver_id': self.other.id, 'content': 'REST again'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 90)
@@ -0,0 +1,107 @@
+"""
+In-process cache of auth token key -> (user, token).
+
+Saves the token/user query that TokenAuthentication makes on every API
+request. Entries expire after AUTH_TOKEN_CACHE['TTL'] seconds and the
+least recently used are evicted beyond MAX_SIZE. Logout, token deletion
+and changes to the user drop their entries in this process; the TTL
+bounds how long another worker process may keep serving a stale entry.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AUTH_TOKEN_CACHE', {})}
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        # user pk -> their cached keys, so dropping a user doesn't scan the cache
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return ``(user, token)`` for ``key``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= self.clock():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        user, token, expires = entry
+        # Requests may mutate request.user, so each gets its own instance
+        return copy.copy(user), token
+
+    def set(self, key, user, token):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user, token, self.clock() + self.ttl)
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in self._keys_by_user.get(user_id, set()).copy():
+                self._remove(key)
+
+    def _remove(self, key):
+        user, token, expires = self._entries.pop(key)
+        keys = self._keys_by_user[user.pk]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_user[user.pk]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Return the process-wide cache, or None when AUTH_TOKEN_CACHE disables it."""
+    global _cache
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TokenCache(config['MAX_SIZE'], config['TTL'])
+    return _cache
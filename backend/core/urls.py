@@ -1,17 +1,10 @@
 from django.urls import path, include
-from rest_framework.routers import DefaultRouter
-from .views import UserSignUpViewSet, CustomAuthTokenLoginView, UserLogoutView
+from .views import UserSignUpView, CustomAuthTokenLoginView, UserLogoutView, UserSearchView
 
-# Create a router and register our viewsets with it.
-router = DefaultRouter()
-router.register(r'signup', UserSignUpViewSet, basename='signup')
-
-
-# The API URLs are now determined automatically by the router.
-# We also add custom paths for login and logout.
+# Signup and login are async views that hash passwords in core.hashing's pool.
 urlpatterns = [
     # Signup URL (e.g., POST /api/signup/)
-    path('', include(router.urls)),
+    path('signup/', UserSignUpView.as_view(), name='api-signup'),
     
     # Login URL (e.g., POST /api/login/)
     path('login/', CustomAuthTokenLoginView.as_view(), name='api-login'),
@@ -19,6 +12,9 @@ urlpatterns = [
     # Logout URL (e.g., POST /api/logout/)
     path('logout/', UserLogoutView.as_view(), name='api-logout'),
     
+    # User search URL (e.g., GET /api/users/search/?q=ali)
+    path('users/search/', UserSearchView.as_view(), name='api-user-search'),
+    
     # Chat URLs
     path('chat/', include('chat.urls')),
 ]
\ No newline at end of file
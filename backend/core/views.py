@@ -1,92 +1,145 @@
-from rest_framework import viewsets, mixins, status
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import IsAuthenticated
+from .authentication import AUTH_COOKIE, set_auth_cookie
+from .hashing import HashingPoolFull, amake_password, averify_password
 from .models import User
+from .search import search_users, DEFAULT_LIMIT, MAX_LIMIT
 from .serializers import UserSerializer, CustomAuthTokenSerializer
+from .token_cache import get_token_cache
 
-class UserSignUpViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
+def request_data(request):
+    """The JSON or form body of a plain Django request, or None if it isn't valid JSON."""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+def hashing_busy_response():
+    return JsonResponse(
+        {'detail': "Too many logins and sign-ups in progress; please retry shortly."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'},
+    )
+
+
+def create_account(validated_data, password_hash):
+    user = User.objects.create_user_with_hash(
+        email=validated_data['email'],
+        password_hash=password_hash,
+        first_name=validated_data.get('first_name', ''),
+        last_name=validated_data.get('last_name', ''),
+    )
+    token, created = Token.objects.get_or_create(user=user)
+    return user, token
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserSignUpView(View):
     """
-    A ViewSet for user registration (sign up).
+    A view for user registration (sign up).
     
-    Provides a 'create' action:
+    Provides an action:
     POST /api/signup/
+
+    Async, so the password is hashed in the hashing pool while this
+    worker keeps serving other requests.
     """
-    queryset = User.objects.all()
-    serializer_class = UserSerializer
-    permission_classes = [AllowAny] # Anyone can sign up
 
-    def create(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         """
         Handle user creation. On success, also generate and return an auth token.
         """
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = serializer.save()
-        
-        # Generate token for the new user
-        token, created = Token.objects.get_or_create(user=user)
-        
-        headers = self.get_success_headers(serializer.data)
-        
-        headers = self.get_success_headers(serializer.data)
-        
-        response = Response(
+        data = request_data(request)
+        if data is None:
+            return JsonResponse({'detail': "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = UserSerializer(data=data)
+        # The email uniqueness check queries the database
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            password_hash = await amake_password(serializer.validated_data['password'])
+        except HashingPoolFull:
+            return hashing_busy_response()
+        user, token = await sync_to_async(create_account)(serializer.validated_data, password_hash)
+
+        response = JsonResponse(
             {
-                'user': serializer.data,
+                'user': UserSerializer(user).data,
                 'token': token.key
             },
             status=status.HTTP_201_CREATED,
-            headers=headers
-        )
-        # Set HttpOnly cookie
-        response.set_cookie(
-            'auth_token',
-            token.key,
-            httponly=True,
-            samesite='Lax',
-            secure=False,  # Set to True in production
-            max_age=3600 * 24 * 7  # 1 week
         )
+        set_auth_cookie(response, token.key)
         return response
 
-class CustomAuthTokenLoginView(ObtainAuthToken):
+@method_decorator(csrf_exempt, name='dispatch')
+class CustomAuthTokenLoginView(View):
     """
     A view for user login.
     
     Provides an action:
     POST /api/login/
     
-    Returns a token on successful login.
+    Returns a token on successful login. Async, so checking the password
+    runs in the hashing pool while this worker keeps serving other requests.
     """
-    permission_classes = [AllowAny] # Anyone can try to log in
 
-    serializer_class = CustomAuthTokenSerializer
+    async def post(self, request, *args, **kwargs):
+        data = request_data(request)
+        if data is None:
+            return JsonResponse({'detail': "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = CustomAuthTokenSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def post(self, request, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data,
-                                           context={'request': request})
-        serializer.is_valid(raise_exception=True)
-        user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
-        response = Response({
+        try:
+            user = await self.authenticate(serializer.validated_data['email'], serializer.validated_data['password'])
+        except HashingPoolFull:
+            return hashing_busy_response()
+        if user is None:
+            return JsonResponse(
+                {'non_field_errors': ['Unable to log in with provided credentials.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        token, created = await Token.objects.aget_or_create(user=user)
+        response = JsonResponse({
             'token': token.key,
             'user_id': user.pk,
             'email': user.email
         })
-        # Set HttpOnly cookie
-        response.set_cookie(
-            'auth_token',
-            token.key,
-            httponly=True,
-            samesite='Lax',
-            secure=False,  # Set to True in production
-            max_age=3600 * 24 * 7  # 1 week
-        )
+        set_auth_cookie(response, token.key)
         return response
 
+    async def authenticate(self, email, password):
+        """What ModelBackend.authenticate does, with the hashing in the pool."""
+        user = await User.objects.filter(email=email).afirst()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            await amake_password(password)
+            return None
+        matches, needs_rehash = await averify_password(password, user.password)
+        if not matches or not user.is_active:
+            return None
+        if needs_rehash:
+            # Hasher settings changed since this password was stored
+            user.password = await amake_password(password)
+            await sync_to_async(user.save)(update_fields=['password'])
+        return user
+
 class UserLogoutView(APIView):
     """
     A view for user logout.
@@ -101,15 +154,46 @@ class UserLogoutView(APIView):
     def post(self, request, *args, **kwargs):
         try:
             # Delete the token to log the user out
-            request.user.auth_token.delete()
+            token = request.user.auth_token
+            token.delete()
+            cache = get_token_cache()
+            if cache is not None:
+                cache.invalidate(token.key)
             response = Response(
                 {"detail": "Successfully logged out."},
                 status=status.HTTP_200_OK
             )
-            response.delete_cookie('auth_token')
+            response.delete_cookie(AUTH_COOKIE)
             return response
         except Exception as e:
             return Response(
                 {"detail": "Error logging out: {}".format(str(e))},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+class UserSearchView(APIView):
+    """
+    Typeahead search over users' names and emails.
+
+    GET /api/users/search/?q=<text>&offset=<n>&limit=<n>
+
+    Returns the best matches first, with ``next_offset`` set when there are more.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        offset = max(0, self._int_param('offset', 0))
+        limit = max(1, min(self._int_param('limit', DEFAULT_LIMIT), MAX_LIMIT))
+
+        users, has_more = search_users(query, exclude_user_id=request.user.id, offset=offset, limit=limit)
+        return Response({
+            'results': UserSerializer(users, many=True).data,
+            'next_offset': offset + limit if has_more else None,
+        })
+
+    def _int_param(self, name, default):
+        try:
+            return int(self.request.query_params.get(name, default))
+        except ValueError:
+            return default
@@ -1,6 +1,5 @@
 from django.urls import path, include
-from django.contrib.auth import views as auth_views
-from .web_views import home_view, signup_view # Import the new view
+from .web_views import home_view, signup_view, TokenLoginView, TokenLogoutView # Import the new view
 from .forms import EmailAuthenticationForm # Our custom form
 
 urlpatterns = [
@@ -8,13 +7,13 @@ urlpatterns = [
     path('', home_view, name='web-home'),
     
     # Login view
-    path('login/', auth_views.LoginView.as_view(
+    path('login/', TokenLoginView.as_view(
         template_name='core/registration/login.html',
         authentication_form=EmailAuthenticationForm # Use our custom form
     ), name='web-login'),
     
     # Logout view
-    path('logout/', auth_views.LogoutView.as_view(
+    path('logout/', TokenLogoutView.as_view(
         template_name='core/registration/logged_out.html'
     ), name='web-logout'),
 
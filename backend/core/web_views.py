@@ -1,7 +1,12 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
 from django.contrib.auth import login
+from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
+from rest_framework.authtoken.models import Token
+from .authentication import AUTH_COOKIE, set_auth_cookie
 from .forms import UserRegistrationForm # Import the new form
+from .hashing import HashingPoolFull, amake_password
 
 @login_required
 def home_view(request):
@@ -16,22 +21,62 @@ def home_view(request):
     }
     return render(request, 'core/registration/home.html', context)
 # --- NEW SIGNUP VIEW ---
-def signup_view(request):
+async def signup_view(request):
     """
     Handle user registration.
+
+    Async so the password is hashed in core.hashing's pool; the sync steps
+    around it (form validation, session login, rendering) run in a thread.
     """
-    if request.user.is_authenticated:
+    if await sync_to_async(lambda: request.user.is_authenticated)():
         return redirect('web-home') # Already logged in, redirect to home
 
+    status = 200
     if request.method == 'POST':
         form = UserRegistrationForm(request.POST)
-        if form.is_valid():
-            user = form.save()
-            # Log the user in directly
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-            return redirect('web-home') # Redirect to home page
+        if await sync_to_async(form.is_valid)():
+            try:
+                password_hash = await amake_password(form.cleaned_data['password'])
+            except HashingPoolFull:
+                form.add_error(None, "We're handling a lot of sign-ups right now. Please try again in a moment.")
+                status = 503
+            else:
+                return await sync_to_async(complete_signup)(request, form, password_hash)
     else:
         form = UserRegistrationForm()
         
-    return render(request, 'core/registration/signup.html', {'form': form})
+    return await sync_to_async(render)(request, 'core/registration/signup.html', {'form': form}, status=status)
+
+def complete_signup(request, form, password_hash):
+    user = form.save(password_hash=password_hash)
+    # Log the user in directly
+    login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+    response = redirect('web-home') # Redirect to home page
+    token, created = Token.objects.get_or_create(user=user)
+    set_auth_cookie(response, token.key)
+    return response
+
+class TokenLoginView(auth_views.LoginView):
+    """
+    Session login that also sets the auth_token cookie, so the pages'
+    WebSockets and API calls authenticate the same way as the API clients.
+    """
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        token, created = Token.objects.get_or_create(user=form.get_user())
+        set_auth_cookie(response, token.key)
+        return response
+
+class TokenLogoutView(auth_views.LogoutView):
+    """Session logout that also revokes the user's token, like POST /api/logout/."""
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        response = super().post(request, *args, **kwargs)
+        if user.is_authenticated:
+            # Deleting the token drops it from the token cache too
+            Token.objects.filter(user=user).delete()
+        response.delete_cookie(AUTH_COOKIE)
+        return response
 
+    # RemovedInDjango50Warning: LogoutView still accepts GET
+    get = post
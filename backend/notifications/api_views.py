@@ -2,24 +2,46 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import Notification
-from .serializers import NotificationSerializer
+from .models import Notification, NotificationCounter, NotificationPreference
+from .pagination import NotificationCursorPagination
+from .serializers import NotificationPreferenceSerializer, NotificationSerializer
 
 class NotificationViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificationCursorPagination
 
     def get_queryset(self):
         return Notification.objects.filter(recipient=self.request.user)
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request is not None and self.request.user.is_authenticated:
+            context['read_up_to'] = NotificationCounter.objects.read_up_to(self.request.user.id)
+        return context
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        NotificationCounter.objects.mark_read(notification)
         return Response({'status': 'marked as read'})
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        self.get_queryset().update(is_read=True)
+        NotificationCounter.objects.mark_all_read(request.user.id)
         return Response({'status': 'all marked as read'})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        count = NotificationCounter.objects.unread_counts([request.user.id])[request.user.id]
+        return Response({'unread_count': count})
+
+    @action(detail=False, methods=['get', 'patch'], serializer_class=NotificationPreferenceSerializer)
+    def preferences(self, request):
+        preference = NotificationPreference.objects.filter(user=request.user).first() or NotificationPreference(user=request.user)
+        if request.method == 'GET':
+            return Response(NotificationPreferenceSerializer(preference).data)
+        serializer = NotificationPreferenceSerializer(preference, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
@@ -0,0 +1,70 @@
+"""
+Merging bursts of similar notifications into one.
+
+Outbox rows with a ``source`` coalesce by (recipient, type, source): a batch
+of them becomes a single notification with a ``count``, and while the
+recipient hasn't read it yet, later events within COALESCING['WINDOW']
+seconds of it are folded into the same row instead of adding new ones.
+"""
+import datetime
+from django.conf import settings
+from django.utils import timezone
+from .models import Notification, NotificationCounter
+
+DEFAULTS = {
+    # Seconds after a notification is created during which it absorbs similar events
+    'WINDOW': 300,
+}
+
+# Content of a notification standing for more than one event
+COALESCED_CONTENT = {
+    'message': "{name} sent you {count} messages.",
+    'friend_request': "{name} sent you {count} friend requests.",
+    'general': "{name}: {count} new notifications.",
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATION_COALESCING', {})}
+
+
+def coalesce_key(row):
+    """The (recipient, type, source) a row merges on, or None if it stands alone."""
+    if row.source_id is None or row.dedupe_key:
+        return None
+    return (row.recipient_id, row.notification_type, row.source_id)
+
+
+def coalesced_content(notification_type, source, count, single_content):
+    if count == 1:
+        return single_content
+    template = COALESCED_CONTENT.get(notification_type, COALESCED_CONTENT['general'])
+    return template.format(name=source.first_name if source else "Someone", count=count)
+
+
+def mergeable_notifications(keys, window=None):
+    """
+    Map each (recipient, type, source) key to the newest notification that
+    can still absorb events: unread, below no read watermark, and created
+    within the window. The rows are locked for the rest of the transaction.
+    """
+    if not keys:
+        return {}
+    window = get_config()['WINDOW'] if window is None else window
+    recipients = {recipient_id for recipient_id, notification_type, source_id in keys}
+    watermarks = dict(NotificationCounter.objects.filter(user_id__in=recipients).values_list('user_id', 'read_up_to_id'))
+    candidates = Notification.objects.select_for_update().filter(
+        recipient_id__in=recipients,
+        source_id__in={source_id for recipient_id, notification_type, source_id in keys},
+        notification_type__in={notification_type for recipient_id, notification_type, source_id in keys},
+        is_read=False,
+        dedupe_key__isnull=True,
+        created_at__gte=timezone.now() - datetime.timedelta(seconds=window),
+    ).order_by('-id')
+
+    merged = {}
+    for notification in candidates:
+        key = (notification.recipient_id, notification.notification_type, notification.source_id)
+        if key in keys and key not in merged and notification.id > watermarks.get(notification.recipient_id, 0):
+            merged[key] = notification
+    return merged
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from notifications.outbox import DEFAULT_BATCH_SIZE, drain_all
+
+
+class Command(BaseCommand):
+    help = "Create queued notifications from the outbox in batches, and periodically deliver digests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Outbox rows handled per transaction.")
+        parser.add_argument('--loop', action='store_true', help="Keep draining until interrupted.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep between passes with --loop.")
+        parser.add_argument('--digest', action='store_true', help="Deliver the notifications held for digest users and exit.")
+        parser.add_argument(
+            '--digest-interval', type=float, default=3600.0,
+            help="Seconds between digest deliveries with --loop; 0 leaves them to a separate --digest run.",
+        )
+
+    def handle(self, *args, **options):
+        if options['digest']:
+            created = drain_all(batch_size=options['batch_size'], digest=True)
+            self.stdout.write(f"Created {created} digest notifications.")
+            return
+
+        next_digest = time.monotonic() + options['digest_interval']
+        while True:
+            created = drain_all(batch_size=options['batch_size'])
+            if created or not options['loop']:
+                self.stdout.write(f"Created {created} notifications.")
+            if not options['loop']:
+                return
+            if options['digest_interval'] and time.monotonic() >= next_digest:
+                created = drain_all(batch_size=options['batch_size'], digest=True)
+                self.stdout.write(f"Created {created} digest notifications.")
+                next_digest = time.monotonic() + options['digest_interval']
+            time.sleep(options['interval'])
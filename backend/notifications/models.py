@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Max
 from django.conf import settings
 
 class Notification(models.Model):
@@ -9,13 +10,123 @@ class Notification(models.Model):
     )
 
     recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
+    # The user whose actions this is about; same-type notifications from one source coalesce
+    source = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     notification_type = models.CharField(max_length=20, choices=TYPES, default='general')
     content = models.TextField()
+    # How many events this notification stands for
+    count = models.PositiveIntegerField(default=1)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event must only ever notify once, e.g. "friend_accepted:<friendship id>"
+    dedupe_key = models.CharField(max_length=100, null=True, blank=True, unique=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The inbox pages through a user's notifications newest first
+            models.Index(fields=['recipient', 'created_at'], name='notif_recipient_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} for {self.recipient}: {self.content}"
+
+class NotificationCounterManager(models.Manager):
+    def add_unread(self, counts):
+        """Add ``{user_id: n}`` new unread notifications to the users' counters."""
+        by_amount = {}
+        for user_id, amount in counts.items():
+            if amount:
+                by_amount.setdefault(amount, []).append(user_id)
+
+        for amount, user_ids in by_amount.items():
+            updated = self.filter(user_id__in=user_ids).update(unread_count=F('unread_count') + amount)
+            if updated == len(user_ids):
+                continue
+            # First notification for some of these users
+            missing = set(user_ids) - set(self.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+            try:
+                with transaction.atomic():
+                    self.bulk_create([NotificationCounter(user_id=user_id, unread_count=amount) for user_id in missing])
+            except IntegrityError:
+                # Another writer created them first
+                self.filter(user_id__in=missing).update(unread_count=F('unread_count') + amount)
+
+    def mark_read(self, notification):
+        """Mark one notification read, keeping the counter in step."""
+        if notification.is_read or notification.id <= self.read_up_to(notification.recipient_id):
+            return
+        Notification.objects.filter(id=notification.id).update(is_read=True)
+        notification.is_read = True
+        self.filter(user_id=notification.recipient_id, unread_count__gt=0).update(unread_count=F('unread_count') - 1)
+
+    def mark_all_read(self, user_id):
+        """
+        Mark everything the user has been sent so far as read.
+
+        Moves the user's read watermark to the newest notification id rather
+        than touching their notifications, so it costs the same however many
+        are unread.
+        """
+        latest_id = Notification.objects.aggregate(latest=Max('id'))['latest'] or 0
+        if not self.filter(user_id=user_id).update(read_up_to_id=latest_id, unread_count=0):
+            self.get_or_create(user_id=user_id, defaults={'read_up_to_id': latest_id})
+
+    def unread_counts(self, user_ids):
+        counts = {user_id: 0 for user_id in user_ids}
+        counts.update(self.filter(user_id__in=user_ids).values_list('user_id', 'unread_count'))
+        return counts
+
+    def read_up_to(self, user_id):
+        return self.filter(user_id=user_id).values_list('read_up_to_id', flat=True).first() or 0
+
+class NotificationCounter(models.Model):
+    """
+    Per-user unread count, kept up to date as notifications are created and
+    read, plus the read watermark: every notification with an id up to
+    ``read_up_to_id`` counts as read whatever its ``is_read`` says.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    unread_count = models.PositiveIntegerField(default=0)
+    read_up_to_id = models.BigIntegerField(default=0)
+
+    objects = NotificationCounterManager()
+
+    def __str__(self):
+        return f"{self.unread_count} unread for {self.user_id}"
+
+class NotificationPreference(models.Model):
+    """
+    How a user wants to be notified. With ``digest`` on, their notifications
+    are held in the outbox and delivered, coalesced, by the periodic digest
+    pass instead of as they happen.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    digest = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{'Digest' if self.digest else 'Real-time'} notifications for {self.user_id}"
+
+class NotificationOutbox(models.Model):
+    """
+    Notifications waiting to be created by ``manage.py drain_notifications``.
+
+    Rows are written in the same transaction as the change that caused them,
+    so the request path only pays for one small INSERT.
+    """
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    source = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    notification_type = models.CharField(max_length=20, choices=Notification.TYPES, default='general')
+    content = models.TextField()
+    dedupe_key = models.CharField(max_length=100, null=True, blank=True)
+    # Set for recipients in digest mode; only the digest pass delivers these
+    held = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['held', 'id'], name='notif_outbox_held_idx'),
+        ]
+
+    def __str__(self):
+        return f"Pending {self.notification_type} for {self.recipient_id}"
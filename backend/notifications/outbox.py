@@ -0,0 +1,152 @@
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from .coalesce import coalesce_key, coalesced_content, mergeable_notifications
+from .models import Notification, NotificationCounter, NotificationOutbox, NotificationPreference
+from .push import push_notifications
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 500
+
+# Consecutive dedupe races drain_all retries before giving up
+MAX_CONFLICT_RETRIES = 3
+
+
+def enqueue(recipient_id, notification_type, content, dedupe_key=None, source_id=None):
+    """Queue a notification; call inside the transaction that caused it."""
+    return NotificationOutbox.objects.create(
+        recipient_id=recipient_id,
+        source_id=source_id,
+        notification_type=notification_type,
+        content=content,
+        dedupe_key=dedupe_key,
+    )
+
+
+def enqueue_many(entries):
+    """Queue several ``enqueue()`` keyword dicts with one INSERT."""
+    return NotificationOutbox.objects.bulk_create([NotificationOutbox(**entry) for entry in entries])
+
+
+def drain_outbox(batch_size=DEFAULT_BATCH_SIZE, digest=False):
+    """
+    Turn up to ``batch_size`` queued rows into notifications.
+
+    Rows whose ``dedupe_key`` already has a notification are dropped, found
+    with one lookup of the unique key. Rows from the same source coalesce
+    into one notification, or into a recent unread one (see ``coalesce``).
+    Rows for users in digest mode are set aside as held; ``digest=True``
+    drains those instead. Returns the created notifications.
+
+    Concurrent drainers skip each other's locked rows where the database
+    supports it; if two of them still race on a key, the loser's batch
+    rolls back with IntegrityError (``drain_all`` retries it). Once
+    committed, new and updated notifications are pushed to their
+    recipients' sockets.
+    """
+    return _drain_batch(batch_size, digest)[1]
+
+
+def _drain_batch(batch_size, digest):
+    # Returns (rows locked, notifications created)
+    with transaction.atomic():
+        rows = list(NotificationOutbox.objects.select_for_update(skip_locked=True).filter(held=digest).order_by('id')[:batch_size])
+        if not rows:
+            return 0, []
+        locked = len(rows)
+        drained_ids = [row.id for row in rows]
+
+        if not digest:
+            digest_users = set(NotificationPreference.objects.filter(
+                user_id__in={row.recipient_id for row in rows}, digest=True,
+            ).values_list('user_id', flat=True))
+            if digest_users:
+                held_ids = [row.id for row in rows if row.recipient_id in digest_users]
+                NotificationOutbox.objects.filter(id__in=held_ids).update(held=True)
+                rows = [row for row in rows if row.recipient_id not in digest_users]
+                drained_ids = [row.id for row in rows]
+
+        keys = {row.dedupe_key for row in rows if row.dedupe_key}
+        seen = set(Notification.objects.filter(dedupe_key__in=keys).values_list('dedupe_key', flat=True)) if keys else set()
+        # Standalone rows, and lists of rows sharing a coalesce key, in outbox order
+        entries = []
+        groups = {}
+        for row in rows:
+            if row.dedupe_key:
+                if row.dedupe_key in seen:
+                    continue
+                seen.add(row.dedupe_key)
+            key = coalesce_key(row)
+            if key is None:
+                entries.append(row)
+            elif key in groups:
+                groups[key].append(row)
+            else:
+                groups[key] = [row]
+                entries.append(groups[key])
+
+        targets = mergeable_notifications(set(groups))
+        sources = User.objects.only('id', 'first_name').in_bulk(
+            {key[2] for key, group in groups.items() if len(group) > 1 or key in targets}
+        )
+        notifications = []
+        merged = []
+        for entry in entries:
+            if isinstance(entry, NotificationOutbox):
+                notifications.append(Notification(
+                    recipient_id=entry.recipient_id,
+                    source_id=entry.source_id,
+                    notification_type=entry.notification_type,
+                    content=entry.content,
+                    dedupe_key=entry.dedupe_key,
+                ))
+                continue
+            first, count = entry[0], len(entry)
+            target = targets.get(coalesce_key(first))
+            if target is not None:
+                target.count += count
+                target.content = coalesced_content(target.notification_type, sources.get(target.source_id), target.count, target.content)
+                merged.append(target)
+                continue
+            notifications.append(Notification(
+                recipient_id=first.recipient_id,
+                source_id=first.source_id,
+                notification_type=first.notification_type,
+                content=coalesced_content(first.notification_type, sources.get(first.source_id), count, first.content),
+                count=count,
+            ))
+
+        created = Notification.objects.bulk_create(notifications)
+        if merged:
+            Notification.objects.bulk_update(merged, ['count', 'content'])
+        # Merged notifications were already unread, so only new ones count
+        NotificationCounter.objects.add_unread(Counter(n.recipient_id for n in created))
+        NotificationOutbox.objects.filter(id__in=drained_ids).delete()
+    push_notifications(created + merged)
+    return locked, created
+
+
+def drain_all(batch_size=DEFAULT_BATCH_SIZE, digest=False):
+    """
+    Drain until a pass finds no rows to lock: the outbox is empty, or what
+    is left belongs to another drainer. Returns the number of notifications
+    created.
+
+    A batch that loses a dedupe race is retried; by then the winner's
+    notification exists, so the retry drops the duplicate row.
+    """
+    total = 0
+    conflicts = 0
+    while True:
+        try:
+            locked, created = _drain_batch(batch_size, digest)
+        except IntegrityError:
+            conflicts += 1
+            if conflicts > MAX_CONFLICT_RETRIES:
+                raise
+            continue
+        conflicts = 0
+        if not locked:
+            return total
+        total += len(created)
@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+class NotificationCursorPagination(CursorPagination):
+    """Newest first, walking the (recipient, created_at) index."""
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = '-created_at'
@@ -0,0 +1,41 @@
+"""
+Real-time delivery of notifications over the chat WebSocket.
+
+Notifications go to the same per-user group as chat messages, so every
+socket a user has open on ``ws/chat/`` receives them. Run the drainer
+against a channel layer shared with the web workers (see
+CHANNEL_BROKER_SOCKET) for pushes to reach them.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from chat.consumers import user_group_name
+from .models import Notification, NotificationCounter
+from .serializers import NotificationSerializer
+
+# Most notifications replayed to a reconnecting socket
+BACKLOG_LIMIT = 100
+
+
+def notification_backlog(user_id, since_id):
+    """The frame a socket resuming from ``since_id`` is sent, oldest first."""
+    notifications = Notification.objects.filter(recipient_id=user_id, id__gt=since_id).order_by('id')[:BACKLOG_LIMIT]
+    context = {'read_up_to': NotificationCounter.objects.read_up_to(user_id)}
+    return {
+        'type': 'notifications',
+        'notifications': [dict(NotificationSerializer(n, context=context).data) for n in notifications],
+        'unread_count': NotificationCounter.objects.unread_counts([user_id])[user_id],
+    }
+
+
+def push_notifications(notifications):
+    """Send freshly created notifications, with unread counts, to their recipients."""
+    channel_layer = get_channel_layer()
+    if not notifications or channel_layer is None:
+        return
+    counts = NotificationCounter.objects.unread_counts({n.recipient_id for n in notifications})
+    for notification in notifications:
+        async_to_sync(channel_layer.group_send)(user_group_name(notification.recipient_id), {
+            'type': 'notification_created',
+            'notification': dict(NotificationSerializer(notification).data),
+            'unread_count': counts[notification.recipient_id],
+        })
@@ -1,8 +1,19 @@
 from rest_framework import serializers
-from .models import Notification
+from .models import Notification, NotificationPreference
 
 class NotificationSerializer(serializers.ModelSerializer):
+    is_read = serializers.SerializerMethodField()
+
     class Meta:
         model = Notification
-        fields = ['id', 'notification_type', 'content', 'is_read', 'created_at']
-        read_only_fields = ['id', 'notification_type', 'content', 'created_at']
+        fields = ['id', 'notification_type', 'source', 'content', 'count', 'is_read', 'created_at']
+        read_only_fields = ['id', 'notification_type', 'source', 'content', 'count', 'created_at']
+
+    def get_is_read(self, obj):
+        # Everything up to the recipient's read watermark counts as read
+        return obj.is_read or obj.id <= self.context.get('read_up_to', 0)
+
+class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificationPreference
+        fields = ['digest']
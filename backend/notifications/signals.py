@@ -1,28 +1,50 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from chat.models import Friendship
-from .models import Notification
+from chat.signals import messages_stored
+from .models import Notification, NotificationCounter
+from .outbox import enqueue, enqueue_many
 
 @receiver(post_save, sender=Friendship)
 def create_friendship_notification(sender, instance, created, **kwargs):
+    # Queued in the outbox; `manage.py drain_notifications` creates the notifications
     if created:
         # New friend request
-        Notification.objects.create(
-            recipient=instance.receiver,
-            notification_type='friend_request',
-            content=f"{instance.sender.first_name} sent you a friend request."
+        enqueue(
+            instance.receiver_id,
+            'friend_request',
+            f"{instance.sender.first_name} sent you a friend request.",
+            dedupe_key=f"friend_request:{instance.id}",
+            source_id=instance.sender_id,
         )
     elif instance.status == Friendship.ACCEPTED:
         # Friend request accepted
         # Notify the sender of the request that it was accepted
-        # Avoid duplicate notifications if saved multiple times
-        if not Notification.objects.filter(
-            recipient=instance.sender,
-            notification_type='friend_request',
-            content__contains="accepted"
-        ).exists():
-             Notification.objects.create(
-                recipient=instance.sender,
-                notification_type='friend_request',
-                content=f"{instance.receiver.first_name} accepted your friend request."
-            )
+        # The dedupe key keeps repeated saves from notifying twice
+        enqueue(
+            instance.sender_id,
+            'friend_request',
+            f"{instance.receiver.first_name} accepted your friend request.",
+            dedupe_key=f"friend_accepted:{instance.id}",
+            source_id=instance.receiver_id,
+        )
+
+@receiver(messages_stored)
+def create_message_notifications(sender, messages, **kwargs):
+    # One outbox row per message; the drainer coalesces a burst from one sender
+    enqueue_many([
+        {
+            'recipient_id': message.receiver_id,
+            'source_id': message.sender_id,
+            'notification_type': 'message',
+            'content': f"{message.sender.first_name} sent you a message.",
+        }
+        for message in messages
+        if message.sender_id != message.receiver_id
+    ])
+
+@receiver(post_save, sender=Notification)
+def count_unread_notification(sender, instance, created, **kwargs):
+    # Notifications made one at a time; the outbox drainer counts its own batches
+    if created and not instance.is_read:
+        NotificationCounter.objects.add_unread({instance.recipient_id: 1})
@@ -1,8 +1,17 @@
-from django.test import TestCase
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import IntegrityError
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
+from chat.group_commit import write_messages
 from chat.models import Friendship
-from .models import Notification
+from chat.routing import websocket_urlpatterns
+from .models import Notification, NotificationCounter, NotificationOutbox, NotificationPreference
+from .outbox import drain_all, enqueue
 
 User = get_user_model()
 
@@ -20,6 +29,7 @@ class NotificationTest(TestCase):
     def test_friend_request_notification(self):
         # User A sends friend request to User B
         Friendship.objects.create(sender=self.user_a, receiver=self.user_b, status=Friendship.PENDING)
+        drain_all()
         
         # Check if User B got a notification
         notifications = Notification.objects.filter(recipient=self.user_b)
@@ -34,6 +44,7 @@ class NotificationTest(TestCase):
         # User B accepts
         friendship.status = Friendship.ACCEPTED
         friendship.save()
+        drain_all()
         
         # Check if User A got a notification
         notifications = Notification.objects.filter(recipient=self.user_a)
@@ -47,8 +58,8 @@ class NotificationTest(TestCase):
         
         response = self.client_a.get('/api/notifications/')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['content'], "Test Notification")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['content'], "Test Notification")
 
     def test_api_mark_read(self):
         notif = Notification.objects.create(recipient=self.user_a, content="Test Notification")
@@ -58,3 +69,209 @@ class NotificationTest(TestCase):
         
         notif.refresh_from_db()
         self.assertTrue(notif.is_read)
+
+    def test_notifications_wait_in_outbox_until_drained(self):
+        Friendship.objects.create(sender=self.user_a, receiver=self.user_b, status=Friendship.PENDING)
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+        self.assertFalse(Notification.objects.exists())
+
+        self.assertEqual(drain_all(), 1)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_repeated_accept_notifies_once(self):
+        friendship = Friendship.objects.create(sender=self.user_a, receiver=self.user_b, status=Friendship.PENDING)
+        friendship.status = Friendship.ACCEPTED
+        friendship.save()
+        drain_all()
+        # Saved again later, e.g. from the admin
+        friendship.save()
+        friendship.save()
+
+        self.assertEqual(drain_all(), 0)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(Notification.objects.filter(recipient=self.user_a).count(), 1)
+
+    def test_api_pages_newest_first(self):
+        for i in range(25):
+            Notification.objects.create(recipient=self.user_a, content=f"Notification {i}")
+
+        response = self.client_a.get('/api/notifications/?limit=10')
+        self.assertEqual([n['content'] for n in response.data['results']], [f"Notification {i}" for i in range(24, 14, -1)])
+        seen = [n['id'] for n in response.data['results']]
+        while response.data['next']:
+            response = self.client_a.get(response.data['next'])
+            seen += [n['id'] for n in response.data['results']]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_unread_counter_follows_reads(self):
+        notifications = [Notification.objects.create(recipient=self.user_a, content=f"Notification {i}") for i in range(3)]
+        Friendship.objects.create(sender=self.user_b, receiver=self.user_a, status=Friendship.PENDING)
+        drain_all()
+        self.assertEqual(self.client_a.get('/api/notifications/unread_count/').data, {'unread_count': 4})
+
+        self.client_a.post(f'/api/notifications/{notifications[0].id}/mark_read/')
+        self.client_a.post(f'/api/notifications/{notifications[0].id}/mark_read/')
+        self.assertEqual(NotificationCounter.objects.unread_counts([self.user_a.id]), {self.user_a.id: 3})
+
+    def test_mark_all_read_moves_the_watermark(self):
+        for i in range(50):
+            Notification.objects.create(recipient=self.user_a, content=f"Notification {i}")
+        other = Notification.objects.create(recipient=self.user_b, content="Not yours")
+
+        # The latest id, then one counter UPDATE, however many are unread
+        with self.assertNumQueries(2):
+            self.client_a.post('/api/notifications/mark_all_read/')
+
+        response = self.client_a.get('/api/notifications/?limit=100')
+        self.assertTrue(all(n['is_read'] for n in response.data['results']))
+        self.assertEqual(self.client_a.get('/api/notifications/unread_count/').data, {'unread_count': 0})
+        self.assertEqual(self.client_b.get('/api/notifications/unread_count/').data, {'unread_count': 1})
+
+        # Already covered by the watermark, so the counter is left alone
+        self.client_a.post(f'/api/notifications/{response.data["results"][0]["id"]}/mark_read/')
+        newer = Notification.objects.create(recipient=self.user_a, content="Newer")
+        self.assertEqual(self.client_a.get('/api/notifications/unread_count/').data, {'unread_count': 1})
+        response = self.client_a.get('/api/notifications/')
+        self.assertFalse(response.data['results'][0]['is_read'])
+        self.assertEqual(response.data['results'][0]['id'], newer.id)
+        self.assertFalse(Notification.objects.get(id=other.id).is_read)
+
+class NotificationCoalescingTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email='alice@example.com', password='password123', first_name='Alice', last_name='A')
+        self.bob = User.objects.create_user(email='bob@example.com', password='password123', first_name='Bob', last_name='B')
+        self.carol = User.objects.create_user(email='carol@example.com', password='password123', first_name='Carol', last_name='C')
+
+        self.client_bob = APIClient()
+        self.client_bob.force_authenticate(user=self.bob)
+
+    def send_messages(self, sender, receiver, count):
+        write_messages([(sender.id, receiver.id, f"Msg {i}") for i in range(count)])
+
+    def test_burst_from_one_sender_is_one_notification(self):
+        self.send_messages(self.alice, self.bob, 12)
+        self.send_messages(self.carol, self.bob, 1)
+        self.assertEqual(drain_all(), 2)
+
+        response = self.client_bob.get('/api/notifications/')
+        self.assertEqual(
+            [(n['content'], n['count'], n['source']) for n in response.data['results']],
+            [("Carol sent you a message.", 1, self.carol.id), ("Alice sent you 12 messages.", 12, self.alice.id)],
+        )
+        self.assertEqual(self.client_bob.get('/api/notifications/unread_count/').data, {'unread_count': 2})
+
+    def test_later_events_fold_into_unread_notification(self):
+        self.send_messages(self.alice, self.bob, 1)
+        drain_all()
+        self.send_messages(self.alice, self.bob, 2)
+        self.assertEqual(drain_all(), 0)
+
+        notification = Notification.objects.get()
+        self.assertEqual((notification.count, notification.content), (3, "Alice sent you 3 messages."))
+        self.assertEqual(NotificationCounter.objects.unread_counts([self.bob.id]), {self.bob.id: 1})
+
+        # Once read, the next message starts a new notification
+        self.client_bob.post('/api/notifications/mark_all_read/')
+        self.send_messages(self.alice, self.bob, 1)
+        self.assertEqual(drain_all(), 1)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_window_bounds_coalescing(self):
+        self.send_messages(self.alice, self.bob, 1)
+        drain_all()
+        with self.settings(NOTIFICATION_COALESCING={'WINDOW': 0}):
+            self.send_messages(self.alice, self.bob, 1)
+            self.assertEqual(drain_all(), 1)
+        self.assertEqual(list(Notification.objects.values_list('count', flat=True)), [1, 1])
+
+    def test_friend_requests_are_never_merged(self):
+        Friendship.objects.send_invite(self.alice, self.bob)
+        Friendship.objects.send_invite(self.carol, self.bob)
+        self.assertEqual(drain_all(), 2)
+
+    def test_digest_holds_notifications_until_digest_pass(self):
+        response = self.client_bob.patch('/api/notifications/preferences/', {'digest': True}, format='json')
+        self.assertEqual(response.data, {'digest': True})
+
+        self.send_messages(self.alice, self.bob, 5)
+        self.send_messages(self.bob, self.alice, 1)
+        self.assertEqual(drain_all(), 1)
+        self.assertEqual(NotificationOutbox.objects.filter(held=True).count(), 5)
+        self.assertFalse(Notification.objects.filter(recipient=self.bob).exists())
+
+        self.assertEqual(drain_all(digest=True), 1)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(Notification.objects.get(recipient=self.bob).content, "Alice sent you 5 messages.")
+        self.assertTrue(NotificationPreference.objects.get(user=self.bob).digest)
+
+class OutboxDrainTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+
+    def test_dedupe_race_is_retried(self):
+        enqueue(self.user.id, 'general', "Welcome!", dedupe_key=f'welcome:{self.user.id}')
+        bulk_create = Notification.objects.bulk_create
+        calls = []
+
+        def lose_first_race(objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                raise IntegrityError("UNIQUE constraint failed: notifications_notification.dedupe_key")
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Notification.objects, 'bulk_create', side_effect=lose_first_race):
+            self.assertEqual(drain_all(), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(NotificationCounter.objects.unread_counts([self.user.id]), {self.user.id: 1})
+
+    def test_rows_locked_by_another_drainer_end_the_pass(self):
+        enqueue(self.user.id, 'general', "Welcome!")
+        # Every row is already locked elsewhere, so nothing can be claimed
+        with mock.patch.object(NotificationOutbox.objects, 'select_for_update', return_value=NotificationOutbox.objects.none()):
+            self.assertEqual(drain_all(), 0)
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+class NotificationPushTest(TransactionTestCase):
+    def setUp(self):
+        self.user_a = User.objects.create_user(email='user_a@example.com', password='password123', first_name='User', last_name='A')
+        self.user_b = User.objects.create_user(email='user_b@example.com', password='password123', first_name='User', last_name='B')
+
+    def communicator_for(self, user, path='/ws/chat/'):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_new_notifications_are_pushed(self):
+        async def exchange():
+            socket_b = self.communicator_for(self.user_b)
+            await socket_b.connect()
+            await database_sync_to_async(Friendship.objects.send_invite)(self.user_a, self.user_b)
+            await database_sync_to_async(drain_all)()
+            frame = await socket_b.receive_json_from(timeout=5)
+            await socket_b.disconnect()
+            return frame
+
+        frame = async_to_sync(exchange)()
+        self.assertEqual(frame['type'], 'notification')
+        self.assertIn('sent you a friend request', frame['notification']['content'])
+        self.assertEqual(frame['unread_count'], 1)
+
+    def test_reconnect_resumes_from_since_id(self):
+        seen = Notification.objects.create(recipient=self.user_b, content="Seen")
+        missed = Notification.objects.create(recipient=self.user_b, content="Missed")
+        Notification.objects.create(recipient=self.user_a, content="Someone else's")
+
+        async def reconnect():
+            socket_b = self.communicator_for(self.user_b, f'/ws/chat/?notifications_since={seen.id}')
+            await socket_b.connect()
+            frame = await socket_b.receive_json_from(timeout=5)
+            await socket_b.disconnect()
+            return frame
+
+        frame = async_to_sync(reconnect)()
+        self.assertEqual(frame['type'], 'notifications')
+        self.assertEqual([n['id'] for n in frame['notifications']], [missed.id])
+        self.assertEqual(frame['unread_count'], 2)